@@ -0,0 +1,219 @@
+import asyncio
+import os
+import threading
+from typing import Optional, List, Dict, Any, Tuple, Callable, Awaitable
+
+from .store import try_exclusive_lock
+
+# Limits applied to an environment's container, by profile name
+RESOURCE_PROFILES = {
+    "small": {"memory_mb": 1024, "cpus": 1.0, "pids": 512},
+    "medium": {"memory_mb": 2048, "cpus": 2.0, "pids": 1024},
+    "large": {"memory_mb": 4096, "cpus": 4.0, "pids": 2048},
+}
+DEFAULT_RESOURCE_PROFILE = os.environ.get("DEFAULT_RESOURCE_PROFILE", "small")
+# Host capacity environments may commit; 0 means derive it from the host
+ADMISSION_MEMORY_MB = int(os.environ.get("ADMISSION_MEMORY_MB", 0))
+ADMISSION_CPUS = float(os.environ.get("ADMISSION_CPUS", 0))
+# Memory kept back for the backend, the Docker daemon and the warm pool when deriving capacity
+HOST_RESERVED_MB = int(os.environ.get("HOST_RESERVED_MB", 2048))
+# CPU limits are ceilings rather than reservations, so some overcommit is safe
+CPU_OVERCOMMIT = float(os.environ.get("CPU_OVERCOMMIT", 2.0))
+CPU_PERIOD = 100000
+# Held by the one worker allowed to run against this data directory
+ADMISSION_LOCK_PATH = 'data/admission.lock'
+
+EnvironmentKey = Tuple[str, str]  # (project name, environment id)
+
+
+def host_memory_mb(field: str = "MemTotal") -> Optional[int]:
+    """A /proc/meminfo field (e.g. "MemTotal", "MemAvailable") in MB; None where unavailable."""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+def resolve_profile(name: Optional[str]) -> Dict[str, Any]:
+    """The named profile (the default one if `name` is empty); ValueError if unknown."""
+    name = name or DEFAULT_RESOURCE_PROFILE
+    if name not in RESOURCE_PROFILES:
+        raise ValueError(f"Unknown resource profile '{name}'. Available: {', '.join(RESOURCE_PROFILES)}.")
+    return dict(RESOURCE_PROFILES[name], name=name)
+
+
+def run_limits(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Keyword arguments for `containers.run`."""
+    memory = f"{profile['memory_mb']}m"
+    return {
+        "mem_limit": memory,
+        "memswap_limit": memory,  # No swap on top of the memory limit
+        "nano_cpus": int(profile["cpus"] * 1e9),
+        "pids_limit": profile["pids"],
+    }
+
+
+def update_limits(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Keyword arguments for `update_container`, which can't change the pids limit."""
+    memory = f"{profile['memory_mb']}m"
+    return {
+        "mem_limit": memory,
+        "memswap_limit": memory,
+        "cpu_period": CPU_PERIOD,
+        "cpu_quota": int(profile["cpus"] * CPU_PERIOD),
+    }
+
+
+# --- Admission Control ---
+
+class AdmissionController:
+    """Admits environment containers while their profiles fit the host.
+
+    Every running (or starting) environment commits its profile's memory and
+    CPUs. A request that doesn't fit waits in a FIFO queue; when capacity is
+    released the queue is drained in order and each admitted request's job
+    is run on the event loop. Newcomers never overtake the queue, so a large
+    environment can't be starved by a stream of small ones.
+
+    `release()` may be called from any thread (container events arrive on
+    their own).
+
+    Commitments and the queue (whose jobs are closures on this event loop)
+    live in process memory, so only one worker may admit environments for
+    a data directory; `claim_host()` enforces that at startup.
+    """
+
+    def __init__(self, memory_mb: int = ADMISSION_MEMORY_MB, cpus: float = ADMISSION_CPUS):
+        if memory_mb <= 0:
+            memory_mb = max((host_memory_mb() or 8192) - HOST_RESERVED_MB, 1024)
+        if cpus <= 0:
+            cpus = (os.cpu_count() or 2) * CPU_OVERCOMMIT
+        self.memory_mb = memory_mb
+        self.cpus = cpus
+        self._lock = threading.Lock()
+        self._committed: Dict[EnvironmentKey, Dict[str, Any]] = {}
+        self._queue: List[Dict[str, Any]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks = set()
+        self._host_lock = None
+
+    def claim_host(self, lock_path: str = ADMISSION_LOCK_PATH):
+        """Makes this process the only one admitting environments; RuntimeError if another already is."""
+        if self._host_lock is not None:
+            return
+        self._host_lock = try_exclusive_lock(lock_path)
+        if self._host_lock is None:
+            raise RuntimeError(
+                f"Another backend worker holds {lock_path}. Admission control and the warm pool "
+                "are per process, so run a single worker per data directory."
+            )
+
+    def _used(self) -> Tuple[int, float]:
+        return (
+            sum(profile["memory_mb"] for profile in self._committed.values()),
+            sum(profile["cpus"] for profile in self._committed.values()),
+        )
+
+    def _fits(self, profile: Dict[str, Any]) -> bool:
+        memory_mb, cpus = self._used()
+        return memory_mb + profile["memory_mb"] <= self.memory_mb and cpus + profile["cpus"] <= self.cpus
+
+    def admit(self, key: EnvironmentKey, profile: Dict[str, Any]) -> bool:
+        """Commits capacity for `key` if it fits now and nobody is queued ahead."""
+        if profile["memory_mb"] > self.memory_mb or profile["cpus"] > self.cpus:
+            raise ValueError(
+                f"Resource profile '{profile.get('name')}' exceeds the host's capacity "
+                f"({self.memory_mb} MB, {self.cpus:g} CPUs)."
+            )
+        with self._lock:
+            if key in self._committed:
+                return True
+            if self._queue or not self._fits(profile):
+                return False
+            self._committed[key] = profile
+            return True
+
+    def commit(self, key: EnvironmentKey, profile: Dict[str, Any]):
+        """Records an environment that is already running, whether or not it fits."""
+        with self._lock:
+            self._committed[key] = profile
+
+    def enqueue(self, key: EnvironmentKey, profile: Dict[str, Any], job: Callable[[], Awaitable[None]]) -> int:
+        """Queues `key`; `job` runs on this loop once admitted. Returns the 1-based position."""
+        self._loop = asyncio.get_running_loop()
+        with self._lock:
+            self._queue = [entry for entry in self._queue if entry["key"] != key]
+            self._queue.append({"key": key, "profile": profile, "job": job})
+            position = len(self._queue)
+        print(f"Environment {key[0]}/{key[1]} queued for admission at position {position}")
+        # Capacity may have been released while the caller was deciding to queue
+        self._drain()
+        return self.position(key) or 0
+
+    def position(self, key: EnvironmentKey) -> Optional[int]:
+        with self._lock:
+            for index, entry in enumerate(self._queue):
+                if entry["key"] == key:
+                    return index + 1
+        return None
+
+    def cancel(self, key: EnvironmentKey) -> bool:
+        """Removes `key` from the queue; True if it was queued."""
+        with self._lock:
+            remaining = [entry for entry in self._queue if entry["key"] != key]
+            cancelled = len(remaining) != len(self._queue)
+            self._queue = remaining
+        if cancelled:
+            self._drain()  # The head of the queue may fit now
+        return cancelled
+
+    def release(self, key: EnvironmentKey):
+        """Frees the capacity committed for `key` and admits whoever now fits."""
+        with self._lock:
+            released = self._committed.pop(key, None)
+        if released is not None:
+            self._drain()
+
+    def _drain(self):
+        admitted = []
+        with self._lock:
+            while self._queue and self._fits(self._queue[0]["profile"]):
+                entry = self._queue.pop(0)
+                self._committed[entry["key"]] = entry["profile"]
+                admitted.append(entry)
+        loop = self._loop
+        for entry in admitted:
+            print(f"Environment {entry['key'][0]}/{entry['key'][1]} admitted from the queue")
+            if loop is None or loop.is_closed():
+                continue
+            loop.call_soon_threadsafe(self._run_job, entry["job"])
+
+    def _run_job(self, job: Callable[[], Awaitable[None]]):
+        task = asyncio.ensure_future(job())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            memory_mb, cpus = self._used()
+            return {
+                "capacity": {"memory_mb": self.memory_mb, "cpus": self.cpus},
+                "committed": {"memory_mb": memory_mb, "cpus": cpus},
+                "environments": [
+                    {"project": project, "env": env_id, "profile": profile.get("name")}
+                    for (project, env_id), profile in self._committed.items()
+                ],
+                "queue": [
+                    {"project": entry["key"][0], "env": entry["key"][1], "profile": entry["profile"].get("name"), "position": index + 1}
+                    for index, entry in enumerate(self._queue)
+                ],
+                "profiles": RESOURCE_PROFILES,
+                "default_profile": DEFAULT_RESOURCE_PROFILE,
+            }
+
+
+admission = AdmissionController()
@@ -1,26 +1,236 @@
-import re
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import os
+from datetime import timedelta
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import List, Optional
 
 from .services import docker_service, project_service
+from .docker_async import async_docker
+from .relay import relay_stats
+from .sessions import attach_stats, SPARE_SHELL_EXEC
+from .tool_images import TOOL_PACKAGES
+from .admission import admission, resolve_profile
+from .registry import environment_registry, container_name_for
 from . import auth
 from .auth import User, UserCreate, Token, get_current_user
 
+# Docker operations a single bulk request runs at once
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", 8))
+
 # Create two routers: one for auth and one for protected API endpoints
 auth_router = APIRouter()
 api_router = APIRouter()
 
 # --- Helper Functions ---
-def sanitize_for_docker(name: str) -> str:
-    """Sanitizes a string to be a valid Docker container name."""
-    # Remove any characters not allowed by Docker
-    sanitized = re.sub(r'[^a-zA-Z0-9_.-]', '', name)
-    # Ensure it doesn't start with a forbidden character
-    if sanitized.startswith(('_', '.', '-')):
-        sanitized = 'container' + sanitized
-    return sanitized
+def watch_environment_readiness(project_name: str, env_id: str, container_name: str, check_existing: bool = False):
+    """Marks a pending environment running once its container reports setup complete."""
+    def on_ready():
+        env = project_service.get_environment(project_name, env_id)
+        if env and env.get("status") == "pending":
+            project_service.update_environment_status(project_name, env_id, {"status": "running"})
+        if env and SPARE_SHELL_EXEC:
+            # The first attach then only has to start an exec
+            docker_service.prepare_shell_exec(container_name, env.get("ai_tool", "gemini"))
+    docker_service.readiness.watch(container_name, on_ready, check_existing=check_existing)
+
+def check_environment_credentials(proj: dict, env_data: "EnvironmentCreate"):
+    """Raises 400 unless the project has the tokens the chosen AI tool needs."""
+    if env_data.ai_tool == "gemini":
+        # Check if using Google login mode
+        use_google_login = getattr(env_data, "gemini_use_google_login", False)
+        if not use_google_login:
+            # Standard mode requires gemini_token
+            if not proj.get("gemini_token") or not proj.get("git_token"):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Project is missing Gemini API Key or Git Access Token. Please set them in the project settings.",
+                )
+        else:
+            # Google login mode only requires git_token
+            if not proj.get("git_token"):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Project is missing Git Access Token. Please set it in the project settings.",
+                )
+    elif env_data.ai_tool == "claude":
+        if not proj.get("anthropic_auth_token") or not proj.get("git_token"):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Project is missing Anthropic Auth Token or Git Access Token. Please set them in the project settings.",
+            )
+
+async def check_existing_branch(proj: dict, env_data: "EnvironmentCreate"):
+    """Raises 400 if the environment is to check out a branch the remote doesn't have.
+
+    Uses the same cached branch list as /git/branches; when the remote can't
+    be reached the check is skipped and the clone reports any problem.
+    """
+    if env_data.branch_mode == "new":
+        return
+    if not env_data.existing_branch:
+        raise HTTPException(status_code=400, detail="An existing branch must be selected.")
+    exists = await async_docker.branches.has_branch(proj["git_repo"], proj.get("git_token"), env_data.existing_branch)
+    if exists is False:
+        raise HTTPException(status_code=400, detail=f"Branch '{env_data.existing_branch}' does not exist in {proj['git_repo']}.")
+
+def get_environment_or_404(project_name: str, env_id: str) -> dict:
+    env = project_service.get_environment(project_name, env_id)
+    if not env:
+        if not project_service.get_project(project_name):
+            raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
+        raise HTTPException(status_code=404, detail=f"Environment '{env_id}' not found.")
+    return env
+
+def environment_container_name(project_name: str, env: dict) -> str:
+    """The container of a recorded environment, from its registry handle."""
+    return environment_registry.handle(project_name, env["id"], env).container_name
+
+def environment_container_env(proj: dict, env_data: "EnvironmentCreate") -> dict:
+    container_env_vars = {
+        "GIT_TOKEN": proj.get("git_token", "")
+    }
+    
+    # Add AI tool specific environment variables
+    if env_data.ai_tool == "gemini":
+        use_google_login = getattr(env_data, "gemini_use_google_login", False)
+        container_env_vars["GEMINI_USE_GOOGLE_LOGIN"] = str(use_google_login).lower()
+        if not use_google_login:
+            container_env_vars["GEMINI_API_KEY"] = proj.get("gemini_token", "")
+    elif env_data.ai_tool == "claude":
+        container_env_vars["ANTHROPIC_AUTH_TOKEN"] = proj.get("anthropic_auth_token", "")
+        container_env_vars["ANTHROPIC_BASE_URL"] = proj.get("anthropic_base_url", "")
+    return container_env_vars
+
+def new_environment_entry(env_data: "EnvironmentCreate", status: str = "pending") -> dict:
+    env_dict = Environment(id=env_data.name, base_image=env_data.base_image, status=status, resource_profile=resolve_profile(env_data.resource_profile)["name"]).dict(exclude={"queue_position"})
+    # Add ai_tool to the environment data
+    env_dict["ai_tool"] = env_data.ai_tool
+    env_dict["sessionId"] = None  # Initialize sessionId cache
+    return env_dict
+
+def remove_environment_entries(project_name: str, env_ids: set):
+    # Removes just these entries; a whole-project write could undo concurrent changes
+    project_service.remove_environments(project_name, env_ids)
+    for env_id in env_ids:
+        environment_registry.forget(project_name, env_id)
+
+# --- Admission ---
+
+def resource_profile_or_400(name: Optional[str]) -> dict:
+    try:
+        return resolve_profile(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def environment_resources(env: dict) -> dict:
+    """The environment's resource profile; the default one if it has none (or an unknown one)."""
+    try:
+        return resolve_profile(env.get("resource_profile"))
+    except ValueError:
+        return resolve_profile(None)
+
+def admit_environment(project_name: str, env_id: str, profile: dict) -> bool:
+    """True if the environment may use its capacity now; False if it has to queue."""
+    try:
+        return admission.admit((project_name, env_id), profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def release_environment(project_name: str, env_id: str):
+    """Gives back the environment's committed capacity, or its place in the queue."""
+    admission.cancel((project_name, env_id))
+    admission.release((project_name, env_id))
+
+async def create_environment_container(project_name: str, proj: dict, env_data: "EnvironmentCreate", profile: dict) -> str:
+    container_name = container_name_for(project_name, env_data.name, env_data.ai_tool)
+    await async_docker.create_and_run_environment(
+        container_name=container_name,
+        base_image=env_data.base_image,
+        git_repo_url=proj["git_repo"],
+        env_name=env_data.name, # Pass original name for git branch
+        env_vars=environment_container_env(proj, env_data),
+        branch_mode=env_data.branch_mode,
+        existing_branch=env_data.existing_branch,
+        ai_tool=env_data.ai_tool,
+        resources=profile,
+    )
+    return container_name
+
+def queue_environment_creation(project_name: str, proj: dict, env_data: "EnvironmentCreate", profile: dict) -> int:
+    """Creates the (already recorded, "queued") environment once admitted; returns its queue position."""
+    async def create_when_admitted():
+        project_service.update_environment_status(project_name, env_data.name, {"status": "pending"})
+        try:
+            container_name = await create_environment_container(project_name, proj, env_data, profile)
+        except Exception as e:
+            print(f"Queued creation of environment {project_name}/{env_data.name} failed: {e}")
+            admission.release((project_name, env_data.name))
+            remove_environment_entries(project_name, {env_data.name})
+            return
+        watch_environment_readiness(project_name, env_data.name, container_name)
+    return admission.enqueue((project_name, env_data.name), profile, create_when_admitted)
+
+async def start_environment_container(project_name: str, env: dict) -> Optional[int]:
+    """Starts the environment if admitted; otherwise queues it and returns its queue position."""
+    env_id = env["id"]
+    profile = environment_resources(env)
+    container_name = environment_container_name(project_name, env)
+    position = admission.position((project_name, env_id))
+    if position is not None:
+        return position
+
+    async def start():
+        try:
+            await async_docker.start_container(container_name, resources=profile)
+        except ValueError:
+            if not env.get("archive_image"):
+                raise
+            # Archived: the container is gone, recreate it from the committed workspace
+            await async_docker.restore_container(container_name, env["archive_image"], env.get("ai_tool", "gemini"), resources=profile)
+            project_service.update_environment_status(project_name, env_id, {"status": "pending"})
+            watch_environment_readiness(project_name, env_id, container_name)
+            return
+        project_service.update_environment_status(project_name, env_id, {"status": "running"})
+
+    if not admit_environment(project_name, env_id, profile):
+        project_service.update_environment_status(project_name, env_id, {"status": "queued"})
+
+        async def start_when_admitted():
+            try:
+                await start()
+            except Exception as e:
+                print(f"Queued start of environment {project_name}/{env_id} failed: {e}")
+                admission.release((project_name, env_id))
+                project_service.update_environment_status(project_name, env_id, {"status": "stopped"})
+        return admission.enqueue((project_name, env_id), profile, start_when_admitted)
+
+    try:
+        await start()
+    except ValueError as e:
+        admission.release((project_name, env_id))
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        admission.release((project_name, env_id))
+        raise HTTPException(status_code=500, detail=f"Failed to start container: {e}")
+    return None
+
+async def resume_environment(project_name: str, env: dict) -> Optional[int]:
+    """Wakes a hibernated environment: unpauses, starts or restores it as needed.
+
+    Returns the queue position if starting has to wait for capacity.
+    """
+    if env.get("status") == "paused":
+        container_name = environment_container_name(project_name, env)
+        try:
+            # Still holds its memory (and its admission), so this is instant
+            await async_docker.unpause_container(container_name)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        project_service.update_environment_status(project_name, env["id"], {"status": "running"})
+        return None
+    return await start_environment_container(project_name, env)
 
 # --- Pydantic Models (subset of original, some are now in auth.py) ---
 
@@ -29,6 +239,8 @@ class Environment(BaseModel):
     base_image: str
     status: str = "stopped"
     sessionId: Optional[str] = None  # Cache for Claude session ID
+    resource_profile: Optional[str] = None  # Name in RESOURCE_PROFILES; the default profile if unset
+    queue_position: Optional[int] = None  # Set in responses for environments waiting for capacity
 
 class Project(BaseModel):
     name: str
@@ -54,6 +266,11 @@ class EnvironmentCreate(BaseModel):
     existing_branch: Optional[str] = None
     ai_tool: str = "gemini"  # "gemini" or "claude"
     gemini_use_google_login: bool = False  # Whether to use Google login instead of API key
+    resource_profile: Optional[str] = None  # "small", "medium", "large"; DEFAULT_RESOURCE_PROFILE if omitted
+
+class ToolImageRequest(BaseModel):
+    base_image: str
+    ai_tool: str
 
 class ProjectSettingsUpdate(BaseModel):
     gemini_token: Optional[str] = None
@@ -71,7 +288,7 @@ def get_auth_status():
     return {"has_users": has_users}
 
 @auth_router.post("/auth/initialize", response_model=User)
-def initialize_first_user(user: UserCreate):
+async def initialize_first_user(user: UserCreate):
     """Create the very first user if none exist."""
     if len(auth.get_users()) > 0:
         raise HTTPException(
@@ -80,7 +297,7 @@ def initialize_first_user(user: UserCreate):
         )
     
     try:
-        created_user = auth.create_user(user)
+        created_user = await auth.create_user_async(user)
         return created_user
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -88,9 +305,18 @@ def initialize_first_user(user: UserCreate):
 
 
 @auth_router.post("/auth/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
     """Standard OAuth2 password flow to get a token."""
-    user = auth.authenticate_user(form_data.username, form_data.password)
+    client_ip = request.client.host if request.client else None
+    try:
+        # bcrypt runs on the hashing pool, never on the event loop
+        user = await auth.authenticate_user_async(form_data.username, form_data.password, client_ip)
+    except auth.LoginThrottled as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -107,12 +333,18 @@ def check_register():
 
 
 @auth_router.post("/auth/register", response_model=User)
-def register_user(user: UserCreate):
+async def register_user(user: UserCreate):
     """Allow anyone to register a new user."""
     try:
         # The create_user function already checks for duplicate usernames.
-        created_user = auth.create_user(user)
+        created_user = await auth.create_user_async(user)
         return created_user
+    except auth.LoginThrottled as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except ValueError as e:
         # This will catch the "Username already registered" error.
         raise HTTPException(
@@ -168,7 +400,7 @@ async def get_remote_branches(repo_url: str, project_name: str, current_user: Us
         logger.info(f"[Git Branches API] 项目 {project_name} 的Git令牌状态: {token_status}")
         
         logger.info(f"[Git Branches API] 开始调用list_remote_branches函数获取分支")
-        branches = docker_service.list_remote_branches(repo_url, token)
+        branches = await async_docker.list_remote_branches(repo_url, token)
         logger.info(f"[Git Branches API] 成功获取到 {len(branches)} 个分支")
         
         return branches
@@ -182,214 +414,317 @@ async def create_environment(project_name: str, env_data: EnvironmentCreate, cur
     if not proj:
         raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
 
-    # Validate that tokens are set before creating an environment
-    if env_data.ai_tool == "gemini":
-        # Check if using Google login mode
-        use_google_login = getattr(env_data, "gemini_use_google_login", False)
-        if not use_google_login:
-            # Standard mode requires gemini_token
-            if not proj.get("gemini_token") or not proj.get("git_token"):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Project is missing Gemini API Key or Git Access Token. Please set them in the project settings.",
-                )
-        else:
-            # Google login mode only requires git_token
-            if not proj.get("git_token"):
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Project is missing Git Access Token. Please set it in the project settings.",
-                )
-    elif env_data.ai_tool == "claude":
-        if not proj.get("anthropic_auth_token") or not proj.get("git_token"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Project is missing Anthropic Auth Token or Git Access Token. Please set them in the project settings.",
-            )
+    check_environment_credentials(proj, env_data)
 
-    if any(e["id"] == env_data.name for e in proj.get("environments", [])):
+    if project_service.get_environment(project_name, env_data.name):
         raise HTTPException(status_code=400, detail=f"Environment '{env_data.name}' already exists.")
+    await check_existing_branch(proj, env_data)
 
-    new_env = Environment(id=env_data.name, base_image=env_data.base_image, status="pending")
-    # Add ai_tool to the environment data
-    env_dict = new_env.dict()
-    env_dict["ai_tool"] = env_data.ai_tool
-    env_dict["sessionId"] = None  # Initialize sessionId cache
-    proj.setdefault("environments", []).append(env_dict)
-    project_service.update_project(project_name, proj)
+    profile = resource_profile_or_400(env_data.resource_profile)
+    # Claim the id first: the store re-checks it under its lock, so of two
+    # concurrent requests for the same name only one gets past this point
+    added = project_service.add_environments(project_name, [new_environment_entry(env_data, "pending")])
+    if added is None:
+        raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
+    if not added:
+        raise HTTPException(status_code=400, detail=f"Environment '{env_data.name}' already exists.")
+    try:
+        admitted = admit_environment(project_name, env_data.name, profile)
+    except HTTPException:
+        remove_environment_entries(project_name, {env_data.name})
+        raise
+    new_env = Environment(id=env_data.name, base_image=env_data.base_image, status="pending" if admitted else "queued", resource_profile=profile["name"])
+
+    if not admitted:
+        # The host is full: the container is created once capacity frees up
+        project_service.update_environment_status(project_name, env_data.name, {"status": "queued"})
+        new_env.queue_position = queue_environment_creation(project_name, proj, env_data, profile)
+        return new_env
 
     try:
-        # Sanitize names for Docker compatibility
-        sane_project_name = sanitize_for_docker(project_name)
-        sane_env_name = sanitize_for_docker(env_data.name)
-        tool_prefix = "claude" if env_data.ai_tool == "claude" else "gemini"
-        container_name = f"{tool_prefix}-env-{sane_project_name}-{sane_env_name}"
-        
-        container_env_vars = {
-            "GIT_TOKEN": proj.get("git_token", "")
-        }
-        
-        # Add AI tool specific environment variables
-        if env_data.ai_tool == "gemini":
-            use_google_login = getattr(env_data, "gemini_use_google_login", False)
-            container_env_vars["GEMINI_USE_GOOGLE_LOGIN"] = str(use_google_login).lower()
-            if not use_google_login:
-                container_env_vars["GEMINI_API_KEY"] = proj.get("gemini_token", "")
-        elif env_data.ai_tool == "claude":
-            container_env_vars["ANTHROPIC_AUTH_TOKEN"] = proj.get("anthropic_auth_token", "")
-            container_env_vars["ANTHROPIC_BASE_URL"] = proj.get("anthropic_base_url", "")
-        
-        docker_service.create_and_run_environment(
-            container_name=container_name, 
-            base_image=env_data.base_image, 
-            git_repo_url=proj["git_repo"],
-            env_name=env_data.name, # Pass original name for git branch
-            env_vars=container_env_vars,
-            branch_mode=env_data.branch_mode,
-            existing_branch=env_data.existing_branch,
-            ai_tool=env_data.ai_tool
-        )
+        container_name = await create_environment_container(project_name, proj, env_data, profile)
         
         # Don't update status to "running" immediately, it will be updated when setup is complete
-        # The /tmp/setup_complete file will indicate when the environment is ready
+        # The setup script's ready marker in the container log flips it (and notifies /ws/status)
+        watch_environment_readiness(project_name, env_data.name, container_name)
         new_env.status = "pending"
         return new_env
 
     except Exception as e:
-        # Rollback: remove environment from project data if creation fails
-        proj["environments"] = [env for env in proj["environments"] if env["id"] != env_data.name]
-        project_service.update_project(project_name, proj)
+        # Rollback: remove this request's environment (and nothing else) if creation fails
+        admission.release((project_name, env_data.name))
+        remove_environment_entries(project_name, {env_data.name})
         raise HTTPException(status_code=500, detail=f"Failed to create environment: {e}")
 
+@api_router.get("/relay/stats")
+async def get_relay_stats(current_user: User = Depends(get_current_user)):
+    """Per-session and total terminal relay counters: bytes (raw vs. on the wire) and throttling."""
+    return relay_stats.snapshot()
+
+@api_router.get("/environments/runtime")
+async def get_environment_runtime(current_user: User = Depends(get_current_user)):
+    """Registry handles of the environments this worker has seen: container, execs and attached clients."""
+    return environment_registry.snapshot()
+
+@api_router.get("/attach/stats")
+async def get_attach_stats(current_user: User = Depends(get_current_user)):
+    """Latency of recent terminal attaches, per phase (see sessions.AttachStats)."""
+    return attach_stats.snapshot()
+
 # ... (other endpoints need similar protection and service layer integration)
 @api_router.get("/docker-images", response_model=List[str])
 async def get_docker_images(current_user: User = Depends(get_current_user)):
-    return docker_service.list_images()
+    return await async_docker.list_images()
+
+@api_router.get("/docker-images/catalog")
+async def get_docker_image_catalog(
+    search: Optional[str] = None, ai_tool: Optional[str] = None, include_internal: bool = False,
+    sort: str = "tag", offset: int = 0, limit: int = 100,
+    current_user: User = Depends(get_current_user),
+):
+    """Local images with size, creation time and the AI tools with a prebuilt tool image, one page at a time."""
+    if sort not in ("tag", "size", "created"):
+        raise HTTPException(status_code=400, detail="sort must be one of: tag, size, created.")
+    if ai_tool is not None and ai_tool not in TOOL_PACKAGES:
+        raise HTTPException(status_code=400, detail=f"Unknown AI tool '{ai_tool}'.")
+    return await async_docker.image_catalog(
+        search=search, ai_tool=ai_tool, include_internal=include_internal, sort=sort, offset=offset, limit=limit,
+    )
+
+@api_router.get("/tool-images")
+async def get_tool_images(current_user: User = Depends(get_current_user)):
+    """Cached tool images plus builds in progress and recent build failures."""
+    return await async_docker.tool_image_status()
+
+@api_router.post("/tool-images/rebuild", status_code=202)
+async def rebuild_tool_image(request: ToolImageRequest, current_user: User = Depends(get_current_user)):
+    """Discards the cached image for a base image / tool pair and rebuilds it in the background."""
+    if request.ai_tool not in TOOL_PACKAGES:
+        raise HTTPException(status_code=400, detail=f"Unknown AI tool '{request.ai_tool}'.")
+    await async_docker.rebuild_tool_image(request.base_image, request.ai_tool)
+    return {"status": "building", "base_image": request.base_image, "ai_tool": request.ai_tool}
+
+@api_router.delete("/tool-images")
+async def invalidate_tool_images(base_image: Optional[str] = None, ai_tool: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Removes cached tool images; new environments then install tools until a rebuild finishes."""
+    return {"removed": await async_docker.invalidate_tool_images(base_image, ai_tool)}
+
+@api_router.get("/warm-pool")
+async def get_warm_pool(current_user: User = Depends(get_current_user)):
+    """Idle pre-started containers per base image / AI tool pair."""
+    return docker_service.warm_pool.status()
+
+@api_router.get("/admission")
+async def get_admission(current_user: User = Depends(get_current_user)):
+    """Host capacity, what running environments have committed of it, and the queue waiting for it."""
+    return admission.status()
 
 @api_router.post("/projects/{project_name}/environments/{env_id}/stop", status_code=200)
 async def stop_environment(project_name: str, env_id: str, current_user: User = Depends(get_current_user)):
-    proj = project_service.get_project(project_name)
-    if not proj:
-        raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
-
-    sane_project_name = sanitize_for_docker(project_name)
-    sane_env_id = sanitize_for_docker(env_id)
-    # Find the environment to get the ai_tool
-    env = next((e for e in proj.get("environments", []) if e["id"] == env_id), None)
-    if not env:
-        raise HTTPException(status_code=404, detail=f"Environment '{env_id}' not found.")
-    
-    sane_project_name = sanitize_for_docker(project_name)
-    sane_env_id = sanitize_for_docker(env_id)
-    tool_prefix = "claude" if env.get("ai_tool") == "claude" else "gemini"
-    container_name = f"{tool_prefix}-env-{sane_project_name}-{sane_env_id}"
+    env = get_environment_or_404(project_name, env_id)
     
-    docker_service.stop_container(container_name)
+    await async_docker.stop_container(environment_container_name(project_name, env))
+    release_environment(project_name, env_id)
     
-    for e in proj.get("environments", []):
-        if e["id"] == env_id:
-            e["status"] = "stopped"
-            break
-    project_service.update_project(project_name, proj)
+    project_service.update_environment_status(project_name, env_id, {"status": "stopped"})
     
     return {"message": "Environment stopped."}
 
 
 @api_router.post("/projects/{project_name}/environments/{env_id}/start", status_code=200)
 async def start_environment(project_name: str, env_id: str, current_user: User = Depends(get_current_user)):
-    proj = project_service.get_project(project_name)
-    if not proj:
-        raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
-
-    sane_project_name = sanitize_for_docker(project_name)
-    sane_env_id = sanitize_for_docker(env_id)
-    # Find the environment to get the ai_tool
-    env = next((e for e in proj.get("environments", []) if e["id"] == env_id), None)
-    if not env:
-        raise HTTPException(status_code=404, detail=f"Environment '{env_id}' not found.")
+    env = get_environment_or_404(project_name, env_id)
     
-    sane_project_name = sanitize_for_docker(project_name)
-    sane_env_id = sanitize_for_docker(env_id)
-    tool_prefix = "claude" if env.get("ai_tool") == "claude" else "gemini"
-    container_name = f"{tool_prefix}-env-{sane_project_name}-{sane_env_id}"
-    
-    try:
-        docker_service.start_container(container_name)
-    except ValueError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to start container: {e}")
-
-    for e in proj.get("environments", []):
-        if e["id"] == env_id:
-            e["status"] = "running"
-            break
-    project_service.update_project(project_name, proj)
+    # Starts now if the host has room for the environment's profile, otherwise waits its turn
+    queue_position = await resume_environment(project_name, env)
+    if queue_position is not None:
+        return {"message": "Environment queued.", "queue_position": queue_position}
     
     return {"message": "Environment started."}
 
 @api_router.delete("/projects/{project_name}/environments/{env_id}", status_code=204)
 async def delete_environment(project_name: str, env_id: str, current_user: User = Depends(get_current_user)):
-    proj = project_service.get_project(project_name)
-    if not proj:
-        raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
-
-    sane_project_name = sanitize_for_docker(project_name)
-    sane_env_id = sanitize_for_docker(env_id)
-    # Find the environment to get the ai_tool
-    env = next((e for e in proj.get("environments", []) if e["id"] == env_id), None)
-    if not env:
-        raise HTTPException(status_code=404, detail=f"Environment '{env_id}' not found.")
+    env = get_environment_or_404(project_name, env_id)
     
-    sane_project_name = sanitize_for_docker(project_name)
-    sane_env_id = sanitize_for_docker(env_id)
-    tool_prefix = "claude" if env.get("ai_tool") == "claude" else "gemini"
-    container_name = f"{tool_prefix}-env-{sane_project_name}-{sane_env_id}"
+    await async_docker.remove_container(environment_container_name(project_name, env))
+    release_environment(project_name, env_id)
+    if env.get("archive_image"):
+        await async_docker.remove_archive(env["archive_image"])
     
-    docker_service.remove_container(container_name)
-    
-    proj["environments"] = [e for e in proj.get("environments", []) if e["id"] != env_id]
-    project_service.update_project(project_name, proj)
+    remove_environment_entries(project_name, {env_id})
     
     return
 
 @api_router.get("/projects/{project_name}/environments/{env_id}/status")
 async def get_environment_status(project_name: str, env_id: str, current_user: User = Depends(get_current_user)):
-    proj = project_service.get_project(project_name)
-    if not proj:
-        raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
-    
-    env = next((e for e in proj.get("environments", []) if e["id"] == env_id), None)
-    if not env:
-        raise HTTPException(status_code=404, detail=f"Environment '{env_id}' not found.")
+    env = get_environment_or_404(project_name, env_id)
     
+    if env.get("status") == "queued":
+        return {"status": "queued", "queue_position": admission.position((project_name, env_id))}
+
     # If the environment is pending, check if setup is complete
     if env.get("status") == "pending":
-        # Construct container name
-        sane_project_name = sanitize_for_docker(project_name)
-        sane_env_id = sanitize_for_docker(env_id)
-        tool_prefix = "claude" if env.get("ai_tool") == "claude" else "gemini"
-        container_name = f"{tool_prefix}-env-{sane_project_name}-{sane_env_id}"
+        container_name = environment_container_name(project_name, env)
         
-        # Check if container exists and setup is complete
-        try:
-            container = docker_service.client.containers.get(container_name)
-            if container.status == "running":
-                # Check if setup is complete
-                result = container.exec_run("test -f /tmp/setup_complete")
-                if result.exit_code == 0:
-                    # Update status to running
-                    for e in proj["environments"]:
-                        if e["id"] == env_id:
-                            e["status"] = "running"
-                            break
-                    project_service.update_project(project_name, proj)
-                    return {"status": "running"}
-                else:
-                    return {"status": "pending"}
-            else:
-                return {"status": "pending"}
-        except:
-            return {"status": "pending"}
+        # Answered from the readiness cache; the first poll after a restart starts a watch
+        if docker_service.readiness.is_ready(container_name):
+            project_service.update_environment_status(project_name, env_id, {"status": "running"})
+            return {"status": "running"}
+        watch_environment_readiness(project_name, env_id, container_name, check_existing=True)
+        return {"status": "pending"}
     
     return {"status": env.get("status", "unknown")}
+
+# --- Bulk Environment Operations ---
+
+class BulkEnvironmentSelector(BaseModel):
+    env_ids: Optional[List[str]] = None  # Explicit environments; all of the project's if omitted
+    status: Optional[str] = None  # Only environments currently in this status (e.g. "running")
+
+class BulkEnvironmentCreate(BaseModel):
+    environments: List[EnvironmentCreate]
+
+async def run_bulk(items: list, operation, env_id_of=lambda env: env["id"]) -> List[dict]:
+    """Runs `operation(item)` for every item, at most BULK_CONCURRENCY at a time.
+
+    Returns one result per item, in order: {"env_id", "ok", "detail"}, where
+    a successful item's detail is whatever `operation` returned.
+    """
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def run_one(item):
+        env_id = env_id_of(item)
+        async with semaphore:
+            try:
+                detail = await operation(item)
+                return {"env_id": env_id, "ok": True, "detail": detail}
+            except HTTPException as e:
+                return {"env_id": env_id, "ok": False, "detail": e.detail}
+            except Exception as e:
+                return {"env_id": env_id, "ok": False, "detail": str(e)}
+
+    return list(await asyncio.gather(*(run_one(item) for item in items)))
+
+def select_environments(proj: dict, selector: BulkEnvironmentSelector):
+    """Returns (matching environments, results for requested ids that don't exist)."""
+    environments = proj.get("environments", [])
+    missing = []
+    if selector.env_ids is not None:
+        by_id = {env["id"]: env for env in environments}
+        missing = [
+            {"env_id": env_id, "ok": False, "detail": f"Environment '{env_id}' not found."}
+            for env_id in selector.env_ids if env_id not in by_id
+        ]
+        environments = [by_id[env_id] for env_id in dict.fromkeys(selector.env_ids) if env_id in by_id]
+    if selector.status is not None:
+        environments = [env for env in environments if env.get("status") == selector.status]
+    return environments, missing
+
+def get_project_or_404(project_name: str) -> dict:
+    proj = project_service.get_project(project_name)
+    if not proj:
+        raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
+    return proj
+
+@api_router.post("/projects/{project_name}/bulk/stop")
+async def bulk_stop_environments(project_name: str, selector: BulkEnvironmentSelector, current_user: User = Depends(get_current_user)):
+    proj = get_project_or_404(project_name)
+    environments, missing = select_environments(proj, selector)
+
+    async def stop(env):
+        await async_docker.stop_container(environment_container_name(project_name, env))
+        release_environment(project_name, env["id"])
+        # Status lives in the runtime layer, which batches its writes
+        project_service.update_environment_status(project_name, env["id"], {"status": "stopped"})
+
+    return {"results": await run_bulk(environments, stop) + missing}
+
+@api_router.post("/projects/{project_name}/bulk/start")
+async def bulk_start_environments(project_name: str, selector: BulkEnvironmentSelector, current_user: User = Depends(get_current_user)):
+    proj = get_project_or_404(project_name)
+    environments, missing = select_environments(proj, selector)
+
+    async def start(env):
+        queue_position = await resume_environment(project_name, env)
+        if queue_position is not None:
+            return f"Queued at position {queue_position}"
+
+    return {"results": await run_bulk(environments, start) + missing}
+
+@api_router.post("/projects/{project_name}/bulk/delete")
+async def bulk_delete_environments(project_name: str, selector: BulkEnvironmentSelector, current_user: User = Depends(get_current_user)):
+    proj = get_project_or_404(project_name)
+    environments, missing = select_environments(proj, selector)
+
+    async def delete(env):
+        await async_docker.remove_container(environment_container_name(project_name, env))
+        release_environment(project_name, env["id"])
+        if env.get("archive_image"):
+            await async_docker.remove_archive(env["archive_image"])
+
+    results = await run_bulk(environments, delete)
+    # One store write for every environment whose container is gone
+    deleted = {result["env_id"] for result in results if result["ok"]}
+    if deleted:
+        remove_environment_entries(project_name, deleted)
+    return {"results": results + missing}
+
+@api_router.post("/projects/{project_name}/bulk/create")
+async def bulk_create_environments(project_name: str, request: BulkEnvironmentCreate, current_user: User = Depends(get_current_user)):
+    # Resolved once; containers are only created for ids claimed in this project below
+    proj = get_project_or_404(project_name)
+    existing_ids = {env["id"] for env in proj.get("environments", [])}
+    seen = set()
+    profiles = {}
+
+    async def validate(env_data: EnvironmentCreate):
+        check_environment_credentials(proj, env_data)
+        if env_data.name in existing_ids or env_data.name in seen:
+            raise HTTPException(status_code=400, detail=f"Environment '{env_data.name}' already exists.")
+        seen.add(env_data.name)
+        await check_existing_branch(proj, env_data)
+        profiles[env_data.name] = resource_profile_or_400(env_data.resource_profile)
+
+    env_id_of = lambda env_data: env_data.name
+    results = await run_bulk(request.environments, validate, env_id_of=env_id_of)
+    valid = [env_data for env_data, result in zip(request.environments, results) if result["ok"]]
+    # Claim every valid id in a single store write, re-checked under the store's lock
+    added = project_service.add_environments(project_name, [new_environment_entry(env_data, "pending") for env_data in valid]) if valid else []
+    if added is None:
+        raise HTTPException(status_code=404, detail=f"Project '{project_name}' not found.")
+    for result in results:
+        if result["ok"] and result["env_id"] not in added:
+            result.update(ok=False, detail=f"Environment '{result['env_id']}' already exists.")
+    claimed = [env_data for env_data in valid if env_data.name in added]
+    created = []
+
+    async def create(env_data: EnvironmentCreate):
+        profile = profiles[env_data.name]
+        if not admit_environment(project_name, env_data.name, profile):
+            project_service.update_environment_status(project_name, env_data.name, {"status": "queued"})
+            position = queue_environment_creation(project_name, proj, env_data, profile)
+            return f"Queued at position {position}"
+        try:
+            container_name = await create_environment_container(project_name, proj, env_data, profile)
+        except Exception:
+            admission.release((project_name, env_data.name))
+            raise
+        created.append((env_data.name, container_name))
+
+    outcomes = dict(zip((env_data.name for env_data in claimed), await run_bulk(claimed, create, env_id_of=env_id_of)))
+    failed = {env_id for env_id, outcome in outcomes.items() if not outcome["ok"]}
+    if failed:
+        remove_environment_entries(project_name, failed)
+    if project_service.get_project(project_name) is None:
+        # Deleted while the containers were being created: nothing would ever clean them up
+        for env_id, container_name in created:
+            admission.release((project_name, env_id))
+            try:
+                await async_docker.remove_container(container_name)
+            except Exception as e:
+                print(f"Error removing container {container_name} of deleted project {project_name}: {e}")
+            outcomes[env_id] = {"env_id": env_id, "ok": False, "detail": f"Project '{project_name}' was deleted."}
+    else:
+        for env_id, container_name in created:
+            watch_environment_readiness(project_name, env_id, container_name)
+    return {"results": [outcomes.get(result["env_id"], result) if result["ok"] else result for result in results]}
@@ -1,6 +1,12 @@
-import json
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -8,11 +14,25 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, Field
 
+from .store import db_store
+
 # --- Configuration ---
 SECRET_KEY = "a_very_secret_key_that_should_be_in_env_vars"  # In a real app, use environment variables
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
-DB_PATH = 'data/db.json'
+# How long a validated token is trusted without decoding it again (never past its exp)
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", 300))
+TOKEN_CACHE_MAX = 4096
+# bcrypt runs on its own threads (it releases the GIL); at most this many hashes at once
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+# Logins waiting for a hashing thread before new ones are turned away
+PASSWORD_HASH_QUEUE_MAX = int(os.environ.get("PASSWORD_HASH_QUEUE_MAX", 32))
+# Failed logins allowed per username / per client IP within LOGIN_FAILURE_WINDOW seconds
+LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get("LOGIN_MAX_FAILURES_PER_USER", 5))
+LOGIN_MAX_FAILURES_PER_IP = int(os.environ.get("LOGIN_MAX_FAILURES_PER_IP", 20))
+LOGIN_FAILURE_WINDOW = int(os.environ.get("LOGIN_FAILURE_WINDOW", 300))
+# Usernames / IPs tracked per throttle; the least recently seen are dropped beyond this
+LOGIN_THROTTLE_MAX_KEYS = int(os.environ.get("LOGIN_THROTTLE_MAX_KEYS", 10000))
 
 # --- Pydantic Models ---
 class UserBase(BaseModel):
@@ -41,6 +61,120 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+class LoginThrottled(Exception):
+    """Too many attempts (or too many logins in flight); retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AttemptThrottle:
+    """Sliding-window count of failed attempts per key (a username or a client IP).
+
+    An attempt is counted by `reserve` before it runs, so parallel attempts
+    can't get past the limit while the first ones are still being checked;
+    `release` takes back one that turned out not to count. Expired keys are
+    swept once per window and at most `max_keys` are kept (least recently
+    seen go first), so made-up usernames can't grow it without bound.
+    """
+
+    def __init__(self, limit: int, window: int = LOGIN_FAILURE_WINDOW, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._attempts: "OrderedDict[str, deque]" = OrderedDict()
+        self._swept_at = time.time()
+
+    def _expire(self, attempts: deque, now: float):
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+
+    def _sweep(self, now: float):
+        for key in list(self._attempts):
+            self._expire(self._attempts[key], now)
+            if not self._attempts[key]:
+                del self._attempts[key]
+        self._swept_at = now
+
+    def reserve(self, key: str) -> float:
+        """Counts an attempt for `key`; raises LoginThrottled if it has none left.
+
+        Returns the attempt's timestamp, for `release`.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._swept_at >= self.window:
+                self._sweep(now)
+            attempts = self._attempts.get(key)
+            if attempts is None:
+                attempts = self._attempts[key] = deque()
+            self._attempts.move_to_end(key)
+            self._expire(attempts, now)
+            if len(attempts) >= self.limit:
+                raise LoginThrottled(
+                    "Too many failed login attempts. Please try again later.",
+                    retry_after=max(1, int(attempts[0] + self.window - now) + 1),
+                )
+            attempts.append(now)
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+            return now
+
+    def release(self, key: str, stamp: float):
+        """Takes back an attempt counted by `reserve`."""
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is not None and stamp in attempts:
+                attempts.remove(stamp)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated thread pool instead of the event loop.
+
+    A semaphore admits PASSWORD_HASH_WORKERS hashes at a time and at most
+    PASSWORD_HASH_QUEUE_MAX more may wait; beyond that callers get
+    LoginThrottled right away, so a burst of logins costs connected users
+    nothing but those threads' CPU.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_max: int = PASSWORD_HASH_QUEUE_MAX):
+        self.workers = workers
+        self.queue_max = queue_max
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # asyncio primitives belong to one loop
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.workers)
+            self._waiting = 0
+        if self._waiting >= self.workers + self.queue_max:
+            raise LoginThrottled("Too many logins in progress. Please try again shortly.", retry_after=1)
+        self._waiting += 1
+        try:
+            async with self._semaphore:
+                return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._waiting -= 1
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+password_hasher = PasswordHasher()
+failed_logins_by_user = AttemptThrottle(LOGIN_MAX_FAILURES_PER_USER)
+failed_logins_by_ip = AttemptThrottle(LOGIN_MAX_FAILURES_PER_IP)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -51,45 +185,116 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# --- User & Auth Service ---
+# --- Auth Caches ---
 
-def _load_db() -> Dict[str, List[Dict[str, Any]]]:
-    try:
-        with open(DB_PATH, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"users": [], "projects": []}
+class UserIndex:
+    """User models by username, built once per user instead of per request.
+
+    Only hits are cached: a username this worker hasn't seen (e.g. one just
+    registered through another worker) is looked up in the store again.
+    """
+
+    def __init__(self, store=db_store):
+        self.store = store
+        self._users: Dict[str, User] = {}
+
+    def get(self, username: str) -> Optional[User]:
+        user = self._users.get(username)
+        if user is None:
+            user_data = self.store.get_user(username)
+            if user_data is None:
+                return None
+            user = User(**user_data)
+            self._users[username] = user
+        return user
+
+    def invalidate(self, username: Optional[str] = None):
+        if username is None:
+            self._users.clear()
+        else:
+            self._users.pop(username, None)
+
+
+class TokenCache:
+    """Usernames of recently validated tokens, keyed by the token's SHA-256.
+
+    An entry lives for TOKEN_CACHE_TTL seconds at most and never past the
+    token's own `exp`; the least recently used entries go first when full.
+    """
+
+    def __init__(self, ttl: int = TOKEN_CACHE_TTL, max_entries: int = TOKEN_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[str]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            username, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return username
+
+    def put(self, token: str, username: str, exp: Optional[float]):
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (username, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
-def _save_db(data: Dict[str, List[Dict[str, Any]]]):
-    with open(DB_PATH, 'w') as f:
-        json.dump(data, f, indent=2)
+
+user_index = UserIndex()
+token_cache = TokenCache()
+
+# --- User & Auth Service ---
 
 def get_user(username: str) -> Optional[User]:
-    db = _load_db()
-    for user_data in db.get("users", []):
-        if user_data["username"] == username:
-            return User(**user_data)
-    return None
+    return user_index.get(username)
 
 def get_users() -> List[User]:
-    db = _load_db()
-    return [User(**u) for u in db.get("users", [])]
+    return [User(**u) for u in db_store.list_users()]
 
-def create_user(user: UserCreate) -> User:
-    db = _load_db()
-    if len(db.get("users", [])) > 0:
+def create_user(user: UserCreate, hashed_password: Optional[str] = None) -> User:
+    """Creates the first user; raises ValueError once one exists.
+
+    The check that counts is made by the store in the same write as the
+    insert, so concurrent calls can't both succeed. Pass `hashed_password`
+    if the password has been hashed already.
+    """
+    if db_store.list_users():
         raise ValueError("Cannot create user, a user already exists.")
-    if get_user(user.username):
-        raise ValueError("Username already registered")
-    
-    hashed_password = get_password_hash(user.password)
+    if hashed_password is None:
+        hashed_password = get_password_hash(user.password)
     user_in_db = User(username=user.username, hashed_password=hashed_password)
     
-    db["users"].append(user_in_db.dict())
-    _save_db(db)
+    db_store.add_user(user_in_db.dict(), only_first=True)
+    user_index.invalidate(user.username)
     return user_in_db
 
-
+async def create_user_async(user: UserCreate) -> User:
+    """create_user with the password hashed off the event loop."""
+    # Checked again by create_user; this only saves the hash when it's clearly too late
+    if db_store.list_users():
+        raise ValueError("Cannot create user, a user already exists.")
+    return create_user(user, await password_hasher.hash(user.password))
 
 def authenticate_user(username: str, password: str) -> Optional[User]:
     user = get_user(username)
@@ -99,46 +304,63 @@ def authenticate_user(username: str, password: str) -> Optional[User]:
         return None
     return user
 
+async def authenticate_user_async(username: str, password: str, client_ip: Optional[str] = None) -> Optional[User]:
+    """authenticate_user for the login endpoint: throttled, with bcrypt off the event loop.
+
+    Raises LoginThrottled while the username or the client IP has too many
+    recent failures; throttled attempts never reach bcrypt. Each attempt is
+    counted as a failure before the hash runs and taken back if it succeeds
+    (or never gets a hashing thread).
+    """
+    reserved = []
+    try:
+        for throttle, key in ((failed_logins_by_user, username), (failed_logins_by_ip, client_ip)):
+            if key:
+                reserved.append((throttle, key, throttle.reserve(key)))
+        user = get_user(username)
+        verified = user is not None and await password_hasher.verify(password, user.hashed_password)
+    except LoginThrottled:
+        for throttle, key, stamp in reserved:
+            throttle.release(key, stamp)
+        raise
+    if not verified:
+        return None
+    failed_logins_by_user.reset(username)
+    for throttle, key, stamp in reserved:
+        throttle.release(key, stamp)
+    return user
+
 # --- FastAPI Dependency for Protected Routes ---
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+def _user_for_token(token: str) -> User:
+    """Validates a JWT and returns its user; cached tokens skip the decode and the store."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    username = token_cache.get(token) if token else None
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    user = get_user(token_data.username)
+        username = token_data.username
+        token_cache.put(token, username, payload.get("exp"))
+
+    user = get_user(username)
     if user is None:
         raise credentials_exception
     return user
 
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    return _user_for_token(token)
+
 
 def verify_token(token: str) -> User:
     """Verify a JWT token and return the associated user. Used for WebSocket authentication."""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    user = get_user(token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
+    return _user_for_token(token)
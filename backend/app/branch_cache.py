@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from typing import Optional, List, Dict, Tuple
+
+from .git_mirror import GitMirrorCache, repo_path, auth_url, token_identity
+
+# Branch lists younger than this are served as they are
+BRANCH_CACHE_TTL = int(os.environ.get("BRANCH_CACHE_TTL", 60))
+# Older lists are still served (and refreshed in the background) up to this age
+BRANCH_CACHE_STALE_SECONDS = int(os.environ.get("BRANCH_CACHE_STALE_SECONDS", 600))
+LS_REMOTE_TIMEOUT = 30
+BRANCH_CACHE_MAX = 256
+
+
+# --- Remote Branch Cache ---
+
+class BranchCache:
+    """Remote branch lists per (repository, token identity).
+
+    Fresh lists are returned directly; stale ones are returned while a
+    single background refresh runs; missing or expired ones are fetched,
+    with concurrent callers sharing one fetch. A fetch reads a recently
+    synced git mirror when there is one this token has fetched itself (see
+    GitMirrorCache.readable_with) and otherwise runs `git ls-remote` as an
+    async subprocess, so nothing here blocks the event loop.
+    """
+
+    def __init__(self, git_mirrors: GitMirrorCache, ttl: int = BRANCH_CACHE_TTL, stale_seconds: int = BRANCH_CACHE_STALE_SECONDS):
+        self.git_mirrors = git_mirrors
+        self.ttl = ttl
+        self.stale_seconds = max(stale_seconds, ttl)
+        # key -> (branches, fetched at, whether ls-remote rather than the mirror said so)
+        self._entries: Dict[Tuple[str, str], Tuple[List[str], float, bool]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight: Dict[Tuple[str, str, bool], asyncio.Task] = {}
+
+    @staticmethod
+    def _key(repo_url: str, token: Optional[str]) -> Tuple[str, str]:
+        return repo_path(repo_url), token_identity(token)
+
+    async def get(self, repo_url: str, token: Optional[str]) -> List[str]:
+        """The repository's branch names, sorted."""
+        key = self._key(repo_url, token)
+        entry = self._entries.get(key)
+        if entry is not None:
+            branches, fetched_at, _ = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                return branches
+            if age < self.stale_seconds:
+                self._refresh(key, repo_url, token)
+                return branches
+        return await asyncio.shield(self._refresh(key, repo_url, token))
+
+    async def has_branch(self, repo_url: str, token: Optional[str], branch: str) -> Optional[bool]:
+        """Whether `branch` exists on the remote; None if that can't be determined right now.
+
+        A miss is only final when `git ls-remote` has just said so: a cached
+        list, or one read from a mirror up to MIRROR_FRESH_SECONDS behind,
+        may predate the push. Concurrent checks share one ls-remote.
+        """
+        key = self._key(repo_url, token)
+        cached = self._entries.get(key)
+        try:
+            if branch in await self.get(repo_url, token):
+                return True
+            entry = self._entries.get(key)
+            if entry is not cached and entry is not None and entry[2]:
+                return False  # ls-remote listed it just now
+            return branch in await asyncio.shield(self._refresh(key, repo_url, token, remote=True))
+        except Exception as e:
+            print(f"Could not check branch '{branch}' of {repo_path(repo_url)}: {e}")
+            return None
+
+    def invalidate(self, repo_url: Optional[str] = None):
+        if repo_url is None:
+            self._entries.clear()
+            return
+        path = repo_path(repo_url)
+        for key in [key for key in self._entries if key[0] == path]:
+            del self._entries[key]
+
+    def _refresh(self, key: Tuple[str, str], repo_url: str, token: Optional[str], remote: bool = False) -> asyncio.Task:
+        """The running fetch for `key`, or a new one; `remote` skips the mirror."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Tasks belong to one loop
+            self._loop = loop
+            self._inflight = {}
+        inflight_key = key + (remote,)
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = loop.create_task(self._fetch(key, repo_url, token, remote))
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda done: self._fetched(inflight_key, done))
+        return task
+
+    def _fetched(self, inflight_key: Tuple[str, str, bool], task: asyncio.Task):
+        if self._inflight.get(inflight_key) is task:
+            del self._inflight[inflight_key]
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved here so background refreshes that fail aren't reported as never retrieved
+            print(f"Error listing branches of {inflight_key[0]}: {task.exception()}")
+
+    async def _fetch(self, key: Tuple[str, str], repo_url: str, token: Optional[str], remote: bool = False) -> List[str]:
+        branches = None
+        # A recently fetched mirror already has every branch; no network round trip needed
+        if not remote and self.git_mirrors.readable_with(repo_url, token) and self.git_mirrors.is_fresh(repo_url):
+            try:
+                branches = await self._git("--git-dir", self.git_mirrors.host_path(repo_url),
+                                           "for-each-ref", "--format=%(refname:short)", "refs/heads")
+                branches = sorted(line for line in branches.splitlines() if line) or None
+            except Exception as e:
+                print(f"Reading branches from the mirror of {key[0]} failed, using ls-remote: {e}")
+        from_remote = branches is None
+        if from_remote:
+            # Refresh (or create) the mirror in the background for later listings and clones
+            self.git_mirrors.sync(repo_url, token)
+            branches = await self._ls_remote(repo_url, token)
+        self._entries[key] = (branches, time.time(), from_remote)
+        while len(self._entries) > BRANCH_CACHE_MAX:
+            del self._entries[next(iter(self._entries))]
+        return branches
+
+    async def _ls_remote(self, repo_url: str, token: Optional[str]) -> List[str]:
+        start_time = time.time()
+        try:
+            output = await self._git("ls-remote", "--heads", auth_url(repo_url, token), token=token)
+        except Exception as e:
+            raise Exception(f"Could not fetch remote branches: {e}")
+        print(f"Listed remote branches of {repo_path(repo_url)} in {time.time() - start_time:.2f}s")
+        branches = [line.split('\t')[1].replace('refs/heads/', '') for line in output.splitlines() if '\t' in line]
+        if not branches:
+            return ['main', 'master']  # Default branches if no output
+        return sorted(branches)
+
+    async def _git(self, *args: str, token: Optional[str] = None) -> str:
+        process = await asyncio.create_subprocess_exec(
+            "git", *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), LS_REMOTE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise RuntimeError("Request timed out - repository may be slow or unreachable")
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        if process.returncode != 0:
+            message = stderr.decode("utf-8", "replace").strip() or f"git {args[0]} exited with {process.returncode}"
+            raise RuntimeError(message.replace(token, "***") if token else message)
+        return stdout.decode("utf-8", "replace")
@@ -0,0 +1,177 @@
+import threading
+import time
+from typing import Optional, List, Dict, Any, Callable
+
+import docker
+
+from .docker_events import DockerEventsFollower
+
+# Set on every environment (and warm pool) container this backend creates
+MANAGED_LABEL = "iruka.managed"
+# Environment containers created before the label existed are recognised by name
+LEGACY_NAME_PREFIXES = ("claude-env-", "gemini-env-")
+
+# Docker event action -> container status as reported by `docker inspect`
+EVENT_STATUS = {
+    "create": "created",
+    "start": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+    "kill": "exited",
+    "oom": "exited",
+}
+
+StateListener = Callable[[str, Optional[Dict[str, Any]]], None]
+
+
+def _health(container) -> Optional[str]:
+    return (container.attrs.get("State", {}).get("Health") or {}).get("Status")
+
+
+# --- Container State Cache ---
+
+class ContainerStateCache(DockerEventsFollower):
+    """Live container states fed by the Docker events stream.
+
+    One labelled `containers.list` at startup (and after every events
+    reconnect, to cover missed events) seeds the cache; from then on a
+    single background thread applies start/die/destroy/rename/health events.
+    Listeners are called from that thread with the container name and its
+    new state (None once the container is gone).
+
+    Entries are keyed by container name. Containers created before labels
+    existed are picked up by events once they match LEGACY_NAME_PREFIXES, or
+    by `refresh()`.
+    """
+
+    event_type = "container"
+
+    def __init__(self, client: docker.DockerClient):
+        super().__init__(client)
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._listeners: List[StateListener] = []
+        self._reconcile_listeners: List[Callable[[], None]] = []
+
+    def add_listener(self, listener: StateListener):
+        self._listeners.append(listener)
+
+    def add_reconcile_listener(self, listener: Callable[[], None]):
+        """Called (from the events thread) after every full reconcile."""
+        self._reconcile_listeners.append(listener)
+
+    def get(self, container_name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._states.get(container_name)
+            return dict(state) if state is not None else None
+
+    def status(self, container_name: str) -> Optional[str]:
+        """Cached status; None if the container is unknown (or the cache isn't synced)."""
+        state = self.get(container_name)
+        return state["status"] if state is not None else None
+
+    def reconcile(self):
+        """Replaces the cache with one listing of all managed containers."""
+        containers = self.client.containers.list(all=True, filters={"label": MANAGED_LABEL})
+        fresh = {
+            container.name: {
+                "id": container.id,
+                "status": container.status,
+                "health": _health(container),
+                "updated_at": time.time(),
+            }
+            for container in containers
+        }
+        with self._lock:
+            previous = self._states
+            # Unlabelled containers learnt from events stay until they are destroyed
+            for name, state in previous.items():
+                if name not in fresh and state.get("unlabelled"):
+                    fresh[name] = state
+            self._states = fresh
+        self.synced = True
+        for name in set(previous) | set(fresh):
+            if previous.get(name, {}).get("status") != fresh.get(name, {}).get("status"):
+                self._notify(name, fresh.get(name))
+        print(f"Container state cache reconciled: {len(fresh)} containers")
+        for listener in self._reconcile_listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error in container reconcile listener: {e}")
+
+    def refresh(self, container_name: str) -> Optional[Dict[str, Any]]:
+        """Reads one container from the daemon into the cache (for cache misses)."""
+        try:
+            container = self.client.containers.get(container_name)
+        except docker.errors.NotFound:
+            self._set(container_name, None)
+            return None
+        state = {
+            "id": container.id,
+            "status": container.status,
+            "health": _health(container),
+            "updated_at": time.time(),
+            "unlabelled": MANAGED_LABEL not in (container.labels or {}),
+        }
+        self._set(container_name, state)
+        return dict(state)
+
+    def mark(self, container_name: str, status: str):
+        """Records a status change this process just made, ahead of its event."""
+        with self._lock:
+            existing = self._states.get(container_name)
+        if existing is not None:
+            self._set(container_name, dict(existing, status=status, updated_at=time.time()))
+
+    def _apply(self, event: Dict[str, Any]):
+        action = event.get("Action") or event.get("status") or ""
+        actor = event.get("Actor", {})
+        attributes = actor.get("Attributes", {})
+        name = attributes.get("name")
+        if not name:
+            return
+        with self._lock:
+            existing = self._states.get(name)
+        if MANAGED_LABEL not in attributes and existing is None and not name.startswith(LEGACY_NAME_PREFIXES):
+            return  # Not one of ours
+
+        if action == "destroy":
+            self._set(name, None)
+        elif action == "rename":
+            old_name = attributes.get("oldName", "").lstrip("/")
+            with self._lock:
+                state = self._states.pop(old_name, None)
+            if old_name:
+                self._notify(old_name, None)
+            if state is None:
+                state = {"id": actor.get("ID"), "status": "running", "health": None}
+            self._set(name, dict(state, updated_at=time.time()))
+        elif action.startswith("health_status"):
+            health = action.split(":", 1)[-1].strip()
+            if existing is not None:
+                self._set(name, dict(existing, health=health, updated_at=time.time()))
+        elif action in EVENT_STATUS:
+            state = dict(existing or {"health": None}, id=actor.get("ID"), status=EVENT_STATUS[action], updated_at=time.time())
+            if MANAGED_LABEL not in attributes:
+                state["unlabelled"] = True
+            self._set(name, state)
+
+    def _set(self, container_name: str, state: Optional[Dict[str, Any]]):
+        with self._lock:
+            previous = self._states.get(container_name)
+            if state is None:
+                self._states.pop(container_name, None)
+            else:
+                self._states[container_name] = state
+        if (previous or {}).get("status") != (state or {}).get("status"):
+            self._notify(container_name, state)
+
+    def _notify(self, container_name: str, state: Optional[Dict[str, Any]]):
+        for listener in self._listeners:
+            try:
+                listener(container_name, dict(state) if state is not None else None)
+            except Exception as e:
+                print(f"Error in container state listener for {container_name}: {e}")
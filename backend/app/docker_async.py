@@ -0,0 +1,180 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Callable, Tuple
+
+from .services import DockerService, docker_service
+from .branch_cache import BranchCache
+
+# Threads dedicated to Docker engine calls (separate from the loop's default executor)
+DOCKER_EXECUTOR_WORKERS = int(os.environ.get("DOCKER_EXECUTOR_WORKERS", 16))
+# Per-operation limits on concurrent calls, and how long a caller waits (seconds)
+DOCKER_OP_LIMITS = {
+    "create": 4,
+    "start": 8,
+    "stop": 8,
+    "remove": 8,
+    "pause": 16,
+    "archive": 2,
+    "inspect": 16,
+    "exec": 16,
+    "list": 4,
+}
+DOCKER_OP_TIMEOUTS = {
+    "create": 600.0,  # May include pulling the base image
+    "start": 60.0,
+    "stop": 30.0,
+    "remove": 30.0,
+    "pause": 10.0,
+    "archive": 900.0,  # Commits the whole container filesystem
+    "inspect": 10.0,
+    "exec": 30.0,
+    "list": 30.0,
+}
+
+
+class DockerTimeoutError(Exception):
+    """A Docker operation did not finish within its timeout."""
+
+
+# --- Async Docker Access ---
+
+class AsyncDockerService:
+    """Awaitable versions of every DockerService operation.
+
+    docker-py is synchronous, so calls run on a bounded executor of their
+    own; a per-operation semaphore keeps one slow kind of call (e.g. stops,
+    which may wait 10s for the container to exit) from occupying every
+    worker. A timeout only stops the caller waiting: the engine call keeps
+    running in its thread and its result is discarded, after `on_timeout`
+    (if given) has undone whatever it did.
+    """
+
+    def __init__(self, service: DockerService, max_workers: int = DOCKER_EXECUTOR_WORKERS):
+        self.service = service
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="docker")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.branches = BranchCache(service.git_mirrors)
+
+    def _semaphore(self, op: str) -> asyncio.Semaphore:
+        # asyncio primitives belong to one loop; start over if the app runs on a new one
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphores = {}
+        if op not in self._semaphores:
+            self._semaphores[op] = asyncio.Semaphore(DOCKER_OP_LIMITS[op])
+        return self._semaphores[op]
+
+    async def run(
+        self, op: str, func: Callable, *args, timeout: Optional[float] = None,
+        on_timeout: Optional[Callable[[], None]] = None, **kwargs,
+    ):
+        """Runs a blocking Docker call for operation class `op` off the event loop.
+
+        `on_timeout` runs in the engine thread once a call the caller gave up
+        on has finished (not at all if it never started).
+        """
+        timeout = DOCKER_OP_TIMEOUTS[op] if timeout is None else timeout
+        async with self._semaphore(op):
+            call = self._executor.submit(functools.partial(func, *args, **kwargs))
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(call), timeout)
+            except asyncio.TimeoutError:
+                if on_timeout is not None:
+                    call.add_done_callback(functools.partial(self._after_timeout, op, on_timeout))
+                raise DockerTimeoutError(f"Docker {op} operation timed out after {timeout:g}s")
+
+    @staticmethod
+    def _after_timeout(op: str, on_timeout: Callable[[], None], call):
+        if call.cancelled():
+            return
+        try:
+            on_timeout()
+        except Exception as e:
+            print(f"Error cleaning up after timed out Docker {op} operation: {e}")
+
+    def _remove_orphan(self, container_name: str) -> Callable[[], None]:
+        """on_timeout for creations: the caller has rolled back, so the container must not stay."""
+        def remove():
+            print(f"Removing container {container_name}, created after its request timed out")
+            self.service.remove_container(container_name)
+        return remove
+
+    async def create_and_run_environment(self, **kwargs):
+        return await self.run(
+            "create", self.service.create_and_run_environment,
+            on_timeout=self._remove_orphan(kwargs["container_name"]), **kwargs,
+        )
+
+    async def start_container(self, container_name: str, resources: Optional[Dict[str, Any]] = None):
+        return await self.run("start", self.service.start_container, container_name, resources)
+
+    async def stop_container(self, container_name: str):
+        return await self.run("stop", self.service.stop_container, container_name)
+
+    async def remove_container(self, container_name: str):
+        return await self.run("remove", self.service.remove_container, container_name)
+
+    async def pause_container(self, container_name: str):
+        return await self.run("pause", self.service.pause_container, container_name)
+
+    async def unpause_container(self, container_name: str):
+        return await self.run("pause", self.service.unpause_container, container_name)
+
+    async def archive_container(self, container_name: str) -> str:
+        return await self.run("archive", self.service.archive_container, container_name)
+
+    async def restore_container(self, container_name: str, archive_image: str, ai_tool: str, resources: Optional[Dict[str, Any]] = None):
+        return await self.run(
+            "create", self.service.restore_container, container_name, archive_image, ai_tool, resources,
+            on_timeout=self._remove_orphan(container_name),
+        )
+
+    async def remove_archive(self, archive_image: str):
+        return await self.run("remove", self.service.remove_archive, archive_image)
+
+    async def stop_and_remove_container(self, container_name: str):
+        return await self.run("remove", self.service.stop_and_remove_container, container_name)
+
+    async def is_setup_complete(self, container_name: str) -> bool:
+        return await self.run("inspect", self.service.is_setup_complete, container_name)
+
+    async def list_images(self) -> List[str]:
+        if self.service.images.synced:
+            return self.service.images.tags()  # In memory, no executor hop needed
+        return await self.run("list", self.service.list_images)
+
+    async def image_catalog(self, **query) -> Dict[str, Any]:
+        """A page of the image catalog (see ImageCatalog.query), loading it first if needed."""
+        if not self.service.images.synced:
+            await self.run("list", self.service.images.reconcile)
+        return self.service.images.query(**query)
+
+    async def list_remote_branches(self, repo_url: str, token: Optional[str]) -> List[str]:
+        # Cached, and fetched with async subprocesses rather than on the executor
+        return await self.branches.get(repo_url, token)
+
+    async def setup_shell_session(self, container_name: str, ai_tool: str = "gemini", timings: Optional[Dict[str, float]] = None) -> Tuple[str, Any]:
+        return await self.run("exec", self.service.setup_shell_session, container_name, ai_tool, timings)
+
+    async def prepare_shell_exec(self, container_name: str, ai_tool: str = "gemini"):
+        return await self.run("exec", self.service.prepare_shell_exec, container_name, ai_tool)
+
+    async def tool_image_status(self) -> Dict[str, Any]:
+        return await self.run("list", self.service.tool_images.status)
+
+    async def invalidate_tool_images(self, base_image: Optional[str] = None, ai_tool: Optional[str] = None) -> List[str]:
+        return await self.run("remove", self.service.tool_images.invalidate, base_image, ai_tool)
+
+    async def rebuild_tool_image(self, base_image: str, ai_tool: str):
+        # Only the invalidation runs here; the build itself continues in the background
+        await self.run("remove", self.service.tool_images.rebuild, base_image, ai_tool)
+
+    async def resize_shell(self, exec_id: str, rows: int, cols: int):
+        return await self.run("exec", self.service.resize_shell, exec_id, rows, cols)
+
+
+async_docker = AsyncDockerService(docker_service)
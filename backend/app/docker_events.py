@@ -0,0 +1,63 @@
+import threading
+from typing import Optional, Dict, Any
+
+import docker
+
+EVENTS_RETRY_SECONDS = 5
+
+
+# --- Docker Events Follower ---
+
+class DockerEventsFollower:
+    """A background thread applying one type of Docker events to a cache.
+
+    It subscribes to the events stream, then calls `reconcile()` for a full
+    listing (again after every reconnect, to cover missed events) and
+    `_apply()` for each event. Subclasses set `event_type` and implement both.
+    """
+
+    event_type = ""
+
+    def __init__(self, client: docker.DockerClient):
+        self.client = client
+        self.synced = False
+        self._events = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name=f"docker-{self.event_type}-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._events is not None:
+            try:
+                self._events.close()
+            except Exception:
+                pass
+        self._thread = None
+
+    def reconcile(self):
+        raise NotImplementedError
+
+    def _apply(self, event: Dict[str, Any]):
+        raise NotImplementedError
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                # Subscribe first so nothing between the listing and the stream is lost
+                self._events = self.client.events(decode=True, filters={"type": self.event_type})
+                self.reconcile()
+                for event in self._events:
+                    self._apply(event)
+            except Exception as e:
+                if not self._stopping.is_set():
+                    print(f"Docker {self.event_type} events stream failed, retrying in {EVENTS_RETRY_SECONDS}s: {e}")
+            finally:
+                self._events = None
+            self._stopping.wait(EVENTS_RETRY_SECONDS)
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from typing import Optional, List, Dict, Callable
+
+try:
+    import aionotify
+except ImportError:  # inotify is Linux-only; stores fall back to mtime/size validation
+    aionotify = None
+
+# --- File Change Notifications ---
+
+class FileWatcher:
+    """Dispatches inotify events for individual files to registered callbacks.
+
+    Files are replaced atomically via rename, so the watch is placed on their
+    parent directory and matched by name on IN_CLOSE_WRITE / IN_MOVED_TO.
+    `active` is only True while notifications are actually being delivered;
+    caches must keep validating on their own whenever it is False.
+    """
+
+    def __init__(self):
+        self.active = False
+        self._callbacks: Dict[str, Dict[str, List[Callable[[], None]]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def watch(self, path: str, callback: Callable[[], None]):
+        directory, name = os.path.split(os.path.abspath(path))
+        self._callbacks.setdefault(directory, {}).setdefault(name, []).append(callback)
+
+    def start(self):
+        if aionotify is None:
+            print("aionotify not available, caches will validate by mtime/size instead")
+            return
+        if self._task is None and self._callbacks:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        watcher = aionotify.Watcher()
+        flags = aionotify.Flags.CLOSE_WRITE | aionotify.Flags.MOVED_TO
+        try:
+            for directory in self._callbacks:
+                os.makedirs(directory, exist_ok=True)
+                watcher.watch(path=directory, flags=flags, alias=directory)
+            await watcher.setup(asyncio.get_running_loop())
+        except Exception as e:
+            print(f"Could not set up file watcher, falling back to mtime/size validation: {e}")
+            return
+        self.active = True
+        try:
+            while True:
+                event = await watcher.get_event()
+                for callback in self._callbacks.get(event.alias, {}).get(event.name, []):
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(f"Error in file watcher callback for {event.name}: {e}")
+        finally:
+            self.active = False
+            watcher.close()
+
+
+file_watcher = FileWatcher()
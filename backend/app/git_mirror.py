@@ -0,0 +1,146 @@
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict, Set
+
+# Bare mirrors of project repositories, one per git_repo URL
+MIRROR_DIR = "data/git_mirrors"
+# Where a project's mirror is mounted (read-only) inside its environment containers
+MIRROR_MOUNT = "/mirror"
+# Mirrors synced more recently than this are fresh enough to list branches from
+MIRROR_FRESH_SECONDS = int(os.environ.get("GIT_MIRROR_FRESH_SECONDS", 60))
+MIRROR_FETCH_TIMEOUT = 600
+MIRROR_REFSPECS = ("+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*")
+
+
+def repo_path(repo_url: str) -> str:
+    """The URL without protocol, whitespace or invisible characters (host/owner/repo)."""
+    url = repo_url.strip()
+    url = url.split('//', 1)[-1] if '//' in url else url
+    url = re.sub(r'[\u2000-\u200F\u2028-\u202F\u205F-\u206F]', '', url)
+    return url.rstrip('/')
+
+
+def auth_url(repo_url: str, token: Optional[str]) -> str:
+    if token:
+        return f"https://oauth2:{token}@{repo_path(repo_url)}"
+    return f"https://{repo_path(repo_url)}"
+
+
+def mirror_name(repo_url: str) -> str:
+    return hashlib.sha256(repo_path(repo_url).encode('utf-8')).hexdigest()[:16] + ".git"
+
+
+def token_identity(token: Optional[str]) -> str:
+    """Stands in for the token in cache keys, so the token itself is never kept around."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16] if token else ""
+
+
+# --- Git Mirror Cache ---
+
+class GitMirrorCache:
+    """One bare mirror per repository on the host, updated with incremental fetches.
+
+    A container gets its own repository's mirror mounted read-only and
+    clones with `--reference-if-able <mirror> --dissociate`, so only objects
+    the mirror lacks come over the network and the workspace ends up
+    self-contained. The token is only ever passed on the fetch command line;
+    the mirror's configured remote is the plain https URL.
+
+    A mirror is only handed out (mounted, or read for branch lists) with a
+    credential that has fetched it successfully in this process, so a token
+    that can't read the repository gets nothing out of another's mirror.
+    """
+
+    def __init__(self, root: str = MIRROR_DIR, max_syncs: int = 2):
+        self.root = root
+        self._executor = ThreadPoolExecutor(max_workers=max_syncs, thread_name_prefix="git-mirror")
+        self._lock = threading.Lock()
+        self._syncs: Dict[str, Future] = {}
+        self._readers: Dict[str, Set[str]] = {}  # mirror name -> token identities that fetched it
+
+    def host_path(self, repo_url: str) -> str:
+        return os.path.join(self.root, mirror_name(repo_url))
+
+    def container_path(self, repo_url: str) -> str:
+        return f"{MIRROR_MOUNT}/{mirror_name(repo_url)}"
+
+    def exists(self, repo_url: str) -> bool:
+        return os.path.isfile(os.path.join(self.host_path(repo_url), "HEAD"))
+
+    def readable_with(self, repo_url: str, token: Optional[str]) -> bool:
+        """Whether the mirror exists and `token` has proven it can read the repository."""
+        with self._lock:
+            readers = self._readers.get(mirror_name(repo_url), ())
+        return token_identity(token) in readers and self.exists(repo_url)
+
+    def is_fresh(self, repo_url: str) -> bool:
+        # git rewrites FETCH_HEAD on every fetch, which makes it the last sync time
+        try:
+            synced_at = os.path.getmtime(os.path.join(self.host_path(repo_url), "FETCH_HEAD"))
+        except OSError:
+            return False
+        return time.time() - synced_at < MIRROR_FRESH_SECONDS
+
+    def sync(self, repo_url: str, token: Optional[str]) -> Future:
+        """Creates or fetches the mirror in the background; concurrent calls share one run."""
+        name = mirror_name(repo_url)
+        with self._lock:
+            future = self._syncs.get(name)
+            if future is None or future.done():
+                future = self._executor.submit(self._sync, repo_url, token)
+                self._syncs[name] = future
+            return future
+
+    def _sync(self, repo_url: str, token: Optional[str]):
+        path = self.host_path(repo_url)
+        start_time = time.time()
+        try:
+            if self.exists(repo_url):
+                self._fetch(path, repo_url, token)
+            else:
+                # Build next to the final path and rename, so containers never see a half-built mirror
+                os.makedirs(self.root, exist_ok=True)
+                staging = tempfile.mkdtemp(dir=self.root, prefix=".clone-")
+                try:
+                    self._git(token, "init", "--bare", staging)
+                    self._git(token, "--git-dir", staging, "remote", "add", "--mirror=fetch", "origin", auth_url(repo_url, None))
+                    self._fetch(staging, repo_url, token)
+                    os.rename(staging, path)
+                finally:
+                    shutil.rmtree(staging, ignore_errors=True)
+            with self._lock:
+                self._readers.setdefault(mirror_name(repo_url), set()).add(token_identity(token))
+            print(f"Synced git mirror for {repo_path(repo_url)} in {time.time() - start_time:.2f}s")
+        except Exception as e:
+            # A token that stopped working loses its access to the mirror too
+            with self._lock:
+                self._readers.get(mirror_name(repo_url), set()).discard(token_identity(token))
+            print(f"Error syncing git mirror for {repo_path(repo_url)}: {e}")
+            raise
+
+    def _fetch(self, path: str, repo_url: str, token: Optional[str]):
+        self._git(token, "--git-dir", path, "fetch", "--prune", auth_url(repo_url, token), *MIRROR_REFSPECS)
+
+    def _git(self, token: Optional[str], *args: str) -> str:
+        try:
+            result = subprocess.run(
+                ["git", *args],
+                capture_output=True,
+                text=True,
+                timeout=MIRROR_FETCH_TIMEOUT,
+                check=True,
+                env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+            )
+        except subprocess.CalledProcessError as e:
+            message = e.stderr or str(e)
+            raise RuntimeError(message.replace(token, "***") if token else message)
+        except subprocess.TimeoutExpired:
+            raise RuntimeError(f"git {args[0]} timed out")
+        return result.stdout
@@ -0,0 +1,38 @@
+import os
+from typing import Optional
+
+from .readiness import READY_MARKER
+
+# Seconds without a client attached or shell output before each step; 0 disables the step
+IDLE_PAUSE_SECONDS = int(os.environ.get("IDLE_PAUSE_SECONDS", 120))
+IDLE_STOP_SECONDS = int(os.environ.get("IDLE_STOP_SECONDS", 4 * 3600))
+IDLE_ARCHIVE_SECONDS = int(os.environ.get("IDLE_ARCHIVE_SECONDS", 0))  # e.g. 259200 for three days
+IDLE_CHECK_INTERVAL = int(os.environ.get("IDLE_CHECK_INTERVAL", 30))
+
+# Archived environments are committed to iruka-archive:<container name>
+ARCHIVE_IMAGE_REPO = "iruka-archive"
+ARCHIVE_LABEL = "iruka.archive"
+
+# Command of a container restored from its archive: setup already happened before the commit
+RESTORE_COMMAND = f"""
+touch /tmp/setup_complete
+echo {READY_MARKER}
+tail -f /dev/null
+"""
+
+
+def idle_action(status: Optional[str], idle_seconds: float) -> Optional[str]:
+    """The hibernation step due for an environment: "pause", "stop", "archive" or None.
+
+    Paused containers are frozen by the cgroup freezer (no CPU, memory kept,
+    resumed in milliseconds with the shell session intact); stopped ones
+    free their memory but need a cold start; archived ones keep only the
+    committed image.
+    """
+    if status in ("running", "paused") and IDLE_STOP_SECONDS and idle_seconds >= IDLE_STOP_SECONDS:
+        return "stop"
+    if status == "running" and IDLE_PAUSE_SECONDS and idle_seconds >= IDLE_PAUSE_SECONDS:
+        return "pause"
+    if status == "stopped" and IDLE_ARCHIVE_SECONDS and idle_seconds >= IDLE_ARCHIVE_SECONDS:
+        return "archive"
+    return None
@@ -0,0 +1,158 @@
+import threading
+from typing import Optional, List, Dict, Any, Tuple
+
+import docker
+
+from .tool_images import ToolImageCache, TOOL_PACKAGES, TOOL_IMAGE_REPO
+from .hibernation import ARCHIVE_IMAGE_REPO
+from .docker_events import DockerEventsFollower
+
+# Repositories of images this backend builds itself, hidden from the catalog unless asked for
+INTERNAL_REPOS = (TOOL_IMAGE_REPO, ARCHIVE_IMAGE_REPO)
+CATALOG_PAGE_MAX = 500
+# Image event actions after which the image is read again (anything but delete)
+REFRESH_ACTIONS = ("pull", "tag", "untag", "import", "load", "build")
+
+
+def _repository(tag: str) -> str:
+    # The tag is after the last colon, unless that colon belongs to a registry host:port
+    name, _, suffix = tag.rpartition(":")
+    return name if name and "/" not in suffix else tag
+
+
+def _entry(image) -> Dict[str, Any]:
+    return {
+        "id": image.id,
+        "tags": list(image.tags),
+        "size": image.attrs.get("Size"),
+        "created": image.attrs.get("Created"),
+    }
+
+
+# --- Image Catalog ---
+
+class ImageCatalog(DockerEventsFollower):
+    """Local images, listed once and then kept current by Docker image events.
+
+    Works like ContainerStateCache: the events thread lists every image
+    (again after each reconnect, to cover missed events) and then re-reads
+    only the image an event names. Whether a tool image exists for an entry
+    is derived from the catalog itself, since a tool image's tag depends
+    only on its base image's tag and id.
+    """
+
+    event_type = "image"
+
+    def __init__(self, client: docker.DockerClient, tool_images: ToolImageCache):
+        super().__init__(client)
+        self.tool_images = tool_images
+        self._lock = threading.Lock()
+        self._images: Dict[str, Dict[str, Any]] = {}  # image id -> entry
+        # (tag, image id, ai_tool) -> tool image tag; hashing the recipe isn't free
+        self._tool_tags: Dict[Tuple[str, str, str], str] = {}
+
+    def reconcile(self):
+        """Replaces the catalog with one listing of all images."""
+        images = {image.id: _entry(image) for image in self.client.images.list()}
+        with self._lock:
+            self._images = images
+            self._tool_tags = {}
+        self.synced = True
+        print(f"Image catalog loaded: {len(images)} images")
+
+    def refresh(self, reference: str):
+        """Reads one image (by id or tag) into the catalog, or drops it if it is gone."""
+        try:
+            image = self.client.images.get(reference)
+        except docker.errors.ImageNotFound:
+            self._remove(reference)
+            return
+        with self._lock:
+            self._images[image.id] = _entry(image)
+            # A tag moved to this image no longer belongs to the one it was on
+            for image_id, entry in self._images.items():
+                if image_id != image.id and set(entry["tags"]) & set(image.tags):
+                    entry["tags"] = [tag for tag in entry["tags"] if tag not in image.tags]
+
+    def _remove(self, reference: str):
+        with self._lock:
+            for image_id, entry in list(self._images.items()):
+                if image_id == reference or reference in entry["tags"]:
+                    del self._images[image_id]
+
+    def _apply(self, event: Dict[str, Any]):
+        action = event.get("Action") or event.get("status") or ""
+        reference = event.get("Actor", {}).get("ID") or event.get("id")
+        if not reference:
+            return
+        if action == "delete":
+            self._remove(reference)
+        elif action in REFRESH_ACTIONS:
+            try:
+                self.refresh(reference)
+            except Exception as e:
+                print(f"Error refreshing image {reference} in the catalog: {e}")
+
+    def tags(self) -> List[str]:
+        """Every tag, sorted (what DockerService.list_images returns)."""
+        with self._lock:
+            return sorted(tag for entry in self._images.values() for tag in entry["tags"])
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """One entry per tag, with the AI tools that have a tool image for it."""
+        with self._lock:
+            images = [dict(entry) for entry in self._images.values()]
+        all_tags = {tag for entry in images for tag in entry["tags"]}
+        items = []
+        for image in images:
+            for tag in image["tags"]:
+                items.append({
+                    "tag": tag,
+                    "repository": _repository(tag),
+                    "id": image["id"],
+                    "size": image["size"],
+                    "created": image["created"],
+                    "tool_images": [ai_tool for ai_tool in TOOL_PACKAGES if self._tool_tag(tag, image["id"], ai_tool) in all_tags],
+                })
+        return items
+
+    def _tool_tag(self, tag: str, image_id: str, ai_tool: str) -> str:
+        key = (tag, image_id, ai_tool)
+        tool_tag = self._tool_tags.get(key)
+        if tool_tag is None:
+            tool_tag = self._tool_tags[key] = self.tool_images.tag_for(tag, image_id, ai_tool)
+        return tool_tag
+
+    def query(
+        self, search: Optional[str] = None, ai_tool: Optional[str] = None, include_internal: bool = False,
+        sort: str = "tag", offset: int = 0, limit: int = 100,
+    ) -> Dict[str, Any]:
+        """A filtered, sorted page of entries plus the total number matching.
+
+        `search` matches anywhere in the tag (case-insensitive); `ai_tool`
+        keeps images that have a tool image for that tool; `sort` is "tag",
+        "size" or "created" (the latter two largest / newest first).
+        """
+        items = self.entries()
+        if not include_internal:
+            items = [item for item in items if item["repository"] not in INTERNAL_REPOS]
+        if search:
+            needle = search.lower()
+            items = [item for item in items if needle in item["tag"].lower()]
+        if ai_tool:
+            items = [item for item in items if ai_tool in item["tool_images"]]
+        if sort == "size":
+            items.sort(key=lambda item: item["size"] or 0, reverse=True)
+        elif sort == "created":
+            items.sort(key=lambda item: item["created"] or "", reverse=True)
+        else:
+            items.sort(key=lambda item: item["tag"])
+        limit = max(1, min(limit, CATALOG_PAGE_MAX))
+        offset = max(0, offset)
+        return {
+            "total": len(items),
+            "offset": offset,
+            "limit": limit,
+            "items": items[offset:offset + limit],
+            "synced": self.synced,
+        }
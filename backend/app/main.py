@@ -1,57 +1,155 @@
 from fastapi import FastAPI, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from .api import auth_router, api_router
+from .api import auth_router, api_router, watch_environment_readiness, environment_resources, remove_environment_entries
 from . import websocket
+from .registry import environment_registry
 import asyncio
 import time
 from .services import project_service, docker_service
+from .docker_async import async_docker
+from .runtime_state import runtime_state
+from .store import db_store
+from .file_watch import file_watcher
+from .admission import admission
+from .hibernation import idle_action, IDLE_CHECK_INTERVAL
+from .sessions import session_manager
 
 app = FastAPI()
 
-# --- Background Task for Cleanup ---
+# --- Background Task for Idle Hibernation ---
+async def hibernate_environment(project_name: str, env: dict, action: str):
+    """Applies one hibernation step (see hibernation.idle_action) to an idle environment."""
+    container_name = environment_registry.handle(project_name, env["id"], env).container_name
+    if action == "pause":
+        await async_docker.pause_container(container_name)
+        project_service.update_environment_status(project_name, env["id"], {"status": "paused"})
+    elif action == "stop":
+        await async_docker.stop_container(container_name)
+        admission.release((project_name, env["id"]))
+        project_service.update_environment_status(project_name, env["id"], {"status": "stopped"})
+    elif action == "archive":
+        archive_image = await async_docker.archive_container(container_name)
+        project_service.update_environment_status(project_name, env["id"], {"status": "archived", "archive_image": archive_image})
+
 async def cleanup_inactive_environments():
-    """Periodically checks for inactive environments and stops them."""
+    """Periodically moves environments nobody is using down the hibernation tiers."""
     while True:
-        print("Running cleanup task for inactive environments...")
         try:
-            projects = project_service.get_projects()
-            for project in projects:
-                environments = project.get("environments", [])
-                for env in environments:
-                    if env.get("status") == "running" and env.get("disconnected_at"):
-                        inactive_time = time.time() - env["disconnected_at"]
-                        if inactive_time > 300:  # 5 minutes
-                            print(f"Environment {env['id']} in project {project['name']} has been inactive for {inactive_time:.0f}s. Stopping container.")
-                            
-                            # Determine container name based on AI tool
-                            ai_tool = env.get("ai_tool", "gemini")
-                            sane_project_name = websocket.sanitize_for_docker(project['name'])
-                            sane_env_id = websocket.sanitize_for_docker(env['id'])
-                            
-                            if ai_tool == "claude":
-                                container_name = f"claude-env-{sane_project_name}-{sane_env_id}"
-                            else:
-                                container_name = f"gemini-env-{sane_project_name}-{sane_env_id}"
-                            
-                            try:
-                                docker_service.stop_container(container_name)
-                                project_service.update_environment_status(
-                                    project['name'], 
-                                    env['id'], 
-                                    {"status": "stopped", "disconnected_at": None}
-                                )
-                                print(f"Successfully stopped container {container_name} and updated status.")
-                            except Exception as e:
-                                print(f"Error stopping container {container_name}: {e}")
+            # A detached session still producing output (e.g. a long agent run) counts as activity
+            runtime_state.publish_activity(session_manager.output_times())
+            activity = runtime_state.shared_activity()
+            now = time.time()
+            for project in project_service.get_projects():
+                for env in project.get("environments", []):
+                    if env.get("connections") or not env.get("disconnected_at"):
+                        continue
+                    # Clients attached to any worker hold a lease that ends in the future
+                    inactive_time = now - max(env["disconnected_at"], activity.get((project["name"], env["id"]), 0))
+                    action = idle_action(env.get("status"), inactive_time)
+                    if action is None:
+                        continue
+                    print(f"Environment {env['id']} in project {project['name']} has been inactive for {inactive_time:.0f}s: {action}")
+                    try:
+                        await hibernate_environment(project["name"], env, action)
+                    except Exception as e:
+                        print(f"Error applying {action} to environment {env['id']}: {e}")
         except Exception as e:
             print(f"Error in cleanup task: {e}")
         
-        await asyncio.sleep(60)  # Check every 60 seconds
+        await asyncio.sleep(IDLE_CHECK_INTERVAL)
+
+# --- Container State Reconciliation ---
+def sync_environment_status(project_name: str, env: dict, container_status):
+    """Brings an environment's status in line with its container's actual state."""
+    if container_status in (None, "exited", "dead"):
+        # Pending environments whose container doesn't exist yet may still be being created
+        if env.get("status") in ("running", "paused") or (env.get("status") == "pending" and container_status is not None):
+            print(f"Container for {project_name}/{env['id']} is {container_status or 'gone'}, marking environment stopped")
+            project_service.update_environment_status(project_name, env["id"], {"status": "stopped"})
+            admission.release((project_name, env["id"]))
+    elif container_status == "running" and env.get("status") == "paused":
+        project_service.update_environment_status(project_name, env["id"], {"status": "running"})
+    elif container_status == "running" and env.get("status") == "stopped":
+        # Started outside the backend: it uses host capacity all the same
+        admission.commit((project_name, env["id"]), environment_resources(env))
+        project_service.update_environment_status(project_name, env["id"], {"status": "running"})
+
+def on_container_state(container_name: str, state):
+    """Container events listener: keeps the affected environment's status accurate."""
+    handle = environment_registry.by_container(container_name)
+    if handle is None:
+        return
+    env = project_service.get_environment(handle.project_name, handle.env_id)
+    if env is None:
+        environment_registry.forget(handle.project_name, handle.env_id)
+        return
+    sync_environment_status(handle.project_name, env, state["status"] if state else None)
+
+def reconcile_environments():
+    """Checks every environment against the freshly listed containers."""
+    for project in project_service.get_projects():
+        for env in project.get("environments", []):
+            container_name = environment_registry.handle(project["name"], env["id"], env).container_name
+            # Unlabelled (older) containers aren't in the listing; look those up once
+            state = docker_service.container_states.get(container_name) or docker_service.container_states.refresh(container_name)
+            sync_environment_status(project["name"], env, state["status"] if state else None)
+
+def settle_queued_environment(project_name: str, env: dict):
+    """The admission queue doesn't survive a restart: settles an environment that was waiting in it.
+
+    A queued start still has its container (or archive) and is marked stopped,
+    to be started again. A queued creation has nothing to start and its
+    creation options weren't kept, so its entry is removed.
+    """
+    container_name = environment_registry.handle(project_name, env["id"], env).container_name
+    try:
+        exists = env.get("archive_image") or docker_service.container_states.refresh(container_name) is not None
+    except Exception as e:
+        print(f"Could not look up container {container_name}: {e}")
+        exists = True
+    if exists:
+        print(f"Environment {project_name}/{env['id']} was queued before the restart, marking it stopped")
+        project_service.update_environment_status(project_name, env["id"], {"status": "stopped"})
+    else:
+        print(f"Environment {project_name}/{env['id']} was queued for creation before the restart, removing it")
+        remove_environment_entries(project_name, {env["id"]})
 
 @app.on_event("startup")
 async def startup_event():
     """Create a background task for cleanup on startup."""
+    # Before anything else: a second worker would double the admitted capacity and run its own pool
+    admission.claim_host()
     asyncio.create_task(cleanup_inactive_environments())
+    # Keep this worker's cached store coherent with writes from other workers
+    db_store.watch(file_watcher, runtime_state.invalidate)
+    file_watcher.start()
+    # Resume readiness watches for environments that were still being set up, and
+    # count what running environments have committed before admitting new ones
+    for project in project_service.get_projects():
+        for env in project.get("environments", []):
+            if env.get("status") in ("running", "pending", "paused"):
+                admission.commit((project["name"], env["id"]), environment_resources(env))
+            if env.get("status") == "pending":
+                container_name = environment_registry.handle(project["name"], env["id"], env).container_name
+                watch_environment_readiness(project["name"], env["id"], container_name, check_existing=True)
+            elif env.get("status") == "queued":
+                settle_queued_environment(project["name"], env)
+    # One listing of managed containers, then Docker events keep container state current
+    docker_service.container_states.add_listener(on_container_state)
+    docker_service.container_states.add_reconcile_listener(reconcile_environments)
+    docker_service.container_states.start()
+    # Likewise one listing of images, kept current by image events
+    docker_service.images.start()
+    docker_service.warm_pool.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Persist any runtime state still waiting for its batched flush."""
+    await file_watcher.stop()
+    docker_service.container_states.stop()
+    docker_service.images.stop()
+    docker_service.warm_pool.stop()
+    runtime_state.flush()
 
 # Configure CORS
 app.add_middleware(
@@ -0,0 +1,76 @@
+import threading
+from typing import Callable, Set
+
+import docker
+
+# Printed by the setup script once /tmp/setup_complete exists
+READY_MARKER = "IRUKA_SETUP_COMPLETE"
+
+# --- Environment Readiness ---
+
+class ReadinessTracker:
+    """Detects when an environment's setup finishes, once per container.
+
+    A watcher thread follows the container's log stream until the setup
+    script prints READY_MARKER; from then on readiness is answered from
+    memory. Containers created before the marker existed are checked with a
+    single exec when their watch starts.
+    """
+
+    def __init__(self, client: docker.DockerClient):
+        self.client = client
+        self._lock = threading.Lock()
+        self._ready: Set[str] = set()
+        self._watching: Set[str] = set()
+
+    def is_ready(self, container_name: str) -> bool:
+        return container_name in self._ready
+
+    def mark_ready(self, container_name: str):
+        self._ready.add(container_name)
+
+    def forget(self, container_name: str):
+        """Drops cached state, e.g. because the container was removed."""
+        self._ready.discard(container_name)
+
+    def watch(self, container_name: str, on_ready: Callable[[], None], check_existing: bool = False):
+        """Calls `on_ready` (from a background thread) once setup has completed."""
+        if container_name in self._ready:
+            # Still off the caller's thread: callers may be on the event loop and on_ready may block
+            threading.Thread(target=on_ready, name=f"ready-{container_name}", daemon=True).start()
+            return
+        with self._lock:
+            if container_name in self._watching:
+                return
+            self._watching.add(container_name)
+        thread = threading.Thread(
+            target=self._follow, args=(container_name, on_ready, check_existing),
+            name=f"ready-{container_name}", daemon=True,
+        )
+        thread.start()
+
+    def _follow(self, container_name: str, on_ready: Callable[[], None], check_existing: bool):
+        try:
+            container = self.client.containers.get(container_name)
+            if check_existing and container.status == "running" and \
+                    container.exec_run("test -f /tmp/setup_complete").exit_code == 0:
+                self._ready.add(container_name)
+            else:
+                pending = b""
+                # Includes output from before the watch started, so the marker can't be missed
+                for chunk in container.logs(stream=True, follow=True):
+                    pending += chunk
+                    *lines, pending = pending.split(b"\n")
+                    if any(line.strip() == READY_MARKER.encode() for line in lines):
+                        self._ready.add(container_name)
+                        break
+            if container_name in self._ready:
+                print(f"Environment container {container_name} is ready")
+                on_ready()
+        except docker.errors.NotFound:
+            print(f"Container {container_name} not found, not watching for readiness")
+        except Exception as e:
+            print(f"Error watching readiness of {container_name}: {e}")
+        finally:
+            with self._lock:
+                self._watching.discard(container_name)
@@ -0,0 +1,155 @@
+import re
+import threading
+import time
+from typing import Optional, Dict, Any, Set, Tuple
+
+from .services import project_service, docker_service
+from .container_state import LEGACY_NAME_PREFIXES
+
+# Environment containers are named "<tool>-env-<project>-<env>", which is also
+# how container events without the managed label are recognised
+ENVIRONMENT_NAME_PREFIXES = LEGACY_NAME_PREFIXES
+
+
+def sanitize_for_docker(name: str) -> str:
+    """Sanitizes a string to be a valid Docker container name."""
+    # Remove any characters not allowed by Docker
+    sanitized = re.sub(r'[^a-zA-Z0-9_.-]', '', name)
+    # Ensure it doesn't start with a forbidden character
+    if sanitized.startswith(('_', '.', '-')):
+        sanitized = 'container' + sanitized
+    return sanitized
+
+
+def environment_tool(ai_tool: Optional[str]) -> str:
+    """The AI tool an environment runs; Gemini unless it says Claude."""
+    return "claude" if ai_tool == "claude" else "gemini"
+
+
+def container_name_for(project_name: str, env_id: str, ai_tool: Optional[str]) -> str:
+    return f"{environment_tool(ai_tool)}-env-{sanitize_for_docker(project_name)}-{sanitize_for_docker(env_id)}"
+
+
+# --- Environment Handles ---
+
+class EnvironmentHandle:
+    """An environment's runtime identity: container name, tool, execs and attached clients.
+
+    Container id and status come from the events-fed ContainerStateCache, so
+    reading them never asks the daemon.
+    """
+
+    def __init__(self, project_name: str, env_id: str, ai_tool: Optional[str]):
+        self.project_name = project_name
+        self.env_id = env_id
+        self.ai_tool = environment_tool(ai_tool)
+        self.container_name = container_name_for(project_name, env_id, ai_tool)
+        self.exec_ids: Set[str] = set()  # Shell execs of live sessions
+        self.attached = 0  # Clients attached to the shell session
+        self.last_activity = time.time()
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.project_name, self.env_id)
+
+    @property
+    def container_id(self) -> Optional[str]:
+        state = docker_service.container_states.get(self.container_name)
+        return state["id"] if state else None
+
+    @property
+    def container_status(self) -> Optional[str]:
+        return docker_service.container_states.status(self.container_name)
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "project": self.project_name,
+            "env": self.env_id,
+            "ai_tool": self.ai_tool,
+            "container_name": self.container_name,
+            "container_id": self.container_id,
+            "container_status": self.container_status,
+            "exec_ids": sorted(self.exec_ids),
+            "attached": self.attached,
+            "last_activity": self.last_activity,
+        }
+
+
+class EnvironmentRegistry:
+    """One EnvironmentHandle per (project, env), shared by the API, WebSocket and cleanup paths.
+
+    Handles are created on first use and looked up by key or by container
+    name; a container name not seen yet triggers one pass over the stored
+    environments (e.g. ones another worker created) before it is treated as
+    unknown. A handle whose AI tool no longer matches the stored environment
+    (recreated by another worker with a different tool) is rebuilt, since
+    the tool is part of the container name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles: Dict[Tuple[str, str], EnvironmentHandle] = {}
+        self._by_container: Dict[str, EnvironmentHandle] = {}
+
+    def _add(self, project_name: str, env_id: str, ai_tool: Optional[str]) -> EnvironmentHandle:
+        with self._lock:
+            handle = self._handles.get((project_name, env_id))
+            if handle is not None and handle.ai_tool != environment_tool(ai_tool):
+                if self._by_container.get(handle.container_name) is handle:
+                    del self._by_container[handle.container_name]
+                handle = None
+            if handle is None:
+                handle = EnvironmentHandle(project_name, env_id, ai_tool)
+                self._handles[handle.key] = handle
+                # Names can collide after sanitising; the first environment keeps the container
+                self._by_container.setdefault(handle.container_name, handle)
+            return handle
+
+    def get(self, project_name: str, env_id: str) -> Optional[EnvironmentHandle]:
+        return self._handles.get((project_name, env_id))
+
+    def handle(self, project_name: str, env_id: str, env: Optional[Dict[str, Any]] = None) -> Optional[EnvironmentHandle]:
+        """The environment's handle; None if no such environment exists.
+
+        Pass `env` when it's already at hand to skip the store lookup; the
+        handle is then also checked against its AI tool.
+        """
+        handle = self._handles.get((project_name, env_id))
+        if handle is not None and (env is None or handle.ai_tool == environment_tool(env.get("ai_tool"))):
+            return handle
+        if env is None:
+            env = project_service.get_environment(project_name, env_id)
+            if env is None:
+                return None
+        return self._add(project_name, env_id, env.get("ai_tool"))
+
+    def by_container(self, container_name: str) -> Optional[EnvironmentHandle]:
+        handle = self._by_container.get(container_name)
+        if handle is None and container_name.startswith(ENVIRONMENT_NAME_PREFIXES):
+            self.load()
+            handle = self._by_container.get(container_name)
+        return handle
+
+    def load(self):
+        """Adds handles for every stored environment that doesn't have an up-to-date one."""
+        for project in project_service.get_projects():
+            for env in project.get("environments", []):
+                handle = self._handles.get((project["name"], env["id"]))
+                if handle is None or handle.ai_tool != environment_tool(env.get("ai_tool")):
+                    self._add(project["name"], env["id"], env.get("ai_tool"))
+
+    def forget(self, project_name: str, env_id: str):
+        """Drops a deleted environment's handle."""
+        with self._lock:
+            handle = self._handles.pop((project_name, env_id), None)
+            if handle is not None and self._by_container.get(handle.container_name) is handle:
+                del self._by_container[handle.container_name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"environments": [handle.snapshot() for handle in list(self._handles.values())]}
+
+
+environment_registry = EnvironmentRegistry()
@@ -0,0 +1,328 @@
+import asyncio
+import codecs
+import itertools
+import os
+import socket
+import ssl
+import time
+import zlib
+from typing import Optional, Dict, Any, Union, Callable
+
+# Read sizes for the exec socket. Reads start small so keystroke echoes stay
+# cheap and grow (up to the max) while the shell keeps filling the buffer.
+READ_SIZE_MIN = 4096
+READ_SIZE_MAX = 65536
+# Output coalescing: during bursts send at most one frame per window, capped in size
+OUTPUT_FLUSH_WINDOW_MS = 5
+OUTPUT_FRAME_MAX = 65536
+# Per-client cap on output waiting to be sent; past it the client falls behind (see OutputCoalescer)
+OUTPUT_BUFFER_MAX = int(os.environ.get("OUTPUT_BUFFER_MAX", 1024 * 1024))
+# Sent ahead of the scrollback when a client that fell behind is caught up: a full terminal reset (RIS)
+RESYNC_PREFIX = b'\x1bc'
+# Optional application-level compression of binary output frames
+COMPRESS_MIN_BYTES = 256
+COMPRESS_LEVEL = 3
+FRAME_RAW = b'\x00'
+FRAME_DEFLATE = b'\x01'
+
+# --- Docker Exec Socket Stream ---
+
+def _raw_socket(shell_socket) -> Optional[socket.socket]:
+    """Returns the plain socket behind docker-py's exec socket, if there is one.
+
+    docker-py hands back either a socket or a SocketIO wrapper around one.
+    TLS sockets can't be driven by the event loop's sock_* API, so those (and
+    anything unexpected) return None and are read through the executor.
+    """
+    sock = getattr(shell_socket, '_sock', shell_socket)
+    if not isinstance(sock, socket.socket) or isinstance(sock, ssl.SSLSocket):
+        return None
+    return sock
+
+
+class ShellStream:
+    """Async reads and writes on a hijacked Docker exec socket.
+
+    The socket is switched to non-blocking mode and serviced by the event loop
+    (`loop.sock_recv`/`sock_sendall`), so an idle session costs a registered
+    file descriptor rather than a parked executor thread.
+    """
+
+    def __init__(self, shell_socket):
+        self.shell_socket = shell_socket
+        self.read_size = READ_SIZE_MIN
+        self._sock = _raw_socket(shell_socket)
+        if self._sock is not None:
+            self._sock.setblocking(False)
+
+    async def read(self) -> bytes:
+        """Returns the next chunk of shell output, or b'' once the socket is closed."""
+        loop = asyncio.get_running_loop()
+        if self._sock is not None:
+            data = await loop.sock_recv(self._sock, self.read_size)
+        else:
+            data = await loop.run_in_executor(None, self._blocking_read, self.read_size)
+        self._adapt_read_size(len(data))
+        return data
+
+    async def write(self, data: bytes):
+        loop = asyncio.get_running_loop()
+        if self._sock is not None:
+            await loop.sock_sendall(self._sock, data)
+        elif hasattr(self.shell_socket, 'sendall'):
+            await loop.run_in_executor(None, self.shell_socket.sendall, data)
+        else:
+            await loop.run_in_executor(None, self.shell_socket.write, data)
+
+    def close(self):
+        self.shell_socket.close()
+
+    def _blocking_read(self, size: int) -> bytes:
+        if hasattr(self.shell_socket, 'recv'):
+            return self.shell_socket.recv(size)
+        return self.shell_socket.read(size) or b''
+
+    def _adapt_read_size(self, received: int):
+        if received >= self.read_size:
+            self.read_size = min(self.read_size * 2, READ_SIZE_MAX)
+        elif received < self.read_size // 4:
+            self.read_size = max(self.read_size // 2, READ_SIZE_MIN)
+
+
+# --- Output Framing ---
+
+class OutputCoalescer:
+    """Collects shell output and releases it as fewer, larger frames.
+
+    Output arriving after a quiet period is released immediately so keystroke
+    echoes aren't delayed; during a burst at most one frame is released per
+    `flush_window` seconds, or as soon as `max_frame` bytes are pending.
+
+    The buffer is bounded. `offer()` never waits: once `capacity` bytes are
+    pending the client is behind, and output is dropped for it until it has
+    sent everything pending. It then gets RESYNC_PREFIX plus a fresh `replay()`
+    (the session's scrollback) and continues live, so one slow client costs
+    the others nothing. The reader uses `wait_for_space()` to pause the exec
+    socket only when every client is full.
+    """
+
+    def __init__(self, flush_window: float, max_frame: int, capacity: int = OUTPUT_BUFFER_MAX,
+                 stats: Optional["SessionStats"] = None, replay: Optional[Callable[[], bytes]] = None):
+        self.flush_window = flush_window
+        self.max_frame = max_frame
+        self.capacity = max(capacity, max_frame)
+        self.stats = stats
+        self.replay = replay
+        self._buffer = bytearray()
+        self._data_ready = asyncio.Event()
+        self._frame_full = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._closed = False
+        self._behind = False
+        self._last_frame_at = 0.0
+
+    @property
+    def full(self) -> bool:
+        return len(self._buffer) >= self.capacity and not self._closed
+
+    def offer(self, data: bytes) -> bool:
+        """Queues output unless the client is behind; False if it was dropped."""
+        if self._behind or self.full:
+            if not self._behind and self.stats is not None:
+                self.stats.record_resync()
+            self._behind = True
+            return False
+        self._append(data)
+        return True
+
+    async def wait_for_space(self):
+        """Waits until `offer()` would take output again (or the coalescer is closed)."""
+        if not self.full:
+            return
+        loop = asyncio.get_running_loop()
+        throttled_since = loop.time()
+        while self.full:
+            self._space_available.clear()
+            await self._space_available.wait()
+        if self.stats is not None:
+            self.stats.record_throttle(loop.time() - throttled_since)
+
+    def _append(self, data: bytes):
+        self._buffer += data
+        self._data_ready.set()
+        if len(self._buffer) >= self.max_frame:
+            self._frame_full.set()
+
+    def close(self):
+        """No more output will arrive; pending bytes are still handed out."""
+        self._closed = True
+        self._data_ready.set()
+        self._frame_full.set()
+        self._space_available.set()
+
+    async def next_frame(self) -> bytes:
+        """Waits for the next frame; returns b'' once closed and drained."""
+        loop = asyncio.get_running_loop()
+        while not self._buffer:
+            if self._behind and not self._closed:
+                # Caught up with what was queued: repaint from the scrollback and go live again
+                self._behind = False
+                self._append(RESYNC_PREFIX + (self.replay() if self.replay is not None else b''))
+                break
+            if self._closed:
+                return b''
+            self._data_ready.clear()
+            await self._data_ready.wait()
+
+        wait = self._last_frame_at + self.flush_window - loop.time()
+        if wait > 0 and len(self._buffer) < self.max_frame and not self._closed:
+            self._frame_full.clear()
+            try:
+                await asyncio.wait_for(self._frame_full.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+        frame = bytes(self._buffer[:self.max_frame])
+        del self._buffer[:self.max_frame]
+        self._last_frame_at = loop.time()
+        if len(self._buffer) < self.capacity:
+            self._space_available.set()
+        return frame
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._buffer)
+
+
+class OutputEncoder:
+    """Converts output frames to the connection's negotiated wire format.
+
+    "binary" sends the raw bytes as binary WebSocket frames (the client
+    decodes UTF-8). "text" keeps the original text-frame protocol but decodes
+    incrementally, so multibyte characters split across reads survive.
+
+    With `compress` (binary mode only) every frame starts with a type byte:
+    0x00 is followed by raw output; 0x01 by a 4-byte big-endian uncompressed
+    length and a sync-flushed chunk of one raw-deflate stream that lasts for
+    the whole connection, so earlier output acts as the shared dictionary.
+    Frames under COMPRESS_MIN_BYTES (keystroke echoes) are always sent raw.
+    """
+
+    def __init__(self, mode: str = "text", compress: bool = False, stats: Optional["SessionStats"] = None):
+        self.binary = mode == "binary"
+        self.compress = compress and self.binary
+        self.stats = stats
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self._compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15) if self.compress else None
+
+    def encode(self, frame: bytes) -> Union[bytes, str, None]:
+        """Returns the wire payload for `frame` (None if there is nothing to send yet)."""
+        if not self.binary:
+            text = self._decoder.decode(frame)
+            if not text:
+                return None
+            self._record(len(frame), len(frame))
+            return text
+
+        if not self.compress:
+            payload = frame
+        elif len(frame) < COMPRESS_MIN_BYTES:
+            payload = FRAME_RAW + frame
+        else:
+            deflated = self._compressor.compress(frame) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+            payload = FRAME_DEFLATE + len(frame).to_bytes(4, 'big') + deflated
+        self._record(len(frame), len(payload))
+        return payload
+
+    async def send(self, websocket, frame: bytes):
+        payload = self.encode(frame)
+        if isinstance(payload, str):
+            await websocket.send_text(payload)
+        elif payload is not None:
+            await websocket.send_bytes(payload)
+
+    def _record(self, raw_bytes: int, wire_bytes: int):
+        if self.stats is not None:
+            self.stats.record_output(raw_bytes, wire_bytes)
+
+
+# --- Relay Statistics ---
+
+class SessionStats:
+    """Byte and flow-control counters for one shell relay session."""
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.started_at = time.time()
+        self.frames = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.throttle_events = 0
+        self.throttled_seconds = 0.0
+        self.resyncs = 0  # Times the client fell behind and was repainted from scrollback
+        self.buffer: Optional[OutputCoalescer] = None
+
+    def record_output(self, raw_bytes: int, wire_bytes: int):
+        self.frames += 1
+        self.raw_bytes += raw_bytes
+        self.wire_bytes += wire_bytes
+
+    def record_throttle(self, seconds: float):
+        self.throttle_events += 1
+        self.throttled_seconds += seconds
+
+    def record_resync(self):
+        self.resyncs += 1
+
+    def merge(self, other: "SessionStats"):
+        self.frames += other.frames
+        self.raw_bytes += other.raw_bytes
+        self.wire_bytes += other.wire_bytes
+        self.throttle_events += other.throttle_events
+        self.throttled_seconds += other.throttled_seconds
+        self.resyncs += other.resyncs
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "frames": self.frames,
+            "raw_bytes": self.raw_bytes,
+            "wire_bytes": self.wire_bytes,
+            "bytes_saved": self.raw_bytes - self.wire_bytes,
+            "throttle_events": self.throttle_events,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "resyncs": self.resyncs,
+            "buffered_bytes": self.buffer.pending_bytes if self.buffer is not None else 0,
+        }
+
+
+class RelayStats:
+    """Tracks live sessions plus running totals, including closed sessions."""
+
+    def __init__(self):
+        self.sessions: Dict[str, SessionStats] = {}
+        self._closed = SessionStats("closed")
+        self._counter = itertools.count(1)
+
+    def open(self, label: str) -> SessionStats:
+        stats = SessionStats(f"{label}#{next(self._counter)}")
+        self.sessions[stats.name] = stats
+        return stats
+
+    def close(self, stats: SessionStats):
+        if self.sessions.pop(stats.name, None) is not None:
+            self._closed.merge(stats)
+
+    def snapshot(self) -> Dict[str, Any]:
+        totals = SessionStats("total")
+        totals.merge(self._closed)
+        for stats in self.sessions.values():
+            totals.merge(stats)
+        return {
+            "totals": totals.snapshot(),
+            "sessions": [stats.snapshot() for stats in self.sessions.values()],
+        }
+
+
+relay_stats = RelayStats()
@@ -0,0 +1,170 @@
+import os
+import socket
+import threading
+import time
+from typing import Optional, Dict, Any, Tuple, Set
+
+from .store import StorageBackend, ActivityTimes, db_store
+
+# Environment fields that describe what is happening right now rather than how
+# the environment is configured. They live here instead of in db.json.
+RUNTIME_FIELDS = ("status", "disconnected_at", "sessionId", "connections")
+FLUSH_INTERVAL_MS = 500  # Coalesce runtime writes into at most one flush per interval
+# Identifies this process's activity report among the other workers'
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+# How long a report counts without being renewed; the idle check renews it every IDLE_CHECK_INTERVAL
+WORKER_LEASE_SECONDS = int(os.environ.get("WORKER_LEASE_SECONDS", 120))
+
+# --- Runtime State Layer ---
+
+class RuntimeState:
+    """Ephemeral per-environment state with coalesced, batched persistence.
+
+    Updates only touch memory and mark the entry dirty; a single timer flushes
+    all pending changes at most once every `flush_interval_ms`, writing only
+    the dirty entries so other worker processes' entries are left alone.
+    Call `flush()` on shutdown to persist whatever is still pending.
+
+    Connection counts and shell sessions only mean something in the process
+    holding them, so each worker also publishes a short lease
+    (`publish_activity`) with the environments it has clients on and when its
+    sessions last produced output; `shared_activity` tells the idle check
+    about activity on any worker.
+    """
+
+    def __init__(self, backend: StorageBackend = db_store, flush_interval_ms: int = FLUSH_INTERVAL_MS):
+        self.backend = backend
+        self.flush_interval = flush_interval_ms / 1000
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._entries: Optional[Dict[Tuple[str, str], Dict[str, Any]]] = None
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._stale = False
+        self._timer: Optional[threading.Timer] = None
+        self._output_at: ActivityTimes = {}
+
+    def _ensure_loaded(self) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        if self._entries is None:
+            now = time.time()
+            self._entries = self.backend.load_runtime_state()
+            for fields in self._entries.values():
+                # This process's connections don't survive its restart; environments
+                # that had clients attached count as disconnected from now on (the
+                # idle check still honours other workers' leases).
+                if fields.get("connections"):
+                    fields["disconnected_at"] = now
+                fields["connections"] = 0
+        elif self._stale:
+            self._stale = False
+            self._merge_external(self.backend.load_runtime_state())
+        return self._entries
+
+    def _merge_external(self, external: Dict[Tuple[str, str], Dict[str, Any]]):
+        """Adopts entries written by other workers, keeping our unflushed changes."""
+        for key in list(self._entries):
+            if key not in external and key not in self._dirty:
+                del self._entries[key]
+        for key, fields in external.items():
+            if key in self._dirty:
+                continue
+            # Connection counts are per process; never take another worker's
+            fields["connections"] = self._entries.get(key, {}).get("connections", 0)
+            self._entries[key] = fields
+
+    def invalidate(self):
+        """Called by the file watcher when another process flushed runtime state."""
+        self._stale = True
+
+    def get(self, project_name: str, env_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._ensure_loaded().get((project_name, env_id), {}))
+
+    def update(self, project_name: str, env_id: str, updates: Dict[str, Any]):
+        with self._lock:
+            key = (project_name, env_id)
+            entry = self._ensure_loaded().setdefault(key, {})
+            if any(k not in entry or entry[k] != value for k, value in updates.items()):
+                entry.update(updates)
+                self._mark_dirty(key)
+
+    def adjust_connections(self, project_name: str, env_id: str, delta: int) -> int:
+        """Adds `delta` to the environment's live connection count and returns it."""
+        with self._lock:
+            key = (project_name, env_id)
+            entry = self._ensure_loaded().setdefault(key, {})
+            previous = entry.get("connections", 0)
+            entry["connections"] = max(0, previous + delta)
+            self._mark_dirty(key)
+            count = entry["connections"]
+        if (previous == 0) != (count == 0):
+            # Other workers must see the first client (or the last one leaving) right away
+            self.publish_activity()
+        return count
+
+    def publish_activity(self, output_at: Optional[ActivityTimes] = None):
+        """Renews this worker's lease: environments with clients attached, and session output.
+
+        `output_at` maps environments to their session's last output; when
+        omitted, the times from the previous call are published again.
+        """
+        expires_at = time.time() + WORKER_LEASE_SECONDS
+        with self._lock:
+            if output_at is not None:
+                self._output_at = dict(output_at)
+            activity = dict(self._output_at)
+            for key, fields in self._ensure_loaded().items():
+                if fields.get("connections"):
+                    activity[key] = expires_at
+        try:
+            self.backend.save_worker_activity(WORKER_ID, activity, expires_at)
+        except Exception as e:
+            print(f"Error publishing worker activity: {e}")
+
+    def shared_activity(self) -> ActivityTimes:
+        """Latest activity any live worker (this one included) reports per environment.
+
+        An environment with clients attached is reported as active until its
+        lease runs out, i.e. in the future.
+        """
+        try:
+            return self.backend.load_worker_activity()
+        except Exception as e:
+            print(f"Error loading worker activity: {e}")
+            return {}
+
+    def remove(self, project_name: str, env_id: str):
+        with self._lock:
+            key = (project_name, env_id)
+            if self._ensure_loaded().pop(key, None) is not None:
+                self._mark_dirty(key)
+
+    def _mark_dirty(self, key: Tuple[str, str]):
+        self._dirty.add(key)
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes all pending runtime changes in one go."""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                dirty, self._dirty = self._dirty, set()
+                updates = {key: dict(self._entries[key]) for key in dirty if key in self._entries}
+                removed = [key for key in dirty if key not in self._entries]
+            # Persist outside the state lock so updates never wait on disk I/O
+            try:
+                self.backend.save_runtime_state(updates, removed)
+            except Exception as e:
+                print(f"Error flushing runtime state: {e}")
+                with self._lock:
+                    for key in dirty:
+                        self._mark_dirty(key)
+
+
+runtime_state = RuntimeState()
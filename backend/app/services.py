@@ -1,86 +1,152 @@
-import json
 import docker
 import traceback
-import git
-import tempfile
-import shutil
-from typing import Optional, List, Dict, Any
+import threading
+import time
+import os
+from typing import Optional, List, Dict, Any, Tuple, Set
+
+from .store import StorageBackend, db_store
+from .runtime_state import RuntimeState, RUNTIME_FIELDS, runtime_state
+from .tool_images import ToolImageCache, tool_install_script, tool_marker, launcher_install_script, shell_command, SHELL_LAUNCHER
+from .warm_pool import WarmPool, CLAUDE_SESSIONS_DIR, CLAUDE_SESSIONS_MOUNT
+from .git_mirror import GitMirrorCache
+from .readiness import ReadinessTracker, READY_MARKER
+from .status_events import status_hub
+from .container_state import ContainerStateCache, MANAGED_LABEL
+from .image_catalog import ImageCatalog
+from .admission import run_limits, update_limits
+from .hibernation import ARCHIVE_IMAGE_REPO, ARCHIVE_LABEL, RESTORE_COMMAND
 
 # --- Data Persistence Service ---
 
 class ProjectService:
-    def __init__(self, db_path: str = 'data/db.json'):
-        self.db_path = db_path
+    """Durable project config lives in the store; runtime fields in `runtime`.
 
-    def _load_data(self) -> Dict[str, List[Dict[str, Any]]]:
-        try:
-            with open(self.db_path, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            # If file doesn't exist or is empty/corrupted, start fresh
-            return {"users": [], "projects": []}
+    Environments handed out by this service are the durable entry overlaid
+    with its runtime state, and updates are split back into the two layers.
+    """
+
+    def __init__(self, store: StorageBackend = db_store, runtime: RuntimeState = runtime_state):
+        self.store = store
+        self.runtime = runtime
+
+    def _with_runtime(self, project: Dict[str, Any]) -> Dict[str, Any]:
+        for env in project.get("environments", []):
+            env.update(self.runtime.get(project["name"], env["id"]))
+        return project
 
-    def _save_data(self, data: Dict[str, List[Dict[str, Any]]]):
-        with open(self.db_path, 'w') as f:
-            json.dump(data, f, indent=2)
+    def _split_runtime(self, fields: Dict[str, Any]):
+        durable = {k: v for k, v in fields.items() if k not in RUNTIME_FIELDS}
+        runtime = {k: v for k, v in fields.items() if k in RUNTIME_FIELDS}
+        return durable, runtime
+
+    def _store_environments(self, project_name: str, environments: List[Dict[str, Any]], existing_ids=frozenset()) -> List[Dict[str, Any]]:
+        """Returns the durable env entries; only new environments seed their runtime fields.
+
+        Existing environments' runtime fields are whatever the caller read
+        earlier and may be stale, so they are dropped; runtime changes go
+        through update_environment_status.
+        """
+        durable_envs = []
+        for env in environments:
+            durable, runtime = self._split_runtime(env)
+            if runtime and env["id"] not in existing_ids:
+                self.runtime.update(project_name, env["id"], runtime)
+            durable_envs.append(durable)
+        return durable_envs
 
     # Project-specific methods
     def get_projects(self) -> List[Dict[str, Any]]:
-        data = self._load_data()
-        return data.get("projects", [])
+        return [self._with_runtime(p) for p in self.store.list_projects()]
 
     def get_project(self, name: str) -> Optional[Dict[str, Any]]:
-        projects = self.get_projects()
-        for p in projects:
-            if p.get("name") == name:
-                return p
-        return None
+        project = self.store.get_project(name)
+        return self._with_runtime(project) if project else None
+
+    def get_environment(self, project_name: str, env_id: str) -> Optional[Dict[str, Any]]:
+        env = self.store.get_environment(project_name, env_id)
+        if env is None:
+            return None
+        env.update(self.runtime.get(project_name, env_id))
+        return env
 
     def create_project(self, project_data: Dict[str, Any]) -> Dict[str, Any]:
-        data = self._load_data()
-        if self.get_project(project_data["name"]):
-            raise ValueError("Project with this name already exists.")
-        
-        # Ensure the projects list exists
-        if "projects" not in data:
-            data["projects"] = []
-            
-        data["projects"].append(project_data)
-        self._save_data(data)
-        return project_data
+        project_data = dict(project_data)
+        if "environments" in project_data:
+            project_data["environments"] = self._store_environments(
+                project_data["name"], project_data["environments"]
+            )
+        return self._with_runtime(self.store.add_project(project_data))
 
     def update_project(self, name: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        data = self._load_data()
-        project_found = False
-        for i, p in enumerate(data.get("projects", [])):
-            if p.get("name") == name:
-                # Update the project dictionary
-                data["projects"][i].update(updates)
-                project_found = True
-                break
-        
-        if not project_found:
-            return None
-            
-        self._save_data(data)
-        return data["projects"][i]
+        updates = dict(updates)
+        if "environments" in updates:
+            existing = self.store.get_project(name)
+            if existing is None:
+                return None
+            kept_ids = {env["id"] for env in updates["environments"]}
+            existing_ids = {env["id"] for env in existing.get("environments", [])}
+            for env_id in existing_ids - kept_ids:
+                self.runtime.remove(name, env_id)
+                status_hub.publish(name, env_id, None)
+            for env in updates["environments"]:
+                if env["id"] not in existing_ids:
+                    status_hub.publish(name, env["id"], env.get("status"))
+            updates["environments"] = self._store_environments(name, updates["environments"], existing_ids)
+        project = self.store.update_project(name, updates)
+        return self._with_runtime(project) if project else None
+
+    def add_environments(self, project_name: str, environments: List[Dict[str, Any]]) -> Optional[List[str]]:
+        """Adds environments whose id isn't taken, checked under the store's lock.
+
+        Returns the ids added, or None if the project doesn't exist.
+        """
+        added = self.store.add_environments(project_name, [self._split_runtime(env)[0] for env in environments])
+        if added:
+            for env in environments:
+                if env["id"] in added:
+                    _, runtime = self._split_runtime(env)
+                    self.runtime.update(project_name, env["id"], runtime)
+                    status_hub.publish(project_name, env["id"], env.get("status"))
+        return added
+
+    def remove_environments(self, project_name: str, env_ids) -> List[str]:
+        """Removes just these environments, leaving the rest of the project as it is now."""
+        removed = self.store.remove_environments(project_name, env_ids)
+        for env_id in removed:
+            self.runtime.remove(project_name, env_id)
+            status_hub.publish(project_name, env_id, None)
+        return removed
 
     def update_environment_status(self, project_name: str, env_id: str, updates: Dict[str, Any]):
         """Updates a specific environment within a project."""
-        data = self._load_data()
-        projects = data.get("projects", [])
-        for proj in projects:
-            if proj.get("name") == project_name:
-                environments = proj.get("environments", [])
-                for env in environments:
-                    if env.get("id") == env_id:
-                        env.update(updates)
-                        self._save_data(data)
-                        return True
-        return False
+        durable, runtime = self._split_runtime(updates)
+        if durable:
+            if not self.store.update_environment(project_name, env_id, durable):
+                return False
+        elif self.store.get_environment(project_name, env_id) is None:
+            return False
+        if runtime:
+            self.runtime.update(project_name, env_id, runtime)
+        if "status" in updates:
+            status_hub.publish(project_name, env_id, updates["status"])
+        return True
+
+    def mark_connected(self, project_name: str, env_id: str):
+        """Records a new client attaching to the environment's shell."""
+        if self.store.get_environment(project_name, env_id) is None:
+            return
+        self.runtime.adjust_connections(project_name, env_id, 1)
+        self.runtime.update(project_name, env_id, {"disconnected_at": None})
+
+    def mark_disconnected(self, project_name: str, env_id: str):
+        """Records a client detaching; the last one out starts the idle clock."""
+        if self.store.get_environment(project_name, env_id) is None:
+            return
+        if self.runtime.adjust_connections(project_name, env_id, -1) == 0:
+            self.runtime.update(project_name, env_id, {"disconnected_at": time.time()})
 
 # --- Docker Service ---
-# (DockerService class remains unchanged as it doesn't handle project data persistence)
 
 class DockerService:
     def __init__(self):
@@ -89,140 +155,27 @@ class DockerService:
             self.api_client = docker.APIClient()
         except docker.errors.DockerException as e:
             raise RuntimeError(f"Docker is not running or configured correctly: {e}")
+        self.tool_images = ToolImageCache(self.client)
+        self.git_mirrors = GitMirrorCache()
+        self.readiness = ReadinessTracker(self.client)
+        self.container_states = ContainerStateCache(self.client)
+        self.warm_pool = WarmPool(self.client, self.tool_images)
+        self.images = ImageCatalog(self.client, self.tool_images)
+        # container name -> (container id, ai_tool, exec id) of an exec created ahead of the next attach
+        self._spare_execs: Dict[str, Tuple[str, str, str]] = {}
+        # Containers whose spare exec is being created; the slot is claimed before exec_create
+        self._spare_pending: Set[str] = set()
+        self._spare_lock = threading.Lock()
 
-    def list_remote_branches(self, repo_url: str, token: Optional[str]) -> list[str]:
-        """Lists remote branches without cloning the whole repo."""
-        import subprocess
-        import signal
-        import re
-        import logging
-        
-        logger = logging.getLogger("uvicorn")
-        logger.info(f"[Git Service] 开始获取远程分支，仓库URL: {repo_url}")
-        
-        try:
-            # Clean the URL - remove any invisible characters and trailing/leading whitespace
-            original_url = repo_url
-            repo_url = repo_url.strip()
-            
-            if original_url != repo_url:
-                logger.info(f"[Git Service] URL已清理空白字符，原始长度: {len(original_url)}, 清理后长度: {len(repo_url)}")
-            
-            # Extract the protocol and domain parts correctly
-            if '//' in repo_url:
-                url_no_protocol = repo_url.split('//', 1)[-1]
-                logger.info(f"[Git Service] 从URL中提取域名部分: {url_no_protocol}")
-            else:
-                # If no protocol specified, assume https
-                url_no_protocol = repo_url
-                logger.info(f"[Git Service] URL没有协议前缀，使用原始值: {url_no_protocol}")
-                
-            # Remove any trailing invisible characters that might cause issues
-            original_no_protocol = url_no_protocol
-            url_no_protocol = re.sub(r'[\u2000-\u200F\u2028-\u202F\u205F-\u206F]', '', url_no_protocol)
-            
-            if original_no_protocol != url_no_protocol:
-                logger.info(f"[Git Service] 已移除不可见Unicode字符，原始长度: {len(original_no_protocol)}, 清理后长度: {len(url_no_protocol)}")
-                # 输出十六进制表示以便调试
-                logger.info(f"[Git Service] 原始URL十六进制: {original_no_protocol.encode('utf-8').hex()}")
-                logger.info(f"[Git Service] 清理后URL十六进制: {url_no_protocol.encode('utf-8').hex()}")
-            
-            if token:
-                # 隐藏令牌的大部分内容，只显示前4位和后4位
-                masked_token = f"{token[:4]}...{token[-4:]}" if len(token) > 8 else "***"
-                logger.info(f"[Git Service] 使用令牌构建认证URL，令牌(部分隐藏): {masked_token}")
-                auth_url = f"https://oauth2:{token}@{url_no_protocol}"
-            else:
-                logger.info(f"[Git Service] 未提供令牌，使用普通HTTPS URL")
-                auth_url = f"https://{url_no_protocol}"
-
-            # Use subprocess with timeout for better performance
-            try:
-                # 记录即将执行的Git命令（隐藏认证信息）
-                safe_url = auth_url.replace(token, "***") if token else auth_url
-                logger.info(f"[Git Service] 执行命令: git ls-remote --heads {safe_url}")
-                logger.info(f"[Git Service] 设置超时时间: 10秒")
-                
-                # 记录开始时间
-                import time
-                start_time = time.time()
-                
-                # Set a 10-second timeout to prevent hanging
-                result = subprocess.run(
-                    ['git', 'ls-remote', '--heads', auth_url],
-                    capture_output=True,
-                    text=True,
-                    timeout=30,  # 30-second timeout
-                    check=True
-                )
-                
-                # 计算执行时间
-                execution_time = time.time() - start_time
-                logger.info(f"[Git Service] 命令执行完成，耗时: {execution_time:.2f}秒")
-                
-                output = result.stdout
-                output_lines = output.strip().split('\n') if output.strip() else []
-                logger.info(f"[Git Service] 命令输出行数: {len(output_lines)}")
-                
-            except subprocess.TimeoutExpired:
-                logger.error(f"[Git Service] 命令执行超时 (>10秒)")
-                raise Exception("Request timed out - repository may be slow or unreachable")
-            except subprocess.CalledProcessError as e:
-                logger.error(f"[Git Service] 命令执行失败: {e.stderr or str(e)}")
-                raise Exception(f"Failed to fetch remote branches: {e.stderr or str(e)}")
-            except Exception as e:
-                logger.error(f"[Git Service] 发生异常: {str(e)}")
-                raise Exception(f"Failed to fetch remote branches: {str(e)}")
-                
-            logger.info(f"[Git Service] 命令执行成功，开始解析分支信息")
-            
-            if not output.strip():
-                logger.warning(f"[Git Service] 命令输出为空，返回默认分支 ['main', 'master']")
-                return ['main', 'master']  # Default branches if no output
-            
-            # 输出前10行作为调试信息（如果有）
-            preview_lines = output.splitlines()[:10]
-            logger.info(f"[Git Service] 命令输出前{len(preview_lines)}行:\n" + "\n".join(preview_lines))
-                
-            branches = [line.split('\t')[1].replace('refs/heads/', '') for line in output.splitlines() if '\t' in line]
-            
-            if not branches:
-                logger.warning(f"[Git Service] 无法从输出中解析分支，返回默认分支 ['main', 'master']")
-                return ['main', 'master']
-            
-            sorted_branches = sorted(branches)
-            logger.info(f"[Git Service] 成功解析到{len(sorted_branches)}个分支: {', '.join(sorted_branches[:5])}{', ...' if len(sorted_branches) > 5 else ''}")
-            return sorted_branches
-            
-        except Exception as e:
-            # Log the actual error for debugging
-            error_msg = f"Could not fetch remote branches: {str(e)}"
-            print(f"Error: {error_msg}")
-            # Re-raise the exception instead of silently returning default branches
-            # This allows the API to return proper error messages to the frontend
-            raise Exception(error_msg)
-
-    def create_and_run_environment(
-        self, container_name: str, base_image: str, git_repo_url: str, 
-        env_name: str, env_vars: dict, branch_mode: str, existing_branch: Optional[str],
-        ai_tool: str = "gemini"
-    ):
-        setup_script = f"""
-        #!/bin/sh
-        set -ex
-        export DEBIAN_FRONTEND=noninteractive
-        apt-get update -y && apt-get install -y curl git
-        
-        # Install Node.js for both tools
-        curl -fsSL https://deb.nodesource.com/setup_20.x | bash -
-        apt-get install -y nodejs
-        
-        # Install AI tool based on selection
+    def _workspace_script(
+        self, git_repo_url: str, env_name: str, branch_mode: str,
+        existing_branch: Optional[str], ai_tool: str
+    ) -> str:
+        """Shell steps that clone the repository into /workspace and mark setup complete."""
+        return f"""
         if [ "{ai_tool}" = "gemini" ]; then
-            npm install -g @google/gemini-cli --unsafe-perm=true --allow-root
             agent_name="Gemini Agent"
         else
-            npm install -g @anthropic-ai/claude-code --unsafe-perm=true --allow-root
             agent_name="Claude Agent"
         fi
         
@@ -234,7 +187,8 @@ class DockerService:
             clone_url="https://$url_no_protocol"
         fi
         
-git clone "$clone_url" /workspace 2>&1
+        # Objects already in the host mirror are copied locally instead of downloaded
+git clone --reference-if-able {self.git_mirrors.container_path(git_repo_url)} --dissociate "$clone_url" /workspace 2>&1
         cd /workspace
         git config --global user.name "$agent_name"
         git config --global user.email "agent@example.com"
@@ -260,28 +214,68 @@ EOF
         fi
         
         touch /tmp/setup_complete
+        echo {READY_MARKER}
+        """
+
+    def _environment_volumes(
+        self, container_name: str, ai_tool: str,
+        git_repo_url: Optional[str] = None, git_token: Optional[str] = None
+    ) -> Dict[str, Dict[str, str]]:
+        volumes = {}
+        # This repository's git mirror only, read-only, and only for a token that can read it
+        if git_repo_url and self.git_mirrors.readable_with(git_repo_url, git_token):
+            volumes[os.path.abspath(self.git_mirrors.host_path(git_repo_url))] = {
+                'bind': self.git_mirrors.container_path(git_repo_url),
+                'mode': 'ro'
+            }
+        # Prepare volumes for Claude session persistence
+        if ai_tool == "claude":
+            # Create directory for Claude sessions if it doesn't exist
+            claude_session_dir = f"{CLAUDE_SESSIONS_DIR}/{container_name}"
+            os.makedirs(claude_session_dir, exist_ok=True)
+            volumes[os.path.abspath(claude_session_dir)] = {
+                'bind': CLAUDE_SESSIONS_MOUNT,
+                'mode': 'rw'
+            }
+        return volumes
+
+    def create_and_run_environment(
+        self, container_name: str, base_image: str, git_repo_url: str, 
+        env_name: str, env_vars: dict, branch_mode: str, existing_branch: Optional[str],
+        ai_tool: str = "gemini", resources: Optional[Dict[str, Any]] = None
+    ):
+        # Bring the mirror up to date for this and later clones; the clone doesn't wait for it
+        self.git_mirrors.sync(git_repo_url, env_vars.get("GIT_TOKEN"))
+        workspace_script = self._workspace_script(git_repo_url, env_name, branch_mode, existing_branch, ai_tool)
+        # A warm pool container already has its tools installed and is running
+        if self.warm_pool.claim(container_name, base_image, ai_tool, env_vars, workspace_script, resources):
+            print(f"Created {container_name} from a warm pool container")
+            return
+
+        # Start from the prebuilt tool image when there is one; otherwise install in the container
+        image, tools_preinstalled = self.tool_images.resolve(base_image, ai_tool)
+        print(f"Creating {container_name} from {image} (tools preinstalled: {tools_preinstalled})")
+        setup_script = f"""
+        #!/bin/sh
+        set -ex
+        export DEBIAN_FRONTEND=noninteractive
+        if [ ! -f {tool_marker(ai_tool)} ]; then
+            {tool_install_script(ai_tool)}
+        fi
+        [ -x {SHELL_LAUNCHER} ] || {launcher_install_script()}
+        {workspace_script}
         tail -f /dev/null
         """
         try:
-            # Prepare volumes for Claude session persistence
-            volumes = {}
-            if ai_tool == "claude":
-                # Create directory for Claude sessions if it doesn't exist
-                import os
-                claude_session_dir = f"data/claude_sessions/{container_name}"
-                os.makedirs(claude_session_dir, exist_ok=True)
-                volumes[os.path.abspath(claude_session_dir)] = {
-                    'bind': '/root/.claude/projects/-workspace',
-                    'mode': 'rw'
-                }
-            
             self.client.containers.run(
-                image=base_image,
+                image=image,
                 name=container_name,
                 command=["/bin/sh", "-c", setup_script],
                 environment=env_vars,
-                volumes=volumes,
-                detach=True
+                labels={MANAGED_LABEL: "true"},
+                volumes=self._environment_volumes(container_name, ai_tool, git_repo_url, env_vars.get("GIT_TOKEN")),
+                detach=True,
+                **(run_limits(resources) if resources else {})
             )
         except Exception as e:
             traceback.print_exc()
@@ -289,136 +283,247 @@ EOF
             raise e
 
     def list_images(self) -> list[str]:
+        if self.images.synced:
+            return self.images.tags()
         images = self.client.images.list()
         tags = [tag for image in images if image.tags for tag in image.tags]
         return sorted(tags)
 
+    def _container_state(self, container_name: str, expected: Tuple[str, ...] = ()) -> Optional[Dict[str, Any]]:
+        """Container id/status from the events-fed cache, asking the daemon only on a miss.
+
+        With `expected`, a cached status outside it is read again before it is
+        believed: the event for a start or stop may still be on its way.
+        """
+        state = self.container_states.get(container_name)
+        if state is None or (expected and state["status"] not in expected):
+            state = self.container_states.refresh(container_name)
+        return state
+
     def stop_container(self, container_name: str):
         try:
-            container = self.client.containers.get(container_name)
-            if container.status == "running":
-                container.stop()
+            state = self._container_state(container_name, expected=("running", "paused"))
+            if state is None:
+                print(f"Container {container_name} not found, skipping stop.")
+            elif state["status"] in ("running", "paused"):
+                # The daemon thaws a paused container to deliver the stop signal
+                self.api_client.stop(state["id"])
+                self.container_states.mark(container_name, "exited")
         except docker.errors.NotFound:
+            self.container_states.refresh(container_name)
             print(f"Container {container_name} not found, skipping stop.")
         except Exception as e:
             print(f"Error stopping container {container_name}: {e}")
 
-    def start_container(self, container_name: str):
+    def start_container(self, container_name: str, resources: Optional[Dict[str, Any]] = None):
         try:
-            container = self.client.containers.get(container_name)
-            if container.status != "running":
-                container.start()
+            state = self._container_state(container_name)
+            if state is None:
+                raise docker.errors.NotFound(container_name)
+            if state["status"] != "running":
+                if resources:
+                    # Containers from before resource profiles (or a changed profile) get their limits here
+                    self.api_client.update_container(state["id"], **update_limits(resources))
+                self.api_client.start(state["id"])
+                self.container_states.mark(container_name, "running")
         except docker.errors.NotFound:
+            self.container_states.refresh(container_name)
             raise ValueError(f"Container {container_name} not found and cannot be started.")
 
+    def pause_container(self, container_name: str):
+        """Freezes a running container's processes; memory stays allocated."""
+        state = self._container_state(container_name)
+        if state is None:
+            raise ValueError(f"Container {container_name} not found and cannot be paused.")
+        if state["status"] == "running":
+            self.api_client.pause(state["id"])
+            self.container_states.mark(container_name, "paused")
+
+    def unpause_container(self, container_name: str):
+        state = self._container_state(container_name)
+        if state is None:
+            raise ValueError(f"Container {container_name} not found and cannot be resumed.")
+        try:
+            # Not gated on the cached status: the pause event may not have arrived yet
+            self.api_client.unpause(state["id"])
+        except docker.errors.APIError as e:
+            if e.status_code != 409:  # 409: not paused
+                raise
+        else:
+            self.container_states.mark(container_name, "running")
+
+    def archive_container(self, container_name: str) -> str:
+        """Commits the container (workspace included) to an image and removes it.
+
+        Returns the archive image's tag. Volumes (Claude sessions, git
+        mirrors) aren't part of the commit; they stay on the host.
+        """
+        state = self._container_state(container_name)
+        if state is None:
+            raise ValueError(f"Container {container_name} not found and cannot be archived.")
+        tag = container_name[:128]
+        try:
+            previous = self.client.images.get(f"{ARCHIVE_IMAGE_REPO}:{tag}").id
+        except docker.errors.ImageNotFound:
+            previous = None
+        image = self.client.containers.get(state["id"]).commit(
+            repository=ARCHIVE_IMAGE_REPO, tag=tag, changes=[f"LABEL {ARCHIVE_LABEL}=true"]
+        )
+        self.remove_container(container_name)
+        if previous is not None and previous != image.id:
+            # The last archive's image, now that the container built on it is gone
+            self.remove_archive(previous)
+        print(f"Archived {container_name} to {ARCHIVE_IMAGE_REPO}:{tag}")
+        return f"{ARCHIVE_IMAGE_REPO}:{tag}"
+
+    def restore_container(self, container_name: str, archive_image: str, ai_tool: str, resources: Optional[Dict[str, Any]] = None):
+        """Recreates an archived environment's container from its archive image."""
+        # Only this environment's transcripts; in archives of containers claimed before pool
+        # containers had their own directory, the mount point is a link the daemon follows
+        volumes = self._environment_volumes(container_name, ai_tool)
+        try:
+            # Environment variables and the working directory come with the committed image
+            self.client.containers.run(
+                image=archive_image,
+                name=container_name,
+                command=["/bin/sh", "-c", RESTORE_COMMAND],
+                labels={MANAGED_LABEL: "true"},
+                volumes=volumes,
+                detach=True,
+                **(run_limits(resources) if resources else {})
+            )
+        except docker.errors.ImageNotFound:
+            raise ValueError(f"Archive image {archive_image} of {container_name} no longer exists.")
+        print(f"Restored {container_name} from {archive_image}")
+
+    def remove_archive(self, archive_image: str):
+        try:
+            self.client.images.remove(archive_image)
+        except docker.errors.ImageNotFound:
+            pass
+        except Exception as e:
+            print(f"Error removing archive image {archive_image}: {e}")
+
     def remove_container(self, container_name: str):
+        self.readiness.forget(container_name)
+        with self._spare_lock:
+            self._spare_execs.pop(container_name, None)
+            self._spare_pending.discard(container_name)
         try:
-            container = self.client.containers.get(container_name)
-            container.remove(force=True)
+            state = self._container_state(container_name)
+            if state is None:
+                raise docker.errors.NotFound(container_name)
+            self.api_client.remove_container(state["id"], force=True)
         except docker.errors.NotFound:
             print(f"Container {container_name} not found, skipping remove.")
         except Exception as e:
             print(f"Error removing container {container_name}: {e}")
 
+    def is_setup_complete(self, container_name: str) -> bool:
+        """True once the container's setup script has finished (cached after the first success)."""
+        if self.readiness.is_ready(container_name):
+            return True
+        try:
+            if self.container_states.status(container_name) not in (None, "running"):
+                return False
+            container = self.client.containers.get(container_name)
+            if container.status != "running":
+                return False
+            if container.exec_run("test -f /tmp/setup_complete").exit_code != 0:
+                return False
+        except Exception:
+            return False
+        self.readiness.mark_ready(container_name)
+        return True
+
     def stop_and_remove_container(self, container_name: str):
         self.stop_container(container_name)
         self.remove_container(container_name)
 
-    def setup_shell_session(self, container_name: str, ai_tool: str = "gemini"):
-        import time
-        start_time = time.time()
-        print(f"[PERF] setup_shell_session started for {container_name} with {ai_tool}")
-        
-        container = self.client.containers.get(container_name)
-        if container.status != "running":
-            raise RuntimeError(f"Container {container_name} is not running.")
-        
-        setup_check_start = time.time()
-        # Check if the setup is complete by checking for the setup_complete file
-        try:
-            result = container.exec_run("test -f /tmp/setup_complete")
-            if result.exit_code != 0:
-                raise RuntimeError("Environment is still initializing. Please wait for setup to complete.")
-        except:
-            raise RuntimeError("Environment is still initializing. Please wait for setup to complete.")
-        
-        setup_check_time = time.time() - setup_check_start
-        print(f"[PERF] Setup check took {setup_check_time:.3f}s")
-        
-        ai_command = "claude" if ai_tool == "claude" else "gemini"
-        
-        # For Gemini with Google login, we need to handle the login process differently
-        if ai_tool == "gemini":
-            # Build command using a list to avoid quoting issues
-            cmd = [
-                "sh", "-c",
-                "if [ -f /etc/environment ]; then . /etc/environment; fi; "
-                "export TERM=xterm-256color; "
-                "while [ ! -f \"/tmp/setup_complete\" ]; do "
-                "  sleep 1; "
-                "done; "
-                "if [ \"$GEMINI_USE_GOOGLE_LOGIN\" = \"true\" ]; then "
-                "  echo \"Google Login Mode: Run 'gemini login' to authenticate with your Google account\"; "
-                "  echo \"After login, run 'gemini' to start the CLI\"; "
-                "  exec /bin/bash; "
-                "else "
-                "  exec gemini; "
-                "fi"
-            ]
-        else:
-            # Claude with simple session continuation
-            print(f"[PERF] Using claude -c for session continuation")
-            cmd = [
-                "sh", "-c",
-                "echo \"[PERF] Starting Claude session recovery at $(date)\"; "
-                "if [ -f /etc/environment ]; then . /etc/environment; fi; "
-                "export TERM=xterm-256color; "
-                "while [ ! -f \"/tmp/setup_complete\" ]; do "
-                "  sleep 1; "
-                "done; "
-                "echo \"[PERF] Setup complete check passed at $(date)\"; "
-                "cd /workspace; "
-                "echo \"[PERF] Changed to workspace directory at $(date)\"; "
-                "echo \"[PERF] Attempting to continue previous session at $(date)\"; "
-                "echo \"[DEBUG] Checking claude command availability...\"; "
-                "which claude || echo \"[ERROR] claude command not found\"; "
-                "echo \"[DEBUG] Current directory: $(pwd)\"; "
-                "echo \"[DEBUG] Environment variables:\"; "
-                "env | grep -E '(ANTHROPIC|CLAUDE)' || echo \"[DEBUG] No ANTHROPIC/CLAUDE env vars found\"; "
-                "echo \"[DEBUG] Running claude -c with proper TTY setup...\"; "
-                "echo \"[DEBUG] Checking for existing sessions...\"; "
-                "ls -la ~/.claude/ 2>/dev/null || echo \"[DEBUG] No ~/.claude directory found\"; "
-                "echo \"[DEBUG] Attempting session continuation...\"; "
-                "script -qec 'claude -c' /dev/null 2>&1 || { "
-                "  echo \"[DEBUG] Session continuation failed, trying direct claude start...\"; "
-                "  script -qec 'claude' /dev/null 2>&1 || { "
-                "    echo \"[ERROR] Both session continuation and new session failed\"; "
-                "    echo \"[FALLBACK] Starting basic claude without TTY...\"; "
-                "  }; "
-                "};"
-            ]
-        
-        cmd_creation_start = time.time()
+    def _create_shell_exec(self, container_id: str, ai_tool: str) -> str:
         exec_instance = self.api_client.exec_create(
-            container.id,
-            cmd,
+            container_id,
+            shell_command(ai_tool),
             stdin=True,
             tty=True,
             workdir="/workspace"
         )
-        cmd_creation_time = time.time() - cmd_creation_start
-        print(f"[PERF] Command creation took {cmd_creation_time:.3f}s")
-        
-        exec_id = exec_instance['Id']
-        
-        socket_start_time = time.time()
+        return exec_instance['Id']
+
+    def prepare_shell_exec(self, container_name: str, ai_tool: str = "gemini"):
+        """Creates the exec for the container's next terminal attach ahead of time.
+
+        Execs that were never started can't be deleted, so the slot is
+        claimed under a lock first: concurrent calls create one exec, not one
+        each with all but the last left behind.
+        """
+        if not self.readiness.is_ready(container_name):
+            return
+        with self._spare_lock:
+            if container_name in self._spare_execs or container_name in self._spare_pending:
+                return
+            self._spare_pending.add(container_name)
+        try:
+            state = self._container_state(container_name)
+            if state is None or state["status"] != "running":
+                return
+            spare = (state["id"], ai_tool, self._create_shell_exec(state["id"], ai_tool))
+            with self._spare_lock:
+                # Not if the container was removed meanwhile
+                if container_name in self._spare_pending:
+                    self._spare_execs[container_name] = spare
+        except Exception as e:
+            print(f"Could not prepare a shell exec for {container_name}: {e}")
+        finally:
+            with self._spare_lock:
+                self._spare_pending.discard(container_name)
+
+    def setup_shell_session(self, container_name: str, ai_tool: str = "gemini", timings: Optional[Dict[str, float]] = None):
+        """Starts the terminal exec; returns (exec_id, socket).
+
+        Container id, status and readiness normally come from caches, and a
+        spare exec prepared by `prepare_shell_exec` saves the exec_create
+        round trip. Per-phase durations (seconds) are added to `timings`:
+        lookup, readiness, exec_create (absent when a spare exec was used)
+        and exec_start.
+        """
+        timings = {} if timings is None else timings
+        phase_start = time.perf_counter()
+
+        def phase(name: str):
+            nonlocal phase_start
+            now = time.perf_counter()
+            timings[name] = now - phase_start
+            phase_start = now
+
+        state = self._container_state(container_name, expected=("running",))
+        if state is None:
+            raise docker.errors.NotFound(f"Container {container_name} not found.")
+        if state["status"] != "running":
+            raise RuntimeError(f"Container {container_name} is not running.")
+        phase("lookup")
+
+        # Readiness is normally known already; only unknown containers pay for an exec check
+        if not self.is_setup_complete(container_name):
+            raise RuntimeError("Environment is still initializing. Please wait for setup to complete.")
+        phase("readiness")
+
+        with self._spare_lock:
+            spare = self._spare_execs.pop(container_name, None)
+        if spare is not None and spare[:2] == (state["id"], ai_tool):
+            try:
+                socket = self.api_client.exec_start(spare[2], tty=True, socket=True)
+                phase("exec_start")
+                return spare[2], socket
+            except docker.errors.APIError as e:
+                # Execs don't survive a container restart
+                print(f"Spare shell exec for {container_name} is unusable, creating a new one: {e}")
+                phase_start = time.perf_counter()
+
+        exec_id = self._create_shell_exec(state["id"], ai_tool)
+        phase("exec_create")
         socket = self.api_client.exec_start(exec_id, tty=True, socket=True)
-        socket_start_time_elapsed = time.time() - socket_start_time
-        print(f"[PERF] Socket start took {socket_start_time_elapsed:.3f}s")
-        
-        total_time = time.time() - start_time
-        print(f"[PERF] Total setup_shell_session took {total_time:.3f}s")
-        
+        phase("exec_start")
         return exec_id, socket
 
     def resize_shell(self, exec_id: str, rows: int, cols: int):
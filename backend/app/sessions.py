@@ -0,0 +1,278 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Optional, List, Dict, Any, Set, Tuple
+
+from .relay import ShellStream, OutputCoalescer, SessionStats, OUTPUT_FLUSH_WINDOW_MS, OUTPUT_FRAME_MAX
+from .docker_async import async_docker
+from .registry import EnvironmentHandle, environment_registry
+
+# Bytes of recent output kept per environment and replayed to reconnecting clients
+SCROLLBACK_BYTES = int(os.environ.get("SCROLLBACK_BYTES", 256 * 1024))
+# Keep an exec created ahead of each environment's next terminal attach
+SPARE_SHELL_EXEC = os.environ.get("SPARE_SHELL_EXEC", "true").lower() == "true"
+# Recent attaches kept for the per-phase latency report
+ATTACH_SAMPLES = 200
+
+# --- Scrollback ---
+
+class ScrollbackBuffer:
+    """Fixed-size byte ring buffer holding the most recent shell output."""
+
+    def __init__(self, capacity: int = SCROLLBACK_BYTES):
+        self.capacity = capacity
+        self._ring = bytearray(capacity)
+        self._end = 0  # Next write position
+        self._size = 0
+
+    def append(self, data: bytes):
+        if self.capacity == 0:
+            return
+        if len(data) >= self.capacity:
+            self._ring[:] = data[-self.capacity:]
+            self._end = 0
+            self._size = self.capacity
+            return
+        first = min(len(data), self.capacity - self._end)
+        self._ring[self._end:self._end + first] = data[:first]
+        rest = len(data) - first
+        if rest:
+            self._ring[:rest] = data[first:]
+        self._end = (self._end + len(data)) % self.capacity
+        self._size = min(self._size + len(data), self.capacity)
+
+    def clear(self):
+        self._end = 0
+        self._size = 0
+
+    def snapshot(self) -> bytes:
+        """Returns the buffered tail, starting at a UTF-8 character boundary."""
+        start = (self._end - self._size) % self.capacity if self.capacity else 0
+        if start + self._size <= self.capacity:
+            data = bytes(self._ring[start:start + self._size])
+        else:
+            data = bytes(self._ring[start:]) + bytes(self._ring[:self._end])
+        if self._size == self.capacity:
+            # The oldest bytes may be the tail of a multibyte character
+            skip = 0
+            while skip < min(3, len(data)) and 0x80 <= data[skip] <= 0xBF:
+                skip += 1
+            data = data[skip:]
+        return data
+
+
+# --- Persistent Shell Sessions ---
+
+class ShellSession:
+    """An environment's exec session, kept running across WebSocket reconnects.
+
+    A single reader drains the exec socket into the scrollback ring and into
+    one bounded OutputCoalescer per attached client, without waiting on any
+    of them: a client that falls behind skips output and is repainted from
+    the scrollback once it catches up. Only when every client is behind does
+    the reader pause (backpressure). Detached sessions keep filling the ring
+    until the exec ends, typically because the container stopped.
+    """
+
+    def __init__(self, key: Tuple[str, str], container_name: str, exec_id: str, shell_socket, handle: Optional[EnvironmentHandle] = None):
+        self.key = key
+        self.container_name = container_name
+        self.exec_id = exec_id
+        self.handle = handle
+        self.stream = ShellStream(shell_socket)
+        self.scrollback = ScrollbackBuffer()
+        self.subscribers: Set[OutputCoalescer] = set()
+        self.last_output_at = time.time()
+        self.closed = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, on_exit):
+        self._task = asyncio.create_task(self._run(on_exit))
+
+    async def _run(self, on_exit):
+        try:
+            while True:
+                try:
+                    output = await self.stream.read()
+                except Exception as recv_error:
+                    print(f"Error reading from shell socket: {recv_error}")
+                    break
+                if not output:
+                    print(f"No more output from shell, socket is closed for {self.container_name}.")
+                    break
+                subscribers = list(self.subscribers)
+                if subscribers and all(subscriber.full for subscriber in subscribers):
+                    # Nobody is keeping up: stop reading the exec socket until someone is
+                    await self._wait_for_space(subscribers)
+                self.last_output_at = time.time()
+                self.scrollback.append(output)
+                for subscriber in list(self.subscribers):
+                    subscriber.offer(output)
+        finally:
+            self.closed = True
+            if self.handle is not None:
+                self.handle.exec_ids.discard(self.exec_id)
+                self.handle.attached -= len(self.subscribers)
+            for subscriber in list(self.subscribers):
+                subscriber.close()
+            self.subscribers.clear()
+            try:
+                self.stream.close()
+            except Exception as e:
+                print(f"Error closing shell socket: {e}")
+            on_exit(self)
+
+    async def _wait_for_space(self, subscribers: List[OutputCoalescer]):
+        waiters = [asyncio.ensure_future(subscriber.wait_for_space()) for subscriber in subscribers]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    def attach(self, stats: Optional[SessionStats] = None) -> Tuple[OutputCoalescer, bytes]:
+        """Subscribes a client; returns its output buffer and the replay tail.
+
+        Snapshot and subscription happen without yielding to the loop, so the
+        client sees every byte exactly once: first in the replay, then live.
+        """
+        coalescer = OutputCoalescer(OUTPUT_FLUSH_WINDOW_MS / 1000, OUTPUT_FRAME_MAX, stats=stats,
+                                    replay=self.scrollback.snapshot)
+        self.subscribers.add(coalescer)
+        if self.handle is not None:
+            self.handle.attached += 1
+            self.handle.touch()
+        return coalescer, self.scrollback.snapshot()
+
+    def detach(self, coalescer: OutputCoalescer):
+        if coalescer in self.subscribers and self.handle is not None:
+            self.handle.attached -= 1
+            self.handle.touch()
+        self.subscribers.discard(coalescer)
+        coalescer.close()
+
+    async def write(self, data: bytes):
+        await self.stream.write(data)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class SessionManager:
+    """Owns at most one live ShellSession per (project, env)."""
+
+    def __init__(self):
+        self.sessions: Dict[Tuple[str, str], ShellSession] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def get(self, project_name: str, env_id: str) -> Optional[ShellSession]:
+        session = self.sessions.get((project_name, env_id))
+        return session if session is not None and not session.closed else None
+
+    async def get_or_create(
+        self, project_name: str, env_id: str, container_name: str, ai_tool: str,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> ShellSession:
+        """The live session, or a new one; `timings` receives the exec setup phases."""
+        key = (project_name, env_id)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            session = self.get(project_name, env_id)
+            if session is not None:
+                return session
+            exec_id, shell_socket = await async_docker.setup_shell_session(container_name, ai_tool, timings)
+            handle = environment_registry.get(project_name, env_id)
+            session = ShellSession(key, container_name, exec_id, shell_socket, handle)
+            if handle is not None:
+                handle.exec_ids.add(exec_id)
+            self.sessions[key] = session
+            session.start(self._on_exit)
+            if SPARE_SHELL_EXEC:
+                # Off the attach path: ready for when this session's shell exits
+                task = asyncio.create_task(self._prepare_spare(container_name, ai_tool))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return session
+
+    async def _prepare_spare(self, container_name: str, ai_tool: str):
+        try:
+            await async_docker.prepare_shell_exec(container_name, ai_tool)
+        except Exception as e:
+            print(f"Could not prepare a shell exec for {container_name}: {e}")
+
+    def _on_exit(self, session: ShellSession):
+        if self.sessions.get(session.key) is session:
+            del self.sessions[session.key]
+
+    def output_times(self) -> Dict[Tuple[str, str], float]:
+        """When each live session last produced output."""
+        return {key: session.last_output_at for key, session in self.sessions.items() if not session.closed}
+
+    def close(self, project_name: str, env_id: str):
+        """Ends the environment's session, e.g. because its container is going away."""
+        session = self.sessions.pop((project_name, env_id), None)
+        if session is not None:
+            session.close()
+
+
+# --- Attach Latency ---
+
+class AttachStats:
+    """Per-phase durations of recent terminal attaches.
+
+    Phases (all optional): wake (resuming a hibernated environment),
+    lookup, readiness, exec_create, exec_start (see
+    DockerService.setup_shell_session), session (getting the live or a new
+    session, including waits for a concurrent attach) and total (up to the
+    scrollback replay being sent).
+    """
+
+    def __init__(self, samples: int = ATTACH_SAMPLES):
+        self._recent = deque(maxlen=samples)
+        self.attaches = 0
+        self.reattaches = 0
+        self.spare_exec_hits = 0
+
+    def record(self, label: str, timings: Dict[str, float], reattached: bool):
+        self.attaches += 1
+        if reattached:
+            self.reattaches += 1
+        elif "exec_start" in timings and "exec_create" not in timings:
+            self.spare_exec_hits += 1
+        self._recent.append({"label": label, "at": time.time(), "reattached": reattached, "timings": dict(timings)})
+        print(f"[PERF] {'Re' if reattached else ''}attached {label}: " + ", ".join(
+            f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in timings.items()
+        ))
+
+    def snapshot(self) -> Dict[str, Any]:
+        by_phase: Dict[str, List[float]] = {}
+        for sample in self._recent:
+            for phase, seconds in sample["timings"].items():
+                by_phase.setdefault(phase, []).append(seconds * 1000)
+        phases = {}
+        for phase, values in by_phase.items():
+            values.sort()
+            phases[phase] = {
+                "count": len(values),
+                "avg_ms": round(sum(values) / len(values), 2),
+                "p50_ms": round(values[len(values) // 2], 2),
+                "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))], 2),
+                "max_ms": round(values[-1], 2),
+            }
+        return {
+            "attaches": self.attaches,
+            "reattaches": self.reattaches,
+            "spare_exec_hits": self.spare_exec_hits,
+            "phases": phases,
+            "recent": [
+                dict(sample, timings={phase: round(seconds * 1000, 2) for phase, seconds in sample["timings"].items()})
+                for sample in list(self._recent)[-20:]
+            ],
+        }
+
+
+session_manager = SessionManager()
+attach_stats = AttachStats()
@@ -0,0 +1,375 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Optional, List, Dict, Any, Iterable, Tuple, Callable
+
+from .store import StorageBackend, RuntimeEntries, ActivityTimes
+
+if TYPE_CHECKING:
+    from .file_watch import FileWatcher
+
+# How often `watch()` checks PRAGMA data_version for commits by other connections
+SQLITE_WATCH_INTERVAL = float(os.environ.get("SQLITE_WATCH_INTERVAL", 1.0))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    hashed_password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS projects (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS environments (
+    project_name TEXT NOT NULL REFERENCES projects(name) ON DELETE CASCADE,
+    env_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    config TEXT NOT NULL,
+    PRIMARY KEY (project_name, env_id)
+);
+CREATE INDEX IF NOT EXISTS idx_environments_project ON environments (project_name, position);
+CREATE TABLE IF NOT EXISTS runtime_state (
+    project_name TEXT NOT NULL,
+    env_id TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    PRIMARY KEY (project_name, env_id)
+);
+CREATE TABLE IF NOT EXISTS worker_activity (
+    worker_id TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    activity TEXT NOT NULL
+);
+"""
+
+# Hot-path statements. sqlite3 keeps a per-connection cache of compiled
+# statements keyed by SQL text, so reusing these constants means they are
+# prepared once per connection and only re-bound afterwards.
+SELECT_USER = "SELECT username, hashed_password FROM users WHERE username = ?"
+SELECT_USERS = "SELECT username, hashed_password FROM users ORDER BY rowid"
+INSERT_USER = "INSERT INTO users (username, hashed_password) VALUES (?, ?)"
+SELECT_ANY_USER = "SELECT 1 FROM users LIMIT 1"
+SELECT_PROJECT = "SELECT config FROM projects WHERE name = ?"
+SELECT_PROJECTS = "SELECT name, config FROM projects ORDER BY position"
+SELECT_PROJECT_ENVS = "SELECT config FROM environments WHERE project_name = ? ORDER BY position"
+SELECT_ALL_ENVS = "SELECT project_name, config FROM environments ORDER BY project_name, position"
+SELECT_ENV = "SELECT config FROM environments WHERE project_name = ? AND env_id = ?"
+INSERT_PROJECT = "INSERT INTO projects (name, position, config) VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM projects), ?)"
+UPDATE_PROJECT = "UPDATE projects SET config = ? WHERE name = ?"
+UPSERT_ENV = (
+    "INSERT INTO environments (project_name, env_id, position, config) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (project_name, env_id) DO UPDATE SET position = excluded.position, config = excluded.config"
+)
+UPDATE_ENV = "UPDATE environments SET config = ? WHERE project_name = ? AND env_id = ?"
+DELETE_ENV = "DELETE FROM environments WHERE project_name = ? AND env_id = ?"
+INSERT_ENV = (
+    "INSERT OR IGNORE INTO environments (project_name, env_id, position, config) "
+    "VALUES (?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM environments WHERE project_name = ?), ?)"
+)
+SELECT_RUNTIME = "SELECT project_name, env_id, fields FROM runtime_state"
+INSERT_RUNTIME = "INSERT INTO runtime_state (project_name, env_id, fields) VALUES (?, ?, ?)"
+UPSERT_RUNTIME = (
+    "INSERT INTO runtime_state (project_name, env_id, fields) VALUES (?, ?, ?) "
+    "ON CONFLICT (project_name, env_id) DO UPDATE SET fields = excluded.fields"
+)
+DELETE_RUNTIME = "DELETE FROM runtime_state WHERE project_name = ? AND env_id = ?"
+UPSERT_WORKER_ACTIVITY = (
+    "INSERT INTO worker_activity (worker_id, expires_at, activity) VALUES (?, ?, ?) "
+    "ON CONFLICT (worker_id) DO UPDATE SET expires_at = excluded.expires_at, activity = excluded.activity"
+)
+DELETE_WORKER_ACTIVITY = "DELETE FROM worker_activity WHERE worker_id = ? OR expires_at <= ?"
+SELECT_WORKER_ACTIVITY = "SELECT activity FROM worker_activity WHERE expires_at > ?"
+SELECT_MIGRATED = "SELECT 1 FROM meta WHERE key = 'json_migrated'"
+
+# --- SQLite Store ---
+
+class SQLiteStore(StorageBackend):
+    """Embedded SQLite storage in WAL mode.
+
+    Each thread gets its own connection so readers never block each other or
+    the writer. Projects and environments are stored as separate rows (the
+    non-key fields as a JSON config column), so updates touch single rows
+    instead of rewriting the whole dataset. On first open an existing
+    db.json/runtime.json is imported once.
+
+    Reads always go to the database, so only RuntimeState caches anything.
+    `watch()` keeps it coherent with other workers by polling PRAGMA
+    data_version on a dedicated connection, which changes whenever another
+    connection commits (this process's own writes included, which costs one
+    extra reload of the runtime table).
+    """
+
+    def __init__(self, path: str, legacy_db_path: Optional[str] = None, legacy_runtime_path: Optional[str] = None):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._watch_thread: Optional[threading.Thread] = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        self._migrate_from_json(legacy_db_path, legacy_runtime_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, cached_statements=128)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        """Serializes writers within this process; WAL handles other processes."""
+        return _WriteTransaction(self._write_lock, self._conn())
+
+    # --- Change notifications ---
+
+    def watch(self, watcher: "FileWatcher", on_runtime_change: Callable[[], None]):
+        # inotify on the WAL file would also fire for checkpoints; data_version only for commits
+        if self._watch_thread is not None:
+            return
+        self._watch_thread = threading.Thread(
+            target=self._poll_data_version, args=(on_runtime_change,), name="sqlite-watch", daemon=True
+        )
+        self._watch_thread.start()
+
+    def _poll_data_version(self, on_change: Callable[[], None]):
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        while True:
+            time.sleep(SQLITE_WATCH_INTERVAL)
+            try:
+                current = conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error as e:
+                print(f"Error checking {self.path} for changes: {e}")
+                continue
+            if current != version:
+                version = current
+                try:
+                    on_change()
+                except Exception as e:
+                    print(f"Error in SQLite change callback: {e}")
+
+    # --- One-shot migration ---
+
+    def _migrate_from_json(self, db_path: Optional[str], runtime_path: Optional[str]):
+        if self._conn().execute(SELECT_MIGRATED).fetchone():
+            return
+        data: Dict[str, Any] = {}
+        if db_path and os.path.exists(db_path):
+            try:
+                with open(db_path, 'r') as f:
+                    data = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Skipping migration of corrupted {db_path}")
+        runtime: Dict[str, Any] = {}
+        if runtime_path and os.path.exists(runtime_path):
+            try:
+                with open(runtime_path, 'r') as f:
+                    runtime = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Skipping migration of corrupted {runtime_path}")
+
+        with self._write() as conn:
+            # Another worker may have won the race while we were reading
+            if conn.execute(SELECT_MIGRATED).fetchone():
+                return
+            for user in data.get("users", []):
+                conn.execute(INSERT_USER, (user["username"], user["hashed_password"]))
+            for project in data.get("projects", []):
+                self._insert_project(conn, project)
+            for project_name, envs in runtime.items():
+                for env_id, fields in envs.items():
+                    conn.execute(INSERT_RUNTIME, (project_name, env_id, json.dumps(fields)))
+            conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (db_path or "",))
+        if data:
+            print(f"Migrated {len(data.get('users', []))} users and {len(data.get('projects', []))} projects from {db_path}")
+
+    # --- Row helpers ---
+
+    @staticmethod
+    def _split_project(project: Dict[str, Any]):
+        config = {k: v for k, v in project.items() if k != "environments"}
+        return config, project.get("environments", [])
+
+    def _insert_project(self, conn: sqlite3.Connection, project: Dict[str, Any]):
+        config, environments = self._split_project(project)
+        conn.execute(INSERT_PROJECT, (project["name"], json.dumps(config)))
+        for position, env in enumerate(environments):
+            conn.execute(UPSERT_ENV, (project["name"], env["id"], position, json.dumps(env)))
+
+    def _load_project(self, conn: sqlite3.Connection, name: str, config: str) -> Dict[str, Any]:
+        project = json.loads(config)
+        project["environments"] = [json.loads(row[0]) for row in conn.execute(SELECT_PROJECT_ENVS, (name,))]
+        return project
+
+    # --- Users ---
+
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(SELECT_USER, (username,)).fetchone()
+        return {"username": row[0], "hashed_password": row[1]} if row else None
+
+    def list_users(self) -> List[Dict[str, Any]]:
+        return [{"username": u, "hashed_password": h} for u, h in self._conn().execute(SELECT_USERS)]
+
+    def add_user(self, user: Dict[str, Any], only_first: bool = False) -> Dict[str, Any]:
+        try:
+            with self._write() as conn:
+                if only_first and conn.execute(SELECT_ANY_USER).fetchone():
+                    raise ValueError("Cannot create user, a user already exists.")
+                conn.execute(INSERT_USER, (user["username"], user["hashed_password"]))
+        except sqlite3.IntegrityError:
+            raise ValueError("Username already registered")
+        return dict(user)
+
+    # --- Projects & environments ---
+
+    def list_projects(self) -> List[Dict[str, Any]]:
+        conn = self._conn()
+        envs_by_project: Dict[str, List[Dict[str, Any]]] = {}
+        for project_name, config in conn.execute(SELECT_ALL_ENVS):
+            envs_by_project.setdefault(project_name, []).append(json.loads(config))
+        projects = []
+        for name, config in conn.execute(SELECT_PROJECTS):
+            project = json.loads(config)
+            project["environments"] = envs_by_project.get(name, [])
+            projects.append(project)
+        return projects
+
+    def get_project(self, name: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        row = conn.execute(SELECT_PROJECT, (name,)).fetchone()
+        return self._load_project(conn, name, row[0]) if row else None
+
+    def add_project(self, project: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            with self._write() as conn:
+                self._insert_project(conn, project)
+        except sqlite3.IntegrityError:
+            raise ValueError("Project with this name already exists.")
+        return self.get_project(project["name"])
+
+    def update_project(self, name: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._write() as conn:
+            row = conn.execute(SELECT_PROJECT, (name,)).fetchone()
+            if row is None:
+                return None
+            config = json.loads(row[0])
+            config_updates, _ = self._split_project(updates)
+            if any(config.get(key) != value for key, value in config_updates.items()):
+                config.update(config_updates)
+                conn.execute(UPDATE_PROJECT, (json.dumps(config), name))
+            if "environments" in updates:
+                current = {
+                    json.loads(c)["id"]: (position, c)
+                    for position, c in enumerate(r[0] for r in conn.execute(SELECT_PROJECT_ENVS, (name,)))
+                }
+                wanted_ids = set()
+                for position, env in enumerate(updates["environments"]):
+                    wanted_ids.add(env["id"])
+                    encoded = json.dumps(env)
+                    if current.get(env["id"]) != (position, encoded):
+                        conn.execute(UPSERT_ENV, (name, env["id"], position, encoded))
+                for env_id in current.keys() - wanted_ids:
+                    conn.execute(DELETE_ENV, (name, env_id))
+        return self.get_project(name)
+
+    def add_environments(self, project_name: str, environments: List[Dict[str, Any]]) -> Optional[List[str]]:
+        with self._write() as conn:
+            if conn.execute(SELECT_PROJECT, (project_name,)).fetchone() is None:
+                return None
+            added = []
+            for env in environments:
+                cursor = conn.execute(INSERT_ENV, (project_name, env["id"], project_name, json.dumps(env)))
+                if cursor.rowcount:
+                    added.append(env["id"])
+            return added
+
+    def remove_environments(self, project_name: str, env_ids: Iterable[str]) -> List[str]:
+        with self._write() as conn:
+            removed = []
+            for env_id in dict.fromkeys(env_ids):
+                if conn.execute(DELETE_ENV, (project_name, env_id)).rowcount:
+                    removed.append(env_id)
+            return removed
+
+    def get_environment(self, project_name: str, env_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(SELECT_ENV, (project_name, env_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update_environment(self, project_name: str, env_id: str, updates: Dict[str, Any]) -> bool:
+        with self._write() as conn:
+            row = conn.execute(SELECT_ENV, (project_name, env_id)).fetchone()
+            if row is None:
+                return False
+            env = json.loads(row[0])
+            if any(env.get(key) != value for key, value in updates.items()):
+                env.update(updates)
+                conn.execute(UPDATE_ENV, (json.dumps(env), project_name, env_id))
+            return True
+
+    # --- Runtime state ---
+
+    def load_runtime_state(self) -> RuntimeEntries:
+        return {
+            (project_name, env_id): json.loads(fields)
+            for project_name, env_id, fields in self._conn().execute(SELECT_RUNTIME)
+        }
+
+    def save_runtime_state(self, updates: RuntimeEntries, removed: Iterable[Tuple[str, str]] = ()):
+        with self._write() as conn:
+            conn.executemany(
+                UPSERT_RUNTIME,
+                [(p, e, json.dumps(fields)) for (p, e), fields in updates.items()],
+            )
+            conn.executemany(DELETE_RUNTIME, list(removed))
+
+    def save_worker_activity(self, worker_id: str, activity: ActivityTimes, expires_at: float):
+        with self._write() as conn:
+            conn.execute(DELETE_WORKER_ACTIVITY, (worker_id, time.time()))
+            if activity:
+                conn.execute(UPSERT_WORKER_ACTIVITY, (
+                    worker_id, expires_at, json.dumps([[p, e, at] for (p, e), at in activity.items()]),
+                ))
+
+    def load_worker_activity(self) -> ActivityTimes:
+        latest: ActivityTimes = {}
+        for (activity,) in self._conn().execute(SELECT_WORKER_ACTIVITY, (time.time(),)):
+            for project_name, env_id, at in json.loads(activity):
+                key = (project_name, env_id)
+                latest[key] = max(at, latest.get(key, at))
+        return latest
+
+
+class _WriteTransaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK under the process-wide write lock."""
+
+    def __init__(self, lock: threading.Lock, conn: sqlite3.Connection):
+        self.lock = lock
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.execute("COMMIT")
+            else:
+                self.conn.execute("ROLLBACK")
+        finally:
+            self.lock.release()
+        return False
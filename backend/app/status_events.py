@@ -0,0 +1,56 @@
+import asyncio
+from typing import Optional, Dict, Any, Set
+
+# Events queued per subscriber before the slowest clients start missing updates
+SUBSCRIBER_QUEUE_MAX = 256
+
+# --- Environment Status Events ---
+
+class StatusHub:
+    """Fans environment status changes out to subscribed clients.
+
+    `publish()` may be called from any thread (readiness watchers run in
+    their own); events are handed to the event loop the subscribers live on.
+    A subscriber that falls too far behind drops events, and gets an
+    overflow marker so it knows to re-fetch the full state.
+    """
+
+    def __init__(self):
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_MAX)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, project_name: str, env_id: str, status: Optional[str]):
+        event = {"type": "status", "project": project_name, "env": env_id, "status": status}
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._subscribers:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event: Dict[str, Any]):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Make room for a single overflow marker; the client re-syncs from scratch
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "overflow"})
+
+
+status_hub = StatusHub()
@@ -0,0 +1,456 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Optional, List, Dict, Any, Tuple, Callable, Iterable
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; cross-process locking is skipped there
+    fcntl = None
+
+DB_PATH = 'data/db.json'
+RUNTIME_PATH = 'data/runtime.json'
+WORKERS_PATH = 'data/workers.json'
+SQLITE_PATH = 'data/db.sqlite3'
+# "json" keeps data/db.json as the source of truth, "sqlite" uses data/db.sqlite3
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+
+RuntimeEntries = Dict[Tuple[str, str], Dict[str, Any]]
+# Last activity time per environment, as published by a worker process
+ActivityTimes = Dict[Tuple[str, str], float]
+
+if TYPE_CHECKING:
+    from .file_watch import FileWatcher
+
+
+def write_json_atomic(path: str, data: Any):
+    """Atomically replaces the file at `path` with `data` serialized as JSON."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.db-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive advisory lock shared by every worker process on this host."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+# --- Storage Interface ---
+
+def try_exclusive_lock(path: str):
+    """Non-blocking `file_lock`: the open lock file (held until closed), or None if another process has it."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    f = open(path, 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+    return f
+
+
+class StorageBackend(ABC):
+    """Persistence used by ProjectService, the auth helpers and RuntimeState.
+
+    Implementations return fresh dicts that callers are free to mutate.
+    """
+
+    # Users
+    @abstractmethod
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def list_users(self) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def add_user(self, user: Dict[str, Any], only_first: bool = False) -> Dict[str, Any]:
+        """Raises ValueError if the username is taken (or, with `only_first`, if any user exists).
+
+        The `only_first` check is made in the same write as the insert.
+        """
+
+    # Projects & environments
+    @abstractmethod
+    def list_projects(self) -> List[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def get_project(self, name: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def add_project(self, project: Dict[str, Any]) -> Dict[str, Any]:
+        """Raises ValueError if a project with the same name exists."""
+
+    @abstractmethod
+    def update_project(self, name: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merges `updates` into the project; returns None if it doesn't exist."""
+
+    @abstractmethod
+    def add_environments(self, project_name: str, environments: List[Dict[str, Any]]) -> Optional[List[str]]:
+        """Appends environments whose id is free, atomically; returns the ids added (None if no project)."""
+
+    @abstractmethod
+    def remove_environments(self, project_name: str, env_ids: Iterable[str]) -> List[str]:
+        """Removes the given environments, atomically; returns the ids that existed."""
+
+    @abstractmethod
+    def get_environment(self, project_name: str, env_id: str) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    def update_environment(self, project_name: str, env_id: str, updates: Dict[str, Any]) -> bool:
+        """Merges `updates` into the environment; returns False if it doesn't exist."""
+
+    # Runtime state (see runtime_state.py)
+    @abstractmethod
+    def load_runtime_state(self) -> RuntimeEntries: ...
+
+    @abstractmethod
+    def save_runtime_state(self, updates: RuntimeEntries, removed: Iterable[Tuple[str, str]] = ()):
+        """Upserts the given entries and deletes `removed`, leaving the rest untouched."""
+
+    @abstractmethod
+    def save_worker_activity(self, worker_id: str, activity: ActivityTimes, expires_at: float):
+        """Replaces what `worker_id` reports, valid until `expires_at`; drops expired workers."""
+
+    @abstractmethod
+    def load_worker_activity(self) -> ActivityTimes:
+        """Latest activity per environment across all workers whose report hasn't expired."""
+
+    def watch(self, watcher: "FileWatcher", on_runtime_change: Callable[[], None]):
+        """Subscribes cached state (this store's, and RuntimeState via `on_runtime_change`) to other workers' writes."""
+
+
+# --- Resident JSON Store ---
+
+class JSONStore(StorageBackend):
+    """Keeps data/db.json resident in memory, indexed for O(1) lookups.
+
+    Users are indexed by username, projects by name and environments by
+    (project name, env id). Every mutation is written through to disk with an
+    atomic temp-file-and-rename, and only when it actually changes something.
+    Getters hand out copies so callers can't mutate the cache behind its back.
+
+    Other worker processes may rewrite the file too. Once `watch()` hooks the
+    store up to a running FileWatcher, inotify events mark the cache stale;
+    without one, every access compares the file's mtime/size/inode instead.
+    Mutations always re-validate under a cross-process file lock.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, runtime_path: str = RUNTIME_PATH, workers_path: str = WORKERS_PATH):
+        self.db_path = db_path
+        self.runtime_path = runtime_path
+        self.workers_path = workers_path
+        self._lock = threading.RLock()
+        self._data: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._stale = False
+        self._watcher: Optional["FileWatcher"] = None
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._projects: Dict[str, Dict[str, Any]] = {}
+        self._environments: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    # --- Loading, indexing & persistence ---
+
+    def _read_file(self) -> Dict[str, List[Dict[str, Any]]]:
+        try:
+            with open(self.db_path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # If file doesn't exist or is empty/corrupted, start fresh
+            data = {}
+        data.setdefault("users", [])
+        data.setdefault("projects", [])
+        return data
+
+    def _file_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.db_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _ensure_loaded(self, validate: bool = False) -> Dict[str, List[Dict[str, Any]]]:
+        if self._data is None:
+            self._signature = self._file_signature()
+            self._data = self._read_file()
+            self._rebuild_indexes()
+        elif validate or self._stale or not self._notifications_active():
+            self._stale = False
+            signature = self._file_signature()
+            if signature != self._signature:
+                self._signature = signature
+                self._reload()
+        return self._data
+
+    def _notifications_active(self) -> bool:
+        return self._watcher is not None and self._watcher.active
+
+    def _rebuild_indexes(self):
+        self._users = {u["username"]: u for u in self._data["users"]}
+        self._projects = {}
+        self._environments = {}
+        for project in self._data["projects"]:
+            self._projects[project["name"]] = project
+            self._index_environments(project)
+
+    def _index_environments(self, project: Dict[str, Any]):
+        self._environments[project["name"]] = {
+            env["id"]: env for env in project.get("environments", [])
+        }
+
+    def _reload(self):
+        """Re-reads the file written by another process, re-indexing only what changed."""
+        fresh = self._read_file()
+        changed = 0
+        projects = []
+        for project in fresh["projects"]:
+            current = self._projects.get(project["name"])
+            if current is not None and current == project:
+                projects.append(current)
+            else:
+                projects.append(project)
+                self._index_environments(project)
+                changed += 1
+        fresh["projects"] = projects
+        for name in self._projects.keys() - {p["name"] for p in projects}:
+            self._environments.pop(name, None)
+            changed += 1
+        self._projects = {p["name"]: p for p in projects}
+        self._users = {u["username"]: u for u in fresh["users"]}
+        self._data = fresh
+        print(f"Reloaded {self.db_path} after external change ({changed} projects changed)")
+
+    @contextmanager
+    def _mutation(self):
+        """Serializes writers across threads and processes on a fresh view of the file."""
+        with self._lock, file_lock(self.db_path + '.lock'):
+            self._ensure_loaded(validate=True)
+            yield
+
+    def _save(self):
+        write_json_atomic(self.db_path, self._data)
+        self._signature = self._file_signature()
+
+    def invalidate(self):
+        """Called by the file watcher when db.json changes on disk."""
+        self._stale = True
+
+    def watch(self, watcher: "FileWatcher", on_runtime_change: Callable[[], None]):
+        self._watcher = watcher
+        watcher.watch(self.db_path, self.invalidate)
+        watcher.watch(self.runtime_path, on_runtime_change)
+
+    @staticmethod
+    def _copy_project(project: Dict[str, Any]) -> Dict[str, Any]:
+        copied = dict(project)
+        if "environments" in project:
+            copied["environments"] = [dict(env) for env in project["environments"]]
+        return copied
+
+    # --- Users ---
+
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            user = self._users.get(username)
+            return dict(user) if user else None
+
+    def list_users(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            data = self._ensure_loaded()
+            return [dict(u) for u in data["users"]]
+
+    def add_user(self, user: Dict[str, Any], only_first: bool = False) -> Dict[str, Any]:
+        with self._mutation():
+            data = self._data
+            if only_first and data["users"]:
+                raise ValueError("Cannot create user, a user already exists.")
+            if user["username"] in self._users:
+                raise ValueError("Username already registered")
+            stored = dict(user)
+            data["users"].append(stored)
+            self._users[stored["username"]] = stored
+            self._save()
+            return dict(stored)
+
+    # --- Projects & environments ---
+
+    def list_projects(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            data = self._ensure_loaded()
+            return [self._copy_project(p) for p in data["projects"]]
+
+    def get_project(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            project = self._projects.get(name)
+            return self._copy_project(project) if project else None
+
+    def add_project(self, project: Dict[str, Any]) -> Dict[str, Any]:
+        with self._mutation():
+            data = self._data
+            if project["name"] in self._projects:
+                raise ValueError("Project with this name already exists.")
+            stored = self._copy_project(project)
+            data["projects"].append(stored)
+            self._projects[stored["name"]] = stored
+            self._index_environments(stored)
+            self._save()
+            return self._copy_project(stored)
+
+    def update_project(self, name: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._mutation():
+            project = self._projects.get(name)
+            if project is None:
+                return None
+            if any(project.get(key) != value for key, value in updates.items()):
+                project.update(self._copy_project(updates))
+                self._index_environments(project)
+                self._save()
+            return self._copy_project(project)
+
+    def add_environments(self, project_name: str, environments: List[Dict[str, Any]]) -> Optional[List[str]]:
+        with self._mutation():
+            project = self._projects.get(project_name)
+            if project is None:
+                return None
+            envs = self._environments.setdefault(project_name, {})
+            added = []
+            for env in environments:
+                if env["id"] in envs:
+                    continue
+                stored = dict(env)
+                project.setdefault("environments", []).append(stored)
+                envs[stored["id"]] = stored
+                added.append(stored["id"])
+            if added:
+                self._save()
+            return added
+
+    def remove_environments(self, project_name: str, env_ids: Iterable[str]) -> List[str]:
+        with self._mutation():
+            project = self._projects.get(project_name)
+            envs = self._environments.get(project_name, {})
+            removed = [env_id for env_id in dict.fromkeys(env_ids) if env_id in envs]
+            if project is not None and removed:
+                project["environments"] = [e for e in project.get("environments", []) if e["id"] not in removed]
+                self._index_environments(project)
+                self._save()
+            return removed
+
+    def get_environment(self, project_name: str, env_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            env = self._environments.get(project_name, {}).get(env_id)
+            return dict(env) if env else None
+
+    def update_environment(self, project_name: str, env_id: str, updates: Dict[str, Any]) -> bool:
+        with self._mutation():
+            env = self._environments.get(project_name, {}).get(env_id)
+            if env is None:
+                return False
+            if any(env.get(key) != value for key, value in updates.items()):
+                env.update(updates)
+                self._save()
+            return True
+
+    # --- Runtime state ---
+
+    def load_runtime_state(self) -> RuntimeEntries:
+        try:
+            with open(self.runtime_path, 'r') as f:
+                raw = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            raw = {}
+        return {
+            (project_name, env_id): fields
+            for project_name, envs in raw.items()
+            for env_id, fields in envs.items()
+        }
+
+    def save_runtime_state(self, updates: RuntimeEntries, removed: Iterable[Tuple[str, str]] = ()):
+        # Read-merge-write under the file lock so workers don't clobber each other's entries
+        with file_lock(self.runtime_path + '.lock'):
+            try:
+                with open(self.runtime_path, 'r') as f:
+                    raw = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                raw = {}
+            for (project_name, env_id), fields in updates.items():
+                raw.setdefault(project_name, {})[env_id] = fields
+            for project_name, env_id in removed:
+                envs = raw.get(project_name, {})
+                envs.pop(env_id, None)
+                if not envs:
+                    raw.pop(project_name, None)
+            write_json_atomic(self.runtime_path, raw)
+
+    def _read_workers(self) -> Dict[str, Any]:
+        try:
+            with open(self.workers_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_worker_activity(self, worker_id: str, activity: ActivityTimes, expires_at: float):
+        with file_lock(self.workers_path + '.lock'):
+            now = time.time()
+            raw = {
+                worker: report for worker, report in self._read_workers().items()
+                if worker != worker_id and report.get("expires_at", 0) > now
+            }
+            if activity:
+                raw[worker_id] = {
+                    "expires_at": expires_at,
+                    "activity": [[p, e, at] for (p, e), at in activity.items()],
+                }
+            write_json_atomic(self.workers_path, raw)
+
+    def load_worker_activity(self) -> ActivityTimes:
+        now = time.time()
+        latest: ActivityTimes = {}
+        for report in self._read_workers().values():
+            if report.get("expires_at", 0) <= now:
+                continue
+            for project_name, env_id, at in report.get("activity", []):
+                key = (project_name, env_id)
+                latest[key] = max(at, latest.get(key, at))
+        return latest
+
+
+def create_store(backend: str = STORAGE_BACKEND) -> StorageBackend:
+    if backend == "sqlite":
+        from .sqlite_store import SQLiteStore
+        return SQLiteStore(SQLITE_PATH, legacy_db_path=DB_PATH, legacy_runtime_path=RUNTIME_PATH)
+    if backend != "json":
+        raise ValueError(f"Unknown storage backend '{backend}'")
+    return JSONStore()
+
+
+db_store = create_store()
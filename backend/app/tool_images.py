@@ -0,0 +1,248 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, List, Dict, Any, Tuple
+
+import docker
+
+# npm package installed for each AI tool, and the version to bake into images
+TOOL_PACKAGES = {
+    "gemini": "@google/gemini-cli",
+    "claude": "@anthropic-ai/claude-code",
+}
+TOOL_VERSIONS = {
+    "gemini": os.environ.get("GEMINI_CLI_VERSION", "latest"),
+    "claude": os.environ.get("CLAUDE_CODE_VERSION", "latest"),
+}
+NODE_MAJOR = 20
+TOOL_IMAGE_REPO = "iruka-tools"
+TOOL_IMAGE_LABEL = "iruka.tool-image"
+# Present in a tool image; the setup script skips the install steps when it exists
+TOOL_MARKER_DIR = "/opt/iruka"
+# What a terminal attach runs: `iruka-shell <ai_tool>`
+SHELL_LAUNCHER = f"{TOOL_MARKER_DIR}/bin/iruka-shell"
+# Environment variables (tokens included) of a claimed warm pool container; root-only
+CLAIM_ENV_FILE = "/etc/iruka-env"
+SHELL_LAUNCHER_SCRIPT = """#!/bin/sh
+[ -f /etc/environment ] && . /etc/environment
+[ -r """ + CLAIM_ENV_FILE + """ ] && . """ + CLAIM_ENV_FILE + """
+export TERM=xterm-256color
+while [ ! -f /tmp/setup_complete ]; do sleep 0.2; done
+cd /workspace 2>/dev/null
+if [ "$1" = "claude" ]; then
+    # Continue the last conversation if there is one; script gives claude a controlling tty
+    exec script -qec 'claude -c || claude' /dev/null
+fi
+if [ "$GEMINI_USE_GOOGLE_LOGIN" = "true" ]; then
+    echo "Google Login Mode: Run 'gemini login' to authenticate with your Google account"
+    echo "After login, run 'gemini' to start the CLI"
+    exec /bin/bash
+fi
+exec gemini
+"""
+
+
+def tool_marker(ai_tool: str) -> str:
+    return f"{TOOL_MARKER_DIR}/{ai_tool}-tools"
+
+
+def tool_package(ai_tool: str) -> str:
+    return f"{TOOL_PACKAGES[ai_tool]}@{TOOL_VERSIONS[ai_tool]}"
+
+
+def tool_install_script(ai_tool: str) -> str:
+    """Shell commands installing curl, git, Node.js and the AI tool's CLI."""
+    return (
+        "apt-get update -y && apt-get install -y curl git"
+        f" && curl -fsSL https://deb.nodesource.com/setup_{NODE_MAJOR}.x | bash -"
+        " && apt-get install -y nodejs"
+        f" && npm install -g {tool_package(ai_tool)} --unsafe-perm=true --allow-root"
+    )
+
+
+def launcher_install_script() -> str:
+    """Shell command writing SHELL_LAUNCHER (base64, so no quoting issues in a Dockerfile RUN)."""
+    encoded = base64.b64encode(SHELL_LAUNCHER_SCRIPT.encode("utf-8")).decode("ascii")
+    return (
+        f"mkdir -p {os.path.dirname(SHELL_LAUNCHER)}"
+        f" && echo {encoded} | base64 -d > {SHELL_LAUNCHER}"
+        f" && chmod 755 {SHELL_LAUNCHER}"
+    )
+
+
+def shell_command(ai_tool: str) -> List[str]:
+    """Exec command for a terminal: the installed launcher, or the same script inline in older containers."""
+    return ["sh", "-c", f'[ -x {SHELL_LAUNCHER} ] && exec {SHELL_LAUNCHER} "$1"\n{SHELL_LAUNCHER_SCRIPT}', "iruka-shell", ai_tool]
+
+
+def tool_dockerfile(base_image: str, ai_tool: str) -> str:
+    return (
+        f"FROM {base_image}\n"
+        "ARG DEBIAN_FRONTEND=noninteractive\n"
+        f"RUN {tool_install_script(ai_tool)} && rm -rf /var/lib/apt/lists/*\n"
+        f"RUN mkdir -p {TOOL_MARKER_DIR} && touch {tool_marker(ai_tool)}\n"
+        f"RUN {launcher_install_script()}\n"
+    )
+
+
+# --- Tool Image Cache ---
+
+class ToolImageCache:
+    """Derived images with Node.js and an AI tool preinstalled on a base image.
+
+    Images are tagged by a hash of the base image id and the build recipe
+    (tool, package version, Dockerfile), so a changed base image or tool
+    version simply maps to a new tag. A miss never blocks environment
+    creation: the caller gets the base image (and runs the full install in
+    the container) while the tool image is built in the background.
+    """
+
+    def __init__(self, client: docker.DockerClient, max_builds: int = 2):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_builds, thread_name_prefix="tool-image")
+        self._lock = threading.Lock()
+        self._builds: Dict[Tuple[str, str], Future] = {}
+        self._errors: Dict[Tuple[str, str], str] = {}
+
+    def _base_image_id(self, base_image: str) -> Optional[str]:
+        try:
+            return self.client.images.get(base_image).id
+        except docker.errors.ImageNotFound:
+            return None
+
+    def tag_for(self, base_image: str, base_image_id: str, ai_tool: str) -> str:
+        """The tool image tag for a base image tag and id; no daemon calls."""
+        recipe = json.dumps({
+            "base_image_id": base_image_id,
+            "ai_tool": ai_tool,
+            "package": tool_package(ai_tool),
+            "dockerfile": tool_dockerfile(base_image, ai_tool),
+        }, sort_keys=True)
+        digest = hashlib.sha256(recipe.encode('utf-8')).hexdigest()[:16]
+        return f"{TOOL_IMAGE_REPO}:{ai_tool}-{digest}"
+
+    def current_tag(self, base_image: str, ai_tool: str) -> Optional[str]:
+        """Tag the tool image for this combination has (or would have) right now."""
+        base_image_id = self._base_image_id(base_image)
+        if base_image_id is None:
+            return None
+        return self.tag_for(base_image, base_image_id, ai_tool)
+
+    def resolve(self, base_image: str, ai_tool: str) -> Tuple[str, bool]:
+        """Returns (image to start from, whether the tools are preinstalled)."""
+        if ai_tool not in TOOL_PACKAGES:
+            return base_image, False
+        tag = self.current_tag(base_image, ai_tool)
+        if tag is not None:
+            try:
+                self.client.images.get(tag)
+                return tag, True
+            except docker.errors.ImageNotFound:
+                pass
+        self.build(base_image, ai_tool)
+        return base_image, False
+
+    def build(self, base_image: str, ai_tool: str, force: bool = False) -> Future:
+        """Schedules a build unless one is already running for this combination."""
+        key = (base_image, ai_tool)
+        with self._lock:
+            future = self._builds.get(key)
+            if future is None or future.done():
+                future = self._executor.submit(self._build, base_image, ai_tool, force)
+                self._builds[key] = future
+            return future
+
+    def _build(self, base_image: str, ai_tool: str, force: bool) -> str:
+        key = (base_image, ai_tool)
+        try:
+            if self._base_image_id(base_image) is None:
+                print(f"Pulling base image {base_image} for tool image build")
+                self.client.images.pull(base_image)
+            tag = self.current_tag(base_image, ai_tool)
+            if not force:
+                try:
+                    self.client.images.get(tag)
+                    return tag
+                except docker.errors.ImageNotFound:
+                    pass
+            print(f"Building tool image {tag} ({ai_tool} on {base_image})")
+            dockerfile = tool_dockerfile(base_image, ai_tool)
+            self.client.images.build(
+                fileobj=io.BytesIO(dockerfile.encode('utf-8')),
+                tag=tag,
+                rm=True,
+                # A forced rebuild must not reuse the cached npm layer for "latest"
+                nocache=force,
+                labels={
+                    TOOL_IMAGE_LABEL: "true",
+                    "iruka.base-image": base_image,
+                    "iruka.ai-tool": ai_tool,
+                    "iruka.tool-package": tool_package(ai_tool),
+                },
+            )
+            print(f"Tool image {tag} ready")
+            self._errors.pop(key, None)
+            return tag
+        except Exception as e:
+            traceback.print_exc()
+            self._errors[key] = str(e)
+            raise
+
+    def list(self) -> List[Dict[str, Any]]:
+        images = []
+        for image in self.client.images.list(filters={"label": f"{TOOL_IMAGE_LABEL}=true"}):
+            labels = image.labels or {}
+            base_image = labels.get("iruka.base-image")
+            ai_tool = labels.get("iruka.ai-tool")
+            images.append({
+                "tags": image.tags,
+                "base_image": base_image,
+                "ai_tool": ai_tool,
+                "tool_package": labels.get("iruka.tool-package"),
+                "created": image.attrs.get("Created"),
+                "size": image.attrs.get("Size"),
+                "current": self.current_tag(base_image, ai_tool) in image.tags if base_image and ai_tool in TOOL_PACKAGES else False,
+            })
+        return images
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            building = [
+                {"base_image": base_image, "ai_tool": ai_tool}
+                for (base_image, ai_tool), future in self._builds.items() if not future.done()
+            ]
+        failed = [
+            {"base_image": base_image, "ai_tool": ai_tool, "error": error}
+            for (base_image, ai_tool), error in self._errors.items()
+        ]
+        return {"images": self.list(), "building": building, "failed": failed}
+
+    def invalidate(self, base_image: Optional[str] = None, ai_tool: Optional[str] = None) -> List[str]:
+        """Removes cached tool images, optionally only for one base image and/or tool.
+
+        Running containers keep working; only new environments are affected.
+        """
+        removed = []
+        for image in self.client.images.list(filters={"label": f"{TOOL_IMAGE_LABEL}=true"}):
+            labels = image.labels or {}
+            if base_image is not None and labels.get("iruka.base-image") != base_image:
+                continue
+            if ai_tool is not None and labels.get("iruka.ai-tool") != ai_tool:
+                continue
+            for tag in image.tags:
+                try:
+                    self.client.images.remove(tag, force=True)
+                    removed.append(tag)
+                except docker.errors.APIError as e:
+                    print(f"Error removing tool image {tag}: {e}")
+        return removed
+
+    def rebuild(self, base_image: str, ai_tool: str) -> Future:
+        """Drops the cached image for this combination and builds it from scratch."""
+        self.invalidate(base_image, ai_tool)
+        return self.build(base_image, ai_tool, force=True)
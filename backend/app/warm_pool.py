@@ -0,0 +1,291 @@
+import io
+import os
+import shlex
+import shutil
+import tarfile
+import threading
+import time
+import traceback
+import uuid
+from typing import Optional, List, Dict, Any, Tuple
+
+import docker
+
+from .tool_images import ToolImageCache, CLAIM_ENV_FILE
+from .container_state import MANAGED_LABEL
+from .admission import update_limits, host_memory_mb
+
+# Idle containers kept per (base_image, ai_tool); 0 disables the pool
+WARM_POOL_SIZE = int(os.environ.get("WARM_POOL_SIZE", 1))
+# Pairs to keep warm from startup, e.g. "claude@ubuntu:22.04,gemini@node:20"; others are added on first use
+WARM_POOL_TARGETS = os.environ.get("WARM_POOL_TARGETS", "")
+# Host memory idle pool containers may take up, and the estimate charged per container
+WARM_POOL_MEMORY_MB = int(os.environ.get("WARM_POOL_MEMORY_MB", 2048))
+WARM_POOL_CONTAINER_MB = int(os.environ.get("WARM_POOL_CONTAINER_MB", 512))
+WARM_POOL_REFILL_INTERVAL = 30
+POOL_NAME_PREFIX = "iruka-pool-"
+POOL_LABEL = "iruka.pool"
+# Claude session transcripts, one subdirectory per container (a pool container's is renamed on claim)
+CLAUDE_SESSIONS_DIR = "data/claude_sessions"
+CLAUDE_SESSIONS_MOUNT = "/root/.claude/projects/-workspace"
+
+# Runs as PID 1 of a pool container: wait for a claim, then set up the workspace.
+# The consumed claim leaves /tmp/iruka-claimed, so a restarted container just idles.
+POOL_COMMAND = """
+set -e
+if [ ! -f /tmp/iruka-claimed ]; then
+    touch /tmp/pool_ready
+    while [ ! -f /tmp/iruka-claim.ready ]; do sleep 0.2; done
+    mv /tmp/iruka-claim.ready /tmp/iruka-claimed
+    . /tmp/iruka-claim.sh
+fi
+exec tail -f /dev/null
+"""
+
+
+def _claim_archive(files: Dict[str, str]) -> bytes:
+    """Tar of the given files, extracted in order (the .ready marker goes last)."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, content in files.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o600
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+# --- Warm Container Pool ---
+
+class WarmPool:
+    """Idle, already running containers waiting to become environments.
+
+    Pool containers start from the prebuilt tool image and block in
+    POOL_COMMAND. Claiming one copies in the project's environment variables
+    (into the root-only CLAIM_ENV_FILE, which shell sessions source) and the
+    workspace setup script, then renames the container to the environment's
+    standard name, so only the git clone remains on the critical path.
+
+    A background thread refills the pool for every pair that has been used,
+    as long as the idle containers fit in WARM_POOL_MEMORY_MB and the host
+    has memory to spare. The idle list is per process: like admission, the
+    pool assumes the single worker `AdmissionController.claim_host` enforces.
+    """
+
+    def __init__(self, client: docker.DockerClient, tool_images: ToolImageCache, size: int = WARM_POOL_SIZE):
+        self.client = client
+        self.tool_images = tool_images
+        self.size = size
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str], List[Dict[str, str]]] = {}
+        self._targets = set(self._parse_targets(WARM_POOL_TARGETS))
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _parse_targets(spec: str) -> List[Tuple[str, str]]:
+        targets = []
+        for item in spec.split(","):
+            ai_tool, _, base_image = item.strip().partition("@")
+            if ai_tool and base_image:
+                targets.append((base_image, ai_tool))
+        return targets
+
+    def start(self):
+        if self.size <= 0 or self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="warm-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops refilling; idle containers stay up and are adopted on the next start."""
+        self._stopping.set()
+        self._wake.set()
+        self._thread = None
+
+    def _run(self):
+        self._adopt_existing()
+        while not self._stopping.is_set():
+            try:
+                self.refill()
+            except Exception as e:
+                print(f"Error refilling warm pool: {e}")
+            self._wake.wait(WARM_POOL_REFILL_INTERVAL)
+            self._wake.clear()
+
+    def _adopt_existing(self):
+        """Picks up idle pool containers left by a previous run; removes dead ones."""
+        for container in self.client.containers.list(all=True, filters={"label": POOL_LABEL}):
+            if not container.name.startswith(POOL_NAME_PREFIX):
+                continue  # Already claimed and renamed
+            if container.status != "running":
+                self._remove(container.name)
+                continue
+            labels = container.labels or {}
+            key = (labels.get("iruka.base-image"), labels.get("iruka.ai-tool"))
+            if None in key:
+                continue
+            if key[1] == "claude" and not os.path.isdir(os.path.join(CLAUDE_SESSIONS_DIR, container.name)):
+                # Started before pool containers had their own transcript directory
+                self._remove(container.name)
+                continue
+            entry = {"name": container.name, "image": labels.get("iruka.image")}
+            with self._lock:
+                self._idle.setdefault(key, []).append(entry)
+                self._targets.add(key)
+            print(f"Adopted warm pool container {container.name}")
+
+    def refill(self):
+        with self._lock:
+            targets = list(self._targets)
+        for base_image, ai_tool in targets:
+            image, tools_preinstalled = self.tool_images.resolve(base_image, ai_tool)
+            if not tools_preinstalled:
+                continue  # Pool containers are only worth it once the tool image exists
+            self._drop_stale((base_image, ai_tool), image)
+            while self._idle_count((base_image, ai_tool)) < self.size and self._has_memory_budget():
+                if not self._start_container(base_image, ai_tool, image):
+                    break
+
+    def _idle_count(self, key: Optional[Tuple[str, str]] = None) -> int:
+        with self._lock:
+            if key is not None:
+                return len(self._idle.get(key, []))
+            return sum(len(entries) for entries in self._idle.values())
+
+    def _has_memory_budget(self) -> bool:
+        if (self._idle_count() + 1) * WARM_POOL_CONTAINER_MB > WARM_POOL_MEMORY_MB:
+            return False
+        # Leave the host at least one more container's worth of headroom
+        available = host_memory_mb("MemAvailable")
+        return available is None or available >= 2 * WARM_POOL_CONTAINER_MB
+
+    def _drop_stale(self, key: Tuple[str, str], image: str):
+        """Removes idle containers started from an older tool image."""
+        with self._lock:
+            entries = self._idle.get(key, [])
+            stale = [entry for entry in entries if entry["image"] != image]
+            self._idle[key] = [entry for entry in entries if entry["image"] == image]
+        for entry in stale:
+            print(f"Removing warm pool container {entry['name']} built from outdated image {entry['image']}")
+            self._remove(entry["name"])
+
+    def _start_container(self, base_image: str, ai_tool: str, image: str) -> bool:
+        name = f"{POOL_NAME_PREFIX}{ai_tool}-{uuid.uuid4().hex[:12]}"
+        # No git mirror: the repository isn't known until the claim, and mounts can't be added then
+        volumes = {}
+        if ai_tool == "claude":
+            session_dir = os.path.join(CLAUDE_SESSIONS_DIR, name)
+            os.makedirs(session_dir, exist_ok=True)
+            volumes[os.path.abspath(session_dir)] = {'bind': CLAUDE_SESSIONS_MOUNT, 'mode': 'rw'}
+        try:
+            self.client.containers.run(
+                image=image,
+                name=name,
+                command=["/bin/sh", "-c", POOL_COMMAND],
+                labels={
+                    MANAGED_LABEL: "true",
+                    POOL_LABEL: "true",
+                    "iruka.base-image": base_image,
+                    "iruka.ai-tool": ai_tool,
+                    "iruka.image": image,
+                },
+                volumes=volumes,
+                detach=True,
+            )
+        except Exception as e:
+            print(f"Error starting warm pool container for {ai_tool} on {base_image}: {e}")
+            self._remove(name)
+            return False
+        with self._lock:
+            self._idle.setdefault((base_image, ai_tool), []).append({"name": name, "image": image})
+        print(f"Started warm pool container {name} ({ai_tool} on {base_image})")
+        return True
+
+    def claim(
+        self, container_name: str, base_image: str, ai_tool: str, env_vars: Dict[str, str],
+        workspace_script: str, resources: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """Turns an idle pool container into `container_name`; False if none was available."""
+        if self.size <= 0:
+            return False
+        key = (base_image, ai_tool)
+        with self._lock:
+            self._targets.add(key)
+            entries = self._idle.get(key, [])
+            entry = entries.pop(0) if entries else None
+        self._wake.set()  # Refill, or start warming a pair seen for the first time
+        if entry is None:
+            return False
+
+        environment = "".join(
+            f"export {name}={shlex.quote(str(value))}\n" for name, value in env_vars.items()
+        )
+        # Never traced: sourcing the file under `set -x` would print every token to the container log
+        claim_script = (
+            f"mv /tmp/iruka-claim.env {CLAIM_ENV_FILE}\n"
+            f"chmod 600 {CLAIM_ENV_FILE}\n"
+            f". {CLAIM_ENV_FILE}\n"
+        )
+        claim_script += workspace_script
+        try:
+            container = self.client.containers.get(entry["name"])
+            if container.status != "running":
+                raise RuntimeError(f"container is {container.status}")
+            if resources:
+                container.update(**update_limits(resources))
+            container.put_archive("/tmp", _claim_archive({
+                "iruka-claim.env": environment,
+                "iruka-claim.sh": claim_script,
+                "iruka-claim.ready": "",
+            }))
+            if ai_tool == "claude":
+                self._hand_over_sessions(entry["name"], container_name)
+            container.rename(container_name)
+        except Exception as e:
+            traceback.print_exc()
+            print(f"Could not claim warm pool container {entry['name']}: {e}")
+            self._remove(entry["name"])
+            return False
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "memory_budget_mb": WARM_POOL_MEMORY_MB,
+                "pools": [
+                    {"base_image": base_image, "ai_tool": ai_tool, "idle": [entry["name"] for entry in self._idle.get((base_image, ai_tool), [])]}
+                    for base_image, ai_tool in sorted(self._targets)
+                ],
+            }
+
+    @staticmethod
+    def _hand_over_sessions(pool_name: str, container_name: str):
+        """Renames the pool container's transcript directory to the environment's.
+
+        The container's bind mount follows the directory, so it now holds the
+        same files `_environment_volumes` mounts for `container_name`.
+        Transcripts of an earlier environment with that name are kept.
+        """
+        source = os.path.join(CLAUDE_SESSIONS_DIR, pool_name)
+        target = os.path.join(CLAUDE_SESSIONS_DIR, container_name)
+        if os.path.isdir(target):
+            for item in os.listdir(target):
+                os.replace(os.path.join(target, item), os.path.join(source, item))
+            os.rmdir(target)
+        os.rename(source, target)
+
+    def _remove(self, name: str):
+        try:
+            self.client.containers.get(name).remove(force=True)
+        except docker.errors.NotFound:
+            pass
+        except Exception as e:
+            print(f"Error removing warm pool container {name}: {e}")
+        # An unclaimed container's (empty) transcript directory
+        shutil.rmtree(os.path.join(CLAUDE_SESSIONS_DIR, name), ignore_errors=True)
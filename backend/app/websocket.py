@@ -1,9 +1,14 @@
 import asyncio
 import json
-import re
+import struct
 import time
+from typing import Optional, List, Dict, Any, Tuple
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from .services import docker_service
+from .docker_async import async_docker
+from .relay import OutputEncoder, relay_stats
+from .sessions import session_manager, attach_stats
+from .status_events import status_hub
+from .registry import environment_registry, environment_tool, container_name_for
 from urllib.parse import unquote
 
 router = APIRouter()
@@ -12,14 +17,31 @@ router = APIRouter()
 WEBSOCKET_TIMEOUT = 300  # 5 minutes timeout
 HEARTBEAT_INTERVAL = 30  # Send heartbeat every 30 seconds
 MAX_IDLE_TIME = 600  # 10 minutes max idle time before disconnect
+# Environments a shell attach brings back (see hibernation.py); queued ones report their position
+WAKE_STATUSES = ("paused", "stopped", "archived", "queued")
 
-# --- Helper Functions (copied from api.py for consistency) ---
-def sanitize_for_docker(name: str) -> str:
-    """Sanitizes a string to be a valid Docker container name."""
-    sanitized = re.sub(r'[^a-zA-Z0-9_.-]', '', name)
-    if sanitized.startswith(('_', '.', '-')):
-        sanitized = 'container' + sanitized
-    return sanitized
+# --- Helper Functions ---
+def container_for_environment(project_name: str, env_id: str, env: Optional[Dict[str, Any]]) -> Tuple[str, str]:
+    """Returns (ai_tool, container_name) for an environment; defaults to Gemini."""
+    handle = environment_registry.handle(project_name, env_id, env) if env else None
+    if handle is None:
+        return environment_tool(None), container_name_for(project_name, env_id, None)
+    return handle.ai_tool, handle.container_name
+
+async def wake_environment(project_name: str, env: Optional[Dict[str, Any]], timings: Dict[str, float]) -> Optional[str]:
+    """Unpauses, starts or restores a hibernated environment before a shell attaches.
+
+    Returns a message for the client if the environment has to wait for capacity.
+    """
+    if env is None or env.get("status") not in WAKE_STATUSES:
+        return None
+    from .api import resume_environment
+    wake_start = time.perf_counter()
+    queue_position = await resume_environment(project_name, env)
+    if queue_position is not None:
+        return f"The host is at capacity; environment queued at position {queue_position}."
+    timings["wake"] = time.perf_counter() - wake_start
+    return None
 
 @router.websocket("/ws/shell/{project_name}/{env_id}")
 async def websocket_shell(websocket: WebSocket, project_name: str, env_id: str):
@@ -35,6 +57,12 @@ async def websocket_shell(websocket: WebSocket, project_name: str, env_id: str):
         await websocket.close()
         return
     
+    # Output framing is negotiated per connection: "text" (default) or "binary"
+    output_mode = websocket.query_params.get("output", "text")
+    if output_mode not in ("text", "binary"):
+        output_mode = "text"
+    compress_output = websocket.query_params.get("compress") == "deflate"
+
     # Validate the token
     from .auth import verify_token
     try:
@@ -56,53 +84,50 @@ async def websocket_shell(websocket: WebSocket, project_name: str, env_id: str):
         await websocket.close()
         return
         
-    # On successful connection, clear the disconnected_at timestamp
+    # On successful connection, count the client and clear the disconnected_at timestamp
     from .services import project_service
-    project_service.update_environment_status(
-        decoded_project_name, env_id, {"disconnected_at": None}
-    )
+    project_service.mark_connected(decoded_project_name, env_id)
     print(f"Cleared disconnected_at timestamp for env {env_id}")
     
     # First check if the environment is still initializing
-    proj = project_service.get_project(decoded_project_name)
-    if proj:
-        env = next((e for e in proj.get("environments", []) if e["id"] == env_id), None)
-        if env and env.get("status") == "pending":
-            await websocket.send_text("[Environment Initializing] Please wait while the environment is being set up...\r\n")
-            # We could wait for the setup to complete, but for now let's just inform the user
+    env = project_service.get_environment(decoded_project_name, env_id)
+    if env and env.get("status") == "pending":
+        await websocket.send_text("[Environment Initializing] Please wait while the environment is being set up...\r\n")
+        # We could wait for the setup to complete, but for now let's just inform the user
     
-    # Sanitize names to construct the correct container name
-    print(f"Sanitizing project name: '{decoded_project_name}' and env_id: '{env_id}'")
-    sane_project_name = sanitize_for_docker(decoded_project_name)
-    sane_env_id = sanitize_for_docker(env_id)
-    print(f"Sanitized names - project: '{sane_project_name}', env: '{sane_env_id}'")
+    # Determine the container name (Claude or Gemini) from the environment data
+    if not env:
+        print("Environment not found in database")
+    ai_tool, container_name = container_for_environment(decoded_project_name, env_id, env)
+    print(f"Resolved container name: '{container_name}' (AI tool: {ai_tool})")
     
-    # Try to determine if this is a Claude or Gemini environment by checking the project data
-    ai_tool = "gemini"  # default
-    container_name = f"gemini-env-{sane_project_name}-{sane_env_id}"
-    print(f"Initial container name: '{container_name}'")
-    
-    if proj:
-        env = next((e for e in proj.get("environments", []) if e["id"] == env_id), None)
-        if env and env.get("ai_tool") == "claude":
-            ai_tool = "claude"
-            container_name = f"claude-env-{sane_project_name}-{sane_env_id}"
-            print(f"Updated container name for Claude: '{container_name}'")
-        else:
-            print(f"Using Gemini environment, env ai_tool: {env.get('ai_tool') if env else 'None'}")
-    else:
-        print("Project not found in database")
-    
-    exec_id = None
-    shell_socket = None
+    session = None
+    coalescer = None
+    session_stats = None
     
     try:
-        import time
-        websocket_setup_start = time.time()
-        print(f"[PERF] WebSocket attempting to set up shell session for container: '{container_name}' with AI tool: '{ai_tool}'")
-        exec_id, shell_socket = docker_service.setup_shell_session(container_name, ai_tool)
-        websocket_setup_time = time.time() - websocket_setup_start
-        print(f"[PERF] WebSocket shell session set up successfully in {websocket_setup_time:.3f}s. exec_id: {exec_id}")
+        attach_start = time.perf_counter()
+        timings: Dict[str, float] = {}
+        # Paused containers resume in milliseconds (their shell session survives); stopped and archived ones start cold
+        wait_message = await wake_environment(decoded_project_name, env, timings)
+        if wait_message:
+            await websocket.send_text(f"[Environment Queued] {wait_message}\r\n")
+            await websocket.close()
+            return
+        reattached = session_manager.get(decoded_project_name, env_id) is not None
+        session_start = time.perf_counter()
+        session = await session_manager.get_or_create(decoded_project_name, env_id, container_name, ai_tool, timings)
+        timings["session"] = time.perf_counter() - session_start
+        session_stats = relay_stats.open(f"{decoded_project_name}/{env_id}")
+        coalescer, replay = session.attach(session_stats)
+        session_stats.buffer = coalescer
+        encoder = OutputEncoder(output_mode, compress=compress_output, stats=session_stats)
+        
+        # Replay the recent output in one bulk frame before resuming the live stream
+        if replay:
+            await encoder.send(websocket, replay)
+        timings["total"] = time.perf_counter() - attach_start
+        attach_stats.record(f"{decoded_project_name}/{env_id}", timings, reattached)
         
         # Use a mutable type (dict) to share the last activity time between tasks
         last_activity = {'time': time.time()}
@@ -129,33 +154,25 @@ async def websocket_shell(websocket: WebSocket, project_name: str, env_id: str):
                                 'type': 'output',
                                 'data': '\033[2J\033[H'
                             }))
+                            # Nothing before the clear should be replayed on reconnect
+                            session.scrollback.clear()
                             # Clear sessionId cache for Claude
                             try:
                                 from .services import project_service
-                                proj = project_service.get_project(decoded_project_name)
-                                if proj:
-                                    env = next((e for e in proj.get("environments", []) if e["id"] == env_id), None)
-                                    if env:
-                                        env["sessionId"] = None
-                                        project_service.update_project(decoded_project_name, proj)
-                                        print(f"Cleared sessionId cache for environment {env_id}")
+                                if project_service.update_environment_status(decoded_project_name, env_id, {"sessionId": None}):
+                                    print(f"Cleared sessionId cache for environment {env_id}")
                             except Exception as e:
                                 print(f"Failed to clear sessionId cache: {e}")
                             continue
                         
                         # Forward normal input to shell
                         try:
-                            if hasattr(shell_socket, 'sendall'):
-                                shell_socket.sendall(input_data.encode('utf-8'))
-                            elif hasattr(shell_socket, '_sock'):
-                                shell_socket._sock.sendall(input_data.encode('utf-8'))
-                            else:
-                                shell_socket.send(input_data.encode('utf-8'))
+                            await session.write(input_data.encode('utf-8'))
                         except Exception as send_error:
                             print(f"Error sending data to shell: {send_error}")
                             break
                     elif msg.get('type') == 'resize':
-                        docker_service.resize_shell(exec_id, msg['rows'], msg['cols'])
+                        await async_docker.resize_shell(session.exec_id, msg['rows'], msg['cols'])
                     elif msg.get('type') == 'ping':
                         await websocket.send_text(json.dumps({'type': 'pong', 'timestamp': time.time()}))
 
@@ -180,48 +197,32 @@ async def websocket_shell(websocket: WebSocket, project_name: str, env_id: str):
                     break
 
         async def forward_shell_to_client():
-            """Reads from the shell and sends to the client."""
-            loop = asyncio.get_running_loop()
+            """Sends coalesced shell output to the client until the session ends."""
             while True:
+                frame = await coalescer.next_frame()
+                if not frame:
+                    print("Shell session ended.")
+                    break
+                # Any output from the shell resets the activity timer
+                last_activity['time'] = time.time()
                 try:
-                    def read_from_socket():
-                        try:
-                            if hasattr(shell_socket, 'recv'):
-                                return shell_socket.recv(4096)
-                            elif hasattr(shell_socket, '_sock'):
-                                return shell_socket._sock.recv(4096)
-                            else:
-                                return shell_socket.read(4096)
-                        except (socket.timeout, BlockingIOError):
-                            return None # Non-blocking, so it's okay to get nothing
-                        except Exception as recv_error:
-                            print(f"Error reading from shell socket: {recv_error}")
-                            return None
-                    
-                    output = await asyncio.wait_for(
-                        loop.run_in_executor(None, read_from_socket),
-                        timeout=WEBSOCKET_TIMEOUT
-                    )
-
-                    if output:
-                        # Any output from the shell resets the activity timer
-                        last_activity['time'] = time.time()
-                        await websocket.send_text(output.decode('utf-8', errors='ignore'))
-                    else:
-                        # If read_from_socket returns None because of an error or clean close
-                        is_socket_closed = not hasattr(shell_socket, 'fileno') or shell_socket.fileno() == -1
-                        if is_socket_closed:
-                             print("No more output from shell, socket is closed.")
-                             break
-                except asyncio.TimeoutError:
-                    # This is normal if the shell has no output. Continue waiting.
-                    continue
+                    await encoder.send(websocket, frame)
                 except Exception as e:
                     print(f"Error in forward_shell_to_client: {e}")
                     break
 
         print("Starting to gather WebSocket communication tasks")
-        await asyncio.gather(forward_client_to_shell(), forward_shell_to_client())
+        # Whichever side ends first (client gone or shell session ended) tears down the other
+        tasks = [
+            asyncio.create_task(forward_client_to_shell()),
+            asyncio.create_task(forward_shell_to_client()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     except Exception as e:
         print(f"Error in WebSocket handler: {e}")
@@ -229,17 +230,330 @@ async def websocket_shell(websocket: WebSocket, project_name: str, env_id: str):
         traceback.print_exc()
         await websocket.send_text(f"[Error] {str(e)}\r\n")
     finally:
-        # Set the disconnected_at timestamp when the client disconnects
+        # Set the disconnected_at timestamp once the last client disconnects
         from .services import project_service
-        project_service.update_environment_status(
-            decoded_project_name, env_id, {"disconnected_at": time.time()}
-        )
-        print(f"Set disconnected_at timestamp for env {env_id}")
+        project_service.mark_disconnected(decoded_project_name, env_id)
+        print(f"Released connection for env {env_id}")
+        if session_stats is not None:
+            relay_stats.close(session_stats)
         
-        if shell_socket:
+        # The shell session itself stays alive so a reconnect can replay its scrollback
+        if session is not None and coalescer is not None:
+            session.detach(coalescer)
+            print("Detached from shell session")
+        print(f"Connection handler for {container_name} finished.")
+
+
+# --- Multiplexed Shell Endpoint ---
+#
+# One authenticated WebSocket carries any number of environment shells.
+# Client -> server (JSON text frames):
+#   {"type": "open", "channel": N, "project": P, "env": E}
+#   {"type": "input", "channel": N, "data": "..."}
+#   {"type": "resize", "channel": N, "rows": R, "cols": C}
+#   {"type": "close", "channel": N}
+#   {"type": "ping"}
+# Server -> client:
+#   binary frames: 4-byte big-endian channel id + output payload (see OutputEncoder;
+#   with ?compress=deflate each channel has its own deflate stream)
+#   JSON text frames: opened / closed / error (all with "channel"), pong, heartbeat
+# Channels open concurrently, each on its own task; a malformed message gets an
+# error frame (with its "channel" when it has one) and leaves the connection open.
+
+
+class InvalidMessage(Exception):
+    """A multiplexed message that can't be acted on; reported on its channel."""
+
+
+def _message_field(msg: Dict[str, Any], name: str, kind: type):
+    value = msg.get(name)
+    # bool is an int subclass, but never a valid channel or size
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise InvalidMessage(f"'{name}' must be {'an integer' if kind is int else 'a string'}.")
+    return value
+
+class MuxChannel:
+    """One environment shell attached to a multiplexed connection."""
+
+    def __init__(self, channel_id: int, project_name: str, env_id: str):
+        self.channel_id = channel_id
+        self.header = struct.pack('>I', channel_id)
+        self.project_name = project_name
+        self.env_id = env_id
+        self.session = None
+        self.coalescer = None
+        self.stats = None
+        self.task: Optional[asyncio.Task] = None
+        # Input and the latest size sent before the shell was ready, replayed in order
+        self.ready = False
+        self.pending_input: List[bytes] = []
+        self.pending_size: Optional[Tuple[int, int]] = None
+
+    def release(self):
+        from .services import project_service
+        if self.session is not None and self.coalescer is not None:
+            self.session.detach(self.coalescer)
+        if self.stats is not None:
+            relay_stats.close(self.stats)
+        project_service.mark_disconnected(self.project_name, self.env_id)
+
+
+@router.websocket("/ws/mux")
+async def websocket_mux(websocket: WebSocket):
+    await websocket.accept()
+
+    token = websocket.query_params.get("token")
+    if not token:
+        await websocket.send_text(json.dumps({'type': 'error', 'message': 'No token provided.'}))
+        await websocket.close()
+        return
+
+    # Authenticate once for every channel carried by this connection
+    from .auth import verify_token
+    try:
+        user = verify_token(token)
+        print(f"Multiplexed WebSocket authentication successful for user: {user.username}")
+    except Exception as e:
+        print(f"Authentication error: {e}")
+        await websocket.send_text(json.dumps({'type': 'error', 'message': 'Invalid token.'}))
+        await websocket.close()
+        return
+
+    compress_output = websocket.query_params.get("compress") == "deflate"
+    channels: Dict[int, MuxChannel] = {}
+    send_lock = asyncio.Lock()
+
+    async def send_control(message: Dict[str, Any]):
+        async with send_lock:
+            await websocket.send_text(json.dumps(message))
+
+    async def pump_output(channel: MuxChannel, encoder: OutputEncoder, replay: bytes):
+        """Replays the channel's scrollback, then streams its live output."""
+        async def send_frame(frame: bytes):
+            payload = encoder.encode(frame)
+            if payload:
+                async with send_lock:
+                    await websocket.send_bytes(channel.header + payload)
+
+        try:
+            if replay:
+                await send_frame(replay)
+            while True:
+                frame = await channel.coalescer.next_frame()
+                if not frame:
+                    break
+                await send_frame(frame)
+        except Exception as e:
+            print(f"Error forwarding output for channel {channel.channel_id}: {e}")
+        if channels.get(channel.channel_id) is channel:
+            del channels[channel.channel_id]
+            channel.release()
             try:
-                shell_socket.close()
-                print("Shell socket closed")
-            except Exception as e:
-                print(f"Error closing shell socket: {e}")
-        print(f"Connection handler for {container_name} finished.")
\ No newline at end of file
+                await send_control({'type': 'closed', 'channel': channel.channel_id, 'reason': 'Shell session ended.'})
+            except Exception:
+                pass
+
+    async def open_channel(channel: MuxChannel, env: Dict[str, Any]):
+        """Runs as the channel's task until the shell is attached, then hands over to pump_output.
+
+        A close (or the connection ending) cancels it; the wake and the
+        session setup are shielded so they finish for the next attach.
+        """
+        from .services import project_service
+        project_name, env_id, channel_id = channel.project_name, channel.env_id, channel.channel_id
+        ai_tool, container_name = container_for_environment(project_name, env_id, env)
+        attach_start = time.perf_counter()
+        timings: Dict[str, float] = {}
+        try:
+            wait_message = await asyncio.shield(wake_environment(project_name, env, timings))
+            if wait_message:
+                raise RuntimeError(wait_message)
+            env = project_service.get_environment(project_name, env_id) or env
+            reattached = session_manager.get(project_name, env_id) is not None
+            session_start = time.perf_counter()
+            channel.session = await asyncio.shield(
+                session_manager.get_or_create(project_name, env_id, container_name, ai_tool, timings)
+            )
+            timings["session"] = time.perf_counter() - session_start
+        except Exception as e:
+            if channels.get(channel_id) is channel:
+                del channels[channel_id]
+                channel.release()
+            try:
+                await send_control({'type': 'error', 'channel': channel_id, 'message': str(e)})
+            except Exception:
+                pass
+            return
+        channel.stats = relay_stats.open(f"{project_name}/{env_id}")
+        channel.coalescer, replay = channel.session.attach(channel.stats)
+        channel.stats.buffer = channel.coalescer
+        encoder = OutputEncoder("binary", compress=compress_output, stats=channel.stats)
+        await send_control({'type': 'opened', 'channel': channel_id, 'status': env.get("status")})
+        timings["total"] = time.perf_counter() - attach_start
+        attach_stats.record(f"{project_name}/{env_id}", timings, reattached)
+        channel.task = asyncio.create_task(pump_output(channel, encoder, replay))
+        try:
+            while channel.pending_size is not None or channel.pending_input:
+                if channel.pending_size is not None:
+                    size, channel.pending_size = channel.pending_size, None
+                    await async_docker.resize_shell(channel.session.exec_id, *size)
+                if channel.pending_input:
+                    await channel.session.write(channel.pending_input.pop(0))
+        except Exception as e:
+            print(f"Error replaying input for channel {channel_id}: {e}")
+            channel.pending_input = []
+        channel.ready = True
+
+    def start_channel(channel_id: int, project_name: str, env_id: str):
+        from .services import project_service
+        if channel_id in channels:
+            raise InvalidMessage("Channel already open.")
+        env = project_service.get_environment(project_name, env_id)
+        if env is None:
+            raise InvalidMessage(f"Environment '{env_id}' not found.")
+        channel = MuxChannel(channel_id, project_name, env_id)
+        channels[channel_id] = channel
+        project_service.mark_connected(project_name, env_id)
+        channel.task = asyncio.create_task(open_channel(channel, env))
+
+    def close_channel(channel_id: int):
+        channel = channels.pop(channel_id, None)
+        if channel is None:
+            return
+        if channel.task is not None:
+            channel.task.cancel()
+        channel.release()
+
+    last_activity = time.time()
+    try:
+        while True:
+            try:
+                raw_data = await asyncio.wait_for(websocket.receive_text(), timeout=WEBSOCKET_TIMEOUT)
+            except asyncio.TimeoutError:
+                if time.time() - last_activity > MAX_IDLE_TIME:
+                    print(f"Multiplexed WebSocket idle timeout after {MAX_IDLE_TIME} seconds of no input.")
+                    break
+                await send_control({'type': 'heartbeat', 'timestamp': time.time()})
+                continue
+            last_activity = time.time()
+
+            try:
+                msg = json.loads(raw_data)
+            except ValueError:
+                await send_control({'type': 'error', 'message': 'Message is not valid JSON.'})
+                continue
+            if not isinstance(msg, dict):
+                await send_control({'type': 'error', 'message': 'Message must be a JSON object.'})
+                continue
+            msg_type = msg.get('type')
+            if msg_type == 'ping':
+                await send_control({'type': 'pong', 'timestamp': time.time()})
+                continue
+            try:
+                channel_id = _message_field(msg, 'channel', int)
+                channel = channels.get(channel_id)
+                if msg_type == 'open':
+                    start_channel(channel_id, unquote(_message_field(msg, 'project', str)), _message_field(msg, 'env', str))
+                elif msg_type == 'close':
+                    close_channel(channel_id)
+                elif msg_type in ('input', 'resize'):
+                    if channel is None:
+                        continue  # Closed already; the client has been told
+                    if msg_type == 'input':
+                        data = _message_field(msg, 'data', str)
+                        if not channel.ready:
+                            channel.pending_input.append(data.encode('utf-8'))
+                            continue
+                        try:
+                            await channel.session.write(data.encode('utf-8'))
+                        except Exception as send_error:
+                            print(f"Error sending data to shell on channel {channel_id}: {send_error}")
+                            close_channel(channel_id)
+                            await send_control({'type': 'closed', 'channel': channel_id, 'reason': str(send_error)})
+                    else:
+                        rows, cols = _message_field(msg, 'rows', int), _message_field(msg, 'cols', int)
+                        if not channel.ready:
+                            channel.pending_size = (rows, cols)
+                            continue
+                        try:
+                            await async_docker.resize_shell(channel.session.exec_id, rows, cols)
+                        except Exception as e:
+                            raise InvalidMessage(f"Could not resize the shell: {e}")
+                else:
+                    raise InvalidMessage(f"Unknown message type '{msg_type}'.")
+            except InvalidMessage as e:
+                await send_control({'type': 'error', 'channel': msg.get('channel'), 'message': str(e)})
+    except WebSocketDisconnect:
+        print("Multiplexed WebSocket disconnected by client.")
+    except Exception as e:
+        print(f"Error in multiplexed WebSocket handler: {e}")
+    finally:
+        for channel_id in list(channels):
+            close_channel(channel_id)
+        print(f"Multiplexed connection for user {user.username} finished.")
+
+
+# --- Environment Status Stream ---
+#
+# Replaces polling GET .../status. On connect the server sends
+#   {"type": "snapshot", "environments": [{"project": P, "env": E, "status": S}, ...]}
+# followed by {"type": "status", "project": P, "env": E, "status": S} for every
+# change (status null means the environment was deleted). {"type": "overflow"}
+# means events were dropped and the client should re-fetch its data.
+
+@router.websocket("/ws/status")
+async def websocket_status(websocket: WebSocket):
+    await websocket.accept()
+
+    token = websocket.query_params.get("token")
+    from .auth import verify_token
+    try:
+        verify_token(token)
+    except Exception as e:
+        print(f"Status stream authentication error: {e}")
+        await websocket.send_text(json.dumps({'type': 'error', 'message': 'Invalid token.'}))
+        await websocket.close()
+        return
+
+    from .services import project_service
+    # Subscribe before taking the snapshot so no change can fall in between
+    queue = status_hub.subscribe()
+    try:
+        environments = [
+            {'project': project['name'], 'env': env['id'], 'status': env.get('status')}
+            for project in project_service.get_projects()
+            for env in project.get('environments', [])
+        ]
+        await websocket.send_text(json.dumps({'type': 'snapshot', 'environments': environments}))
+
+        async def send_events():
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = {'type': 'heartbeat', 'timestamp': time.time()}
+                await websocket.send_text(json.dumps(event))
+
+        async def receive_messages():
+            while True:
+                message = await websocket.receive_text()
+                try:
+                    if json.loads(message).get('type') == 'ping':
+                        await websocket.send_text(json.dumps({'type': 'pong', 'timestamp': time.time()}))
+                except (ValueError, AttributeError):
+                    pass
+
+        tasks = [asyncio.create_task(send_events()), asyncio.create_task(receive_messages())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            error = task.exception()
+            if error is not None and not isinstance(error, WebSocketDisconnect):
+                print(f"Status stream error: {error}")
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Status stream error: {e}")
+    finally:
+        status_hub.unsubscribe(queue)
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Drawer, List, ListItem, ListItemButton, ListItemText, Typography, Box, Button, IconButton } from '@mui/material';
 import { Add, Stop, Delete, PlayArrow } from '@mui/icons-material';
 import NewEnvironmentModal from './NewEnvironmentModal';
@@ -11,36 +11,63 @@ function DockerSidebar({ project, onEnvSelect, selectedEnvId, onDataChange }) {
   const [modalOpen, setModalOpen] = useState(false);
   const { token } = useAuth();
   
-  // Check environment status periodically for pending environments
+  // Read the latest data from the socket handlers without reconnecting on every refresh
+  const projectRef = useRef(project);
+  const onDataChangeRef = useRef(onDataChange);
+  projectRef.current = project;
+  onDataChangeRef.current = onDataChange;
+  const projectName = project?.name;
+
+  // Environment status changes (e.g. pending -> running) are pushed by the server
   useEffect(() => {
-    if (!project || !project.environments || project.environments.length === 0) return;
-    
-    const pendingEnvs = project.environments.filter(env => env.status === 'pending');
-    if (pendingEnvs.length === 0 || !token) return; // Don't check if no token
-    
-    const interval = setInterval(() => {
-      pendingEnvs.forEach(env => {
-        fetch(apiConfig.buildApiUrl(`/api/projects/${project.name}/environments/${env.id}/status`), {
-          headers: {
-            'Authorization': `Bearer ${token}`,
-          },
-        })
-        .then(res => res.json())
-        .then(data => {
-          if (data.status === 'running') {
-            // Update the environment status
+    if (!projectName || !token) return;
+
+    let ws = null;
+    let reconnectTimer = null;
+    let closed = false;
+
+    const connect = () => {
+      ws = new WebSocket(apiConfig.buildWsUrl(`/ws/status?token=${token}`));
+      ws.onmessage = (event) => {
+        let message;
+        try {
+          message = JSON.parse(event.data);
+        } catch (e) {
+          return;
+        }
+        const project = projectRef.current;
+        const onDataChange = onDataChangeRef.current;
+        if (message.type === 'overflow') {
+          onDataChange();
+        } else if (message.type === 'snapshot') {
+          // Catch up on anything that changed while we were not subscribed
+          const changed = message.environments.some(({ project: name, env: envId, status }) => {
+            if (name !== project.name) return false;
+            const env = (project.environments || []).find(e => e.id === envId);
+            return !env || env.status !== status;
+          });
+          if (changed) onDataChange();
+        } else if (message.type === 'status' && message.project === project.name) {
+          const env = (project.environments || []).find(e => e.id === message.env);
+          if (!env || env.status !== message.status) {
             onDataChange();
           }
-        })
-        .catch(err => {
-          console.error("Failed to check environment status:", err);
-          // Handle authentication or other errors appropriately
-        });
-      });
-    }, 5000); // Check every 5 seconds
-    
-    return () => clearInterval(interval);
-  }, [project, token, onDataChange]);
+        }
+      };
+      ws.onclose = () => {
+        if (!closed) {
+          reconnectTimer = setTimeout(connect, 5000);
+        }
+      };
+    };
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      ws?.close();
+    };
+  }, [projectName, token]);
 
   if (!project) {
     return null;
@@ -156,7 +183,7 @@ function DockerSidebar({ project, onEnvSelect, selectedEnvId, onDataChange }) {
                   primary={env.id} 
                   primaryTypographyProps={{ style: { color: 'white' } }}
                   secondary={`Status: ${env.status}`}
-                  secondaryTypographyProps={{ style: { color: env.status === 'running' ? '#4caf50' : env.status === 'pending' ? '#ff9800' : 'gray' } }}
+                  secondaryTypographyProps={{ style: { color: env.status === 'running' ? '#4caf50' : env.status === 'pending' ? '#ff9800' : env.status === 'queued' ? '#2196f3' : 'gray' } }}
                 />
               </ListItemButton>
             </ListItem>
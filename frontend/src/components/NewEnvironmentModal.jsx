@@ -31,6 +31,8 @@ function NewEnvironmentModal({ open, handleClose, project, onCreated }) {
   const [isLoadingBranches, setIsLoadingBranches] = useState(false);
   const [aiTool, setAiTool] = useState('gemini'); // "gemini" or "claude"
   const [geminiUseGoogleLogin, setGeminiUseGoogleLogin] = useState(false); // Whether to use Google login for Gemini
+  const [resourceProfile, setResourceProfile] = useState('');
+  const [resourceProfiles, setResourceProfiles] = useState({});
   const { token } = useAuth(); // Get the auth token
 
   useEffect(() => {
@@ -51,6 +53,17 @@ function NewEnvironmentModal({ open, handleClose, project, onCreated }) {
         .then(res => res.json())
         .then(data => setImages(data))
         .catch(err => console.error("Failed to fetch images:", err));
+
+      // Resource profiles (memory / CPU / pids limits) and the server's default
+      fetch(apiConfig.buildApiUrl('/api/admission'), {
+        headers: { 'Authorization': `Bearer ${token}` }
+      })
+        .then(res => res.json())
+        .then(data => {
+          setResourceProfiles(data.profiles || {});
+          setResourceProfile(data.default_profile || '');
+        })
+        .catch(err => console.error("Failed to fetch resource profiles:", err));
     }
   }, [open, token]);
 
@@ -124,7 +137,8 @@ function NewEnvironmentModal({ open, handleClose, project, onCreated }) {
       branch_mode: branchMode,
       existing_branch: branchMode === 'existing' ? existingBranch : null,
       ai_tool: aiTool,
-      gemini_use_google_login: aiTool === 'gemini' ? geminiUseGoogleLogin : false
+      gemini_use_google_login: aiTool === 'gemini' ? geminiUseGoogleLogin : false,
+      resource_profile: resourceProfile || null
     };
 
     // Create environment with auth
@@ -143,7 +157,10 @@ function NewEnvironmentModal({ open, handleClose, project, onCreated }) {
       }
       return res.json();
     })
-    .then(() => {
+    .then(env => {
+      if (env.status === 'queued') {
+        alert(`The host is at capacity. "${env.id}" is queued at position ${env.queue_position} and will be created when resources free up.`);
+      }
       onCreated();
       handleClose();
     })
@@ -164,6 +181,17 @@ function NewEnvironmentModal({ open, handleClose, project, onCreated }) {
           </Select>
         </FormControl>
         
+        <FormControl fullWidth margin="normal">
+          <InputLabel>Resources</InputLabel>
+          <Select value={resourceProfile} label="Resources" onChange={(e) => setResourceProfile(e.target.value)}>
+            {Object.entries(resourceProfiles).map(([name, profile]) => (
+              <MenuItem key={name} value={name}>
+                {`${name} (${profile.memory_mb} MB, ${profile.cpus} CPU)`}
+              </MenuItem>
+            ))}
+          </Select>
+        </FormControl>
+        
         <FormControl component="fieldset" margin="normal">
           <RadioGroup row value={branchMode} onChange={(e) => setBranchMode(e.target.value)}>
             <FormControlLabel value="new" control={<Radio />} label="Create new branch" />
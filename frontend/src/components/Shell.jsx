@@ -3,7 +3,7 @@ import { Terminal } from '@xterm/xterm';
 import { FitAddon } from '@xterm/addon-fit';
 import '@xterm/xterm/css/xterm.css';
 import { useAuth } from '../context/AuthContext';
-import apiConfig from '../config/api';
+import shellMux from '../utils/ShellMux';
 
 // This is a simplified and robust implementation inspired by the reference project.
 function Shell({ projectName, dockerId }) {
@@ -42,41 +42,23 @@ function Shell({ projectName, dockerId }) {
       return;
     }
     
-    const wsUrl = apiConfig.buildWsUrl(`/ws/shell/${projectName}/${dockerId}?token=${token}`);
-    const ws = new WebSocket(wsUrl);
+    // All open shells share one multiplexed WebSocket; this terminal is one channel on it
+    const channel = shellMux.openChannel(projectName, dockerId, token, {
+      onOutput: (bytes) => term.write(bytes),
+      onStatus: (text) => term.write(text),
+      // Reattaching replays the session's scrollback, so start from a clean screen
+      onReset: () => term.reset(),
+      onOpen: () => fitAndResize(),
+    });
 
-    const sendJson = (data) => {
-      if (ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify(data));
-      }
-    };
-    
     const fitAndResize = () => {
         fitAddon.fit();
-        sendJson({ type: 'resize', cols: term.cols, rows: term.rows });
-    };
-
-    ws.onopen = () => {
-      fitAndResize();
-    };
-
-    ws.onmessage = (event) => {
-      // The backend now sends raw strings, not JSON
-      term.write(event.data);
-    };
-
-    ws.onerror = (error) => {
-        term.write("\r\n[WebSocket Error] See browser console for details.\r\n");
-        console.error("WebSocket Error:", error);
-    };
-
-    ws.onclose = (event) => {
-      term.write(`\r\n[Connection Closed] Code: ${event.code}\r\n`);
+        channel.resize(term.rows, term.cols);
     };
 
     // The core logic: send all terminal data wrapped in a simple JSON object.
     term.onData((data) => {
-      sendJson({ type: 'input', data: data });
+      channel.sendInput(data);
     });
     
     const resizeObserver = new ResizeObserver(fitAndResize);
@@ -86,7 +68,7 @@ function Shell({ projectName, dockerId }) {
 
     return () => {
       resizeObserver.disconnect();
-      ws.close();
+      channel.close();
       term.dispose();
       isInitialized.current = false;
     };
@@ -0,0 +1,68 @@
+// Decodes compressed terminal output frames from the shell WebSocket.
+//
+// Frame layout (binary frames, negotiated with `compress=deflate`):
+//   0x00 <raw output bytes>
+//   0x01 <uint32 big-endian uncompressed length> <sync-flushed raw-deflate chunk>
+// All 0x01 chunks belong to one deflate stream that lives as long as the
+// connection, so they must be inflated in order through a single decompressor.
+
+export const supportsInflate = typeof DecompressionStream !== 'undefined';
+
+class OutputInflater {
+  constructor(onOutput) {
+    this.onOutput = onOutput;
+    this.chain = Promise.resolve();
+    this.leftover = new Uint8Array(0);
+    const stream = new DecompressionStream('deflate-raw');
+    this.writer = stream.writable.getWriter();
+    this.reader = stream.readable.getReader();
+  }
+
+  // Queues a binary frame; output is delivered strictly in arrival order.
+  push(buffer) {
+    const bytes = new Uint8Array(buffer);
+    if (bytes[0] === 0x00) {
+      const payload = bytes.subarray(1);
+      this.chain = this.chain.then(() => this.onOutput(payload));
+      return;
+    }
+    const length = new DataView(bytes.buffer, bytes.byteOffset + 1, 4).getUint32(0);
+    const payload = bytes.subarray(5);
+    this.chain = this.chain
+      .then(() => {
+        this.writer.write(payload);
+        return this.readExactly(length);
+      })
+      .then((output) => this.onOutput(output))
+      .catch((error) => console.error('Failed to inflate terminal output:', error));
+  }
+
+  async readExactly(length) {
+    const chunks = [];
+    let received = 0;
+    if (this.leftover.length) {
+      chunks.push(this.leftover);
+      received = this.leftover.length;
+    }
+    while (received < length) {
+      const { value, done } = await this.reader.read();
+      if (done) break;
+      chunks.push(value);
+      received += value.length;
+    }
+    const output = new Uint8Array(received);
+    let offset = 0;
+    for (const chunk of chunks) {
+      output.set(chunk, offset);
+      offset += chunk.length;
+    }
+    this.leftover = output.subarray(length);
+    return output.subarray(0, length);
+  }
+
+  close() {
+    this.writer.close().catch(() => {});
+  }
+}
+
+export default OutputInflater;
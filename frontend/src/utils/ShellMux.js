@@ -0,0 +1,136 @@
+import apiConfig from '../config/api';
+import OutputInflater, { supportsInflate } from './OutputInflater';
+
+// One WebSocket (`/ws/mux`) carrying the shells of every open environment.
+// Each environment gets a numbered channel; output arrives as binary frames
+// prefixed with the 4-byte channel id, control messages as JSON text frames.
+class ShellMux {
+  constructor() {
+    this.ws = null;
+    this.token = null;
+    this.channels = new Map(); // channelId -> channel
+    this.nextChannelId = 1;
+    this.reconnectDelay = 2000;
+    this.reconnectTimer = null;
+  }
+
+  openChannel(projectName, envId, token, handlers) {
+    const channel = {
+      id: this.nextChannelId++,
+      projectName,
+      envId,
+      handlers,
+      inflater: null,
+      attached: false,
+      sendInput: (data) => this.send({ type: 'input', channel: channel.id, data }),
+      resize: (rows, cols) => this.send({ type: 'resize', channel: channel.id, rows, cols }),
+      close: () => this.closeChannel(channel.id),
+    };
+    this.channels.set(channel.id, channel);
+    this.ensureConnected(token);
+    if (this.ws.readyState === WebSocket.OPEN) {
+      this.sendOpen(channel);
+    }
+    return channel;
+  }
+
+  closeChannel(channelId) {
+    const channel = this.channels.get(channelId);
+    if (!channel) return;
+    this.channels.delete(channelId);
+    channel.inflater?.close();
+    this.send({ type: 'close', channel: channelId });
+    // Drop the socket once nothing uses it any more
+    if (this.channels.size === 0 && this.ws) {
+      clearTimeout(this.reconnectTimer);
+      this.ws.close(1000);
+      this.ws = null;
+    }
+  }
+
+  ensureConnected(token) {
+    if (this.ws && this.token === token && this.ws.readyState <= WebSocket.OPEN) {
+      return;
+    }
+    if (this.ws) {
+      this.ws.onclose = null;
+      this.ws.close(1000);
+    }
+    this.token = token;
+    const compressParam = supportsInflate ? '&compress=deflate' : '';
+    const ws = new WebSocket(apiConfig.buildWsUrl(`/ws/mux?token=${token}${compressParam}`));
+    ws.binaryType = 'arraybuffer';
+    this.ws = ws;
+
+    ws.onopen = () => {
+      for (const channel of this.channels.values()) {
+        this.sendOpen(channel);
+      }
+    };
+
+    ws.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        const channelId = new DataView(event.data, 0, 4).getUint32(0);
+        const channel = this.channels.get(channelId);
+        if (!channel) return;
+        const payload = event.data.slice(4);
+        if (channel.inflater) {
+          channel.inflater.push(payload);
+        } else {
+          channel.handlers.onOutput(new Uint8Array(payload));
+        }
+        return;
+      }
+      let message;
+      try {
+        message = JSON.parse(event.data);
+      } catch (e) {
+        return;
+      }
+      const channel = this.channels.get(message.channel);
+      if (message.type === 'opened' && channel) {
+        channel.handlers.onOpen?.(message);
+      } else if ((message.type === 'closed' || message.type === 'error') && channel) {
+        channel.handlers.onStatus?.(`\r\n[${message.type === 'error' ? 'Error' : 'Connection Closed'}] ${message.reason || message.message}\r\n`);
+      } else if (message.type === 'error') {
+        console.error('Shell multiplexer error:', message.message);
+      }
+    };
+
+    ws.onerror = (error) => {
+      console.error('Shell multiplexer WebSocket error:', error);
+    };
+
+    ws.onclose = (event) => {
+      if (this.ws !== ws) return;
+      this.ws = null;
+      for (const channel of this.channels.values()) {
+        channel.handlers.onStatus?.(`\r\n[Connection Closed] Code: ${event.code}\r\n`);
+      }
+      // Reattach every open channel; the server replays each shell's recent output
+      if (this.channels.size > 0) {
+        this.reconnectTimer = setTimeout(() => this.ensureConnected(this.token), this.reconnectDelay);
+      }
+    };
+  }
+
+  sendOpen(channel) {
+    channel.inflater?.close();
+    // Every open starts a fresh deflate stream on the server
+    channel.inflater = supportsInflate ? new OutputInflater(channel.handlers.onOutput) : null;
+    if (channel.attached) {
+      channel.handlers.onReset?.();
+    }
+    channel.attached = true;
+    this.send({ type: 'open', channel: channel.id, project: channel.projectName, env: channel.envId });
+  }
+
+  send(message) {
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+      this.ws.send(JSON.stringify(message));
+    }
+  }
+}
+
+// Export singleton instance
+export default new ShellMux();